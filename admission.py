@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+
+from metrics import Counter, Gauge, Histogram
+
+# Cost class of the Dash callbacks, by the id of their (first) output. Callbacks not listed are "medium".
+# "cheap" is not limited, it is only for callbacks answered from memory or local files, never from an upstream API.
+CALLBACK_COSTS = {
+    "my-div": "cheap",              # show_hide_div (home page)
+    "dropdown-id": "medium",        # Zürich endpoint list (upstream API when the cached list expired)
+    "graph-content-wind": "cheap",
+    "graph-content-2": "cheap",     # population
+    "graph-content-ev": "medium",
+    "graph-content-data": "medium",  # mobile antennas
+    "graph-content-ant": "medium",
+    "graph-content-1": "medium",    # Zürich POIs (upstream API)
+    "graph-content": "medium",      # Overpass POIs (upstream API, long queries run as jobs)
+    "graph-content-3": "heavy",     # POI density (spatial join with the boundaries)
+    "graph-content-5": "heavy",     # 3D map (surface interpolation)
+    "graph-content-land": "heavy",  # landscape types
+}
+DEFAULT_COST = "medium"
+
+
+def class_limits(name, default):
+    # "concurrency,queue size,max wait in seconds" from ADMISSION_<CLASS>, concurrency 0 means unlimited
+    concurrency, queue_size, max_wait = os.getenv(f"ADMISSION_{name.upper()}", default).split(",")
+    return int(concurrency), int(queue_size), float(max_wait)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, cost_class, reason, retry_after):
+        super().__init__(f"Too many {cost_class} requests ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CostClass:
+    """
+    Concurrency limit of a cost class with a bounded queue: a request waits for a free slot at most max_wait seconds,
+    it is rejected right away when queue_size requests are already waiting.
+    Requests wait on the event loop, not in a worker thread, so waiting heavy requests never take the threads of the
+    cheap ones.
+    """
+
+    def __init__(self, name, concurrency, queue_size, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.waiting = 0
+        self.running = 0
+
+    async def acquire(self):
+        if self.semaphore is not None:
+            if self.semaphore.locked():
+                if self.waiting >= self.queue_size:
+                    raise AdmissionRejected(self.name, "queue_full", max(1, round(self.max_wait)))
+                start = time.perf_counter()
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self.semaphore.acquire(), self.max_wait)
+                except asyncio.TimeoutError:
+                    raise AdmissionRejected(self.name, "timeout", max(1, round(self.max_wait)))
+                finally:
+                    self.waiting -= 1
+                    admission_wait.observe(time.perf_counter() - start, self.name)
+            else:
+                await self.semaphore.acquire()
+        self.running += 1
+
+    def release(self):
+        self.running -= 1
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+
+class AdmissionController:
+    def __init__(self):
+        self.classes = {
+            "cheap": CostClass("cheap", *class_limits("cheap", "0,0,0")),
+            "medium": CostClass("medium", *class_limits("medium", "8,32,10")),
+            # the heavy callbacks share the task pool, more of them at a time would only queue there
+            "heavy": CostClass("heavy", *class_limits("heavy", f"{max(2, os.cpu_count() or 1)},8,5")),
+        }
+
+    def cost_class(self, output):
+        # output of a Dash request: "graph-content.figure" or "..graph-content.figure...osm-job.data.." (several)
+        component_id = output.lstrip(".").split(".")[0]
+        if component_id.endswith("-search"):
+            # search box suggestions of the map pages (see dash_map_search), answered from the in-memory index
+            return self.classes["cheap"]
+        return self.classes[CALLBACK_COSTS.get(component_id, DEFAULT_COST)]
+
+    async def acquire(self, output):
+        """Waits for a slot of the cost class of the callback, raises AdmissionRejected when there is none."""
+        cost_class = self.cost_class(output)
+        try:
+            await cost_class.acquire()
+        except AdmissionRejected as e:
+            admission_rejections.inc(cost_class.name, e.reason)
+            raise
+        return cost_class
+
+
+admission_wait = Histogram("admission_wait_seconds", "Time a callback request waited for a slot of its cost class.",
+                           ("cost_class",))
+admission_rejections = Counter("admission_rejections_total", "Callback requests rejected by the admission control.",
+                               ("cost_class", "reason"))
+
+admission = AdmissionController()
+
+Gauge("admission_queue_depth", "Callback requests waiting for a slot of their cost class.", ("cost_class",),
+      lambda: {(name, ): c.waiting for name, c in admission.classes.items()})
+Gauge("admission_in_flight", "Callback requests running per cost class.", ("cost_class",),
+      lambda: {(name, ): c.running for name, c in admission.classes.items()})
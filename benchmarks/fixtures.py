@@ -0,0 +1,234 @@
+"""
+Fixture datasets and local stand-ins for the upstream APIs (Overpass, EV feeds, Zürich Tourism API).
+Used by the benchmark suite and the load test so that results do not depend on the network
+or on the pre-processed files that are not part of the repository.
+"""
+import os
+import shutil
+import zlib
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import requests
+from shapely.geometry import Polygon
+
+from string_decode import decode_string
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHAPE_DIR = os.path.join(REPO_DIR, "static", "Grenzen.shp")
+
+# Bounding box of Switzerland (WGS84)
+LON_MIN, LON_MAX = 5.96, 10.49
+LAT_MIN, LAT_MAX = 45.82, 47.81
+
+SEED = 42
+
+EV_STATUSES = ["Available", "Occupied", "OutOfService", "Unknown"]
+EV_PLUGS = ["Type 2 Outlet", "CCS Combo 2 Plug (Cable Attached)", "CHAdeMO", "Type 2 Connector (Cable Attached)",
+            "Type J Swiss Standard", "Type F Schuko"]
+MOBILE_TECHNOLOGIES = ["3G", "4G", "5G", "3G, 4G", "4G, 5G", "3G, 4G, 5G", "2G, 3G, 4G, 5G"]
+MOBILE_TYPES = ["Mobilfunkanlage", "Mobilfunkanlage (bewilligt)", "Kleinzelle"]
+MOBILE_POWER = ["Leistungsklasse : sehr klein (bis 6 W)", "Leistungsklasse : klein (bis 500 W)",
+                "Leistungsklasse : mittel (bis 5'000 W)", "Leistungsklasse : gross (über 5'000 W)"]
+MOBILE_POWER_CODES = [2, 3, 5, 10]
+
+ZUERI_ENDPOINTS = {"101": "Restaurants", "102": "Bars", "103": "Hotels", "104": "Museen", "105": "Parks",
+                   "106": "Shopping"}
+
+
+def _altitude(lon, lat):
+    # Smooth synthetic relief, higher in the south (Alps) and lower in the north (Mittelland)
+    return 400 + 2500 * (1 - (lat - LAT_MIN) / (LAT_MAX - LAT_MIN)) * (1 + np.sin(lon * 3) * np.cos(lat * 5)) / 2
+
+
+def _grid_polygons(count, rng, vertices_per_side=10):
+    # Splits the bounding box into a grid of at least `count` cells and returns `count` polygons with Z values
+    cols = int(np.ceil(np.sqrt(count * (LON_MAX - LON_MIN) / (LAT_MAX - LAT_MIN))))
+    rows = int(np.ceil(count / cols))
+    dx = (LON_MAX - LON_MIN) / cols
+    dy = (LAT_MAX - LAT_MIN) / rows
+    polygons = []
+    for i in range(count):
+        x0 = LON_MIN + (i % cols) * dx
+        y0 = LAT_MIN + (i // cols) * dy
+        t = np.linspace(0, 1, vertices_per_side, endpoint=False)
+        xs = np.concatenate([x0 + t * dx, np.full_like(t, x0 + dx), x0 + dx - t * dx, np.full_like(t, x0)])
+        ys = np.concatenate([np.full_like(t, y0), y0 + t * dy, np.full_like(t, y0 + dy), y0 + dy - t * dy])
+        # jitter the boundary a little so that the shapes are not perfect rectangles
+        xs = xs + rng.normal(0, dx * 0.01, len(xs))
+        ys = ys + rng.normal(0, dy * 0.01, len(ys))
+        polygons.append(Polygon(zip(xs, ys, _altitude(xs, ys))))
+    return polygons
+
+
+def build_boundaries(level, rng):
+    # Real attribute tables from the swissBOUNDARIES3D dbf files with synthetic geometries
+    dbf, area_column = {"kan": ("KANTONSGEBIET", "KANTONSFLA"),
+                        "bez": ("BEZIRKSGEBIET", "BEZIRKSFLA"),
+                        "gem": ("HOHEITSGEBIET", "GEM_FLAECH")}[level]
+    df = gpd.read_file(os.path.join(SHAPE_DIR, f"swissBOUNDARIES3D_1_5_TLM_{dbf}.dbf"))
+    df = pd.DataFrame(df.drop(columns="geometry", errors="ignore"))
+    if level == "gem":
+        df["GEMEINDEFLA"] = df[area_column]
+        area_column = "GEMEINDEFLA"
+    df["NAME"] = df["NAME"].apply(decode_string)
+    df["EINWOHNERZ"] = df["EINWOHNERZ"].fillna(0)
+    df["DICHTE"] = df["EINWOHNERZ"] / df[area_column].replace(0, np.nan).fillna(1) * 100
+    return gpd.GeoDataFrame(df, geometry=_grid_polygons(len(df), rng), crs="EPSG:4326")
+
+
+def build_mobile_antennas(rng, count=20000):
+    lons = rng.uniform(LON_MIN, LON_MAX, count)
+    lats = rng.uniform(LAT_MIN, LAT_MAX, count)
+    power = rng.integers(0, len(MOBILE_POWER), count)
+    return gpd.GeoDataFrame({
+        "typ_de": np.array(MOBILE_TYPES)[rng.integers(0, len(MOBILE_TYPES), count)],
+        "techno_de": np.array(MOBILE_TECHNOLOGIES)[rng.integers(0, len(MOBILE_TECHNOLOGIES), count)],
+        "power_de": np.array(MOBILE_POWER)[power],
+        "power_code": np.array(MOBILE_POWER_CODES)[power],
+    }, geometry=gpd.points_from_xy(lons, lats), crs="EPSG:4326")
+
+
+def build_workspace(path):
+    """
+    Creates a working directory with a static/ folder containing all datasets the pages read and an empty temp/
+    folder. Real files from the repository are copied where available, the others are generated deterministically.
+    """
+    rng = np.random.default_rng(SEED)
+    static_dir = os.path.join(path, "static")
+    os.makedirs(static_dir, exist_ok=True)
+    os.makedirs(os.path.join(path, "temp"), exist_ok=True)
+
+    for filename in ["ant_gdf.json", "antennenstandorte-5g_de.json", "landschaft.gpkg", "wind-turb.csv"]:
+        shutil.copy(os.path.join(REPO_DIR, "static", filename), static_dir)
+    shutil.copytree(SHAPE_DIR, os.path.join(static_dir, "Grenzen.shp"), dirs_exist_ok=True)
+
+    for level in ["kan", "bez", "gem"]:
+        build_boundaries(level, rng).to_file(os.path.join(static_dir, f"gdf_{level}.json"), driver="GeoJSON")
+    build_mobile_antennas(rng).to_file(os.path.join(static_dir, "mobilfunk.json"), driver="GeoJSON")
+    return path
+
+
+# --- Upstream stand-ins ---
+
+def _seeded_rng(*key):
+    # Deterministic random generator per request key, so repeated requests return identical data
+    return np.random.default_rng(zlib.crc32("/".join(str(k) for k in key).encode()))
+
+
+def fake_ev_stations(count=8000):
+    rng = _seeded_rng("ev", count)
+    records = []
+    for i in range(count):
+        lat = rng.uniform(LAT_MIN, LAT_MAX)
+        lon = rng.uniform(LON_MIN, LON_MAX)
+        plugs = list(rng.choice(EV_PLUGS, size=rng.integers(1, 3), replace=False))
+        records.append({
+            "EvseID": f"CH*FIX*E{i:06d}",
+            "GeoCoordinates": {"Google": f"{lat} {lon}"},
+            "Plugs": plugs,
+            "ChargingStationNames": [{"lang": "de", "value": f"Station {i}"}],
+        })
+    return {"EVSEData": [{"EVSEDataRecord": records}]}
+
+
+def fake_ev_statuses(count=8000):
+    rng = _seeded_rng("ev-status", count)
+    statuses = rng.choice(EV_STATUSES, size=count, p=[0.6, 0.2, 0.05, 0.15])
+    records = [{"EvseID": f"CH*FIX*E{i:06d}", "EVSEStatus": status} for i, status in enumerate(statuses)]
+    return {"EVSEStatuses": [{"EVSEStatusRecord": records}]}
+
+
+def fake_zueri_endpoints():
+    return [{"id": api_id, "name": {"de": name, "en": name}} for api_id, name in ZUERI_ENDPOINTS.items()]
+
+
+def fake_zueri_data(api_id, count=400):
+    rng = _seeded_rng("zueri", api_id)
+    # Roughly a third of the POIs are shared with the next endpoint (e.g. a restaurant that is also a bar)
+    offset = (int(api_id) - 101) * count * 2 // 3
+    items = []
+    for i in range(offset, offset + count):
+        poi_rng = _seeded_rng("zueri-poi", i)
+        items.append({
+            "identifier": f"poi-{i}",
+            "name": {"de": f"POI {i}", "en": f"POI {i}"},
+            "geoCoordinates": {"latitude": 47.37 + poi_rng.normal(0, 0.02),
+                               "longitude": 8.53 + poi_rng.normal(0, 0.03)},
+            "address": {"url": f"https://example.com/poi/{i}"},
+        })
+    # a few entries without coordinates, as in the real API
+    items.extend({"name": {"de": f"No coordinates {i}"}} for i in range(int(rng.integers(1, 5))))
+    return items
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+
+def fake_requests_get(url, *args, **kwargs):
+    if "ladestellen-elektromobilitaet/data" in url:
+        return FakeResponse(fake_ev_stations())
+    if "ladestellen-elektromobilitaet/status" in url:
+        return FakeResponse(fake_ev_statuses())
+    if "zuerich.com" in url:
+        if "?id=" in url:
+            return FakeResponse(fake_zueri_data(url.split("?id=")[1]))
+        return FakeResponse(fake_zueri_endpoints())
+    raise requests.ConnectionError(f"No stand-in for upstream URL {url}")
+
+
+class FakeNode:
+    def __init__(self, node_id, lat, lon, tags):
+        self.id = node_id
+        self.lat = lat
+        self.lon = lon
+        self.tags = tags
+
+
+class FakeOverpassResult:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+
+def fake_overpass_nodes(country_iso_a2, tag_key, tag_value):
+    rng = _seeded_rng("overpass", country_iso_a2, tag_key, tag_value)
+    count = int(rng.integers(200, 5000))
+    # Swiss bounding box for CH, a shifted box of the same size for the other countries
+    shift = 0 if country_iso_a2 == "CH" else (zlib.crc32(country_iso_a2.encode()) % 20) - 10
+    lats = rng.uniform(LAT_MIN, LAT_MAX, count) + shift
+    lons = rng.uniform(LON_MIN, LON_MAX, count) + shift / 2
+    nodes = []
+    for i in range(count):
+        tags = {tag_key: tag_value, "name": f"{tag_value} {i}"}
+        if i % 3 == 0:
+            tags["website"] = f"https://example.com/{country_iso_a2}/{tag_value}/{i}"
+        node_id = zlib.crc32(f"{country_iso_a2}/{tag_key}/{tag_value}".encode()) * 100000 + i
+        nodes.append(FakeNode(node_id, lats[i], lons[i], tags))
+    return nodes
+
+
+def fake_overpass_query(self, query):
+    # Parses the values back out of the query built by data_loader_overpy.query_overpass
+    country = query.split('"ISO3166-1"="')[1].split('"')[0]
+    tag_key, tag_value = query.split("node[")[1].split("]")[0].split("=")
+    nodes = fake_overpass_nodes(country, tag_key, tag_value)
+    if "(newer:" in query:
+        # incremental query: about 1% of the nodes changed since the snapshot
+        nodes = nodes[::100]
+        for node in nodes:
+            node.tags["name"] += " (updated)"
+    return FakeOverpassResult(nodes)
+
+
+def install_upstream_stand_ins():
+    """Replaces the upstream APIs used by the loaders with the local stand-ins (for the current process)."""
+    import overpy
+    requests.get = fake_requests_get
+    overpy.Overpass.query = fake_overpass_query
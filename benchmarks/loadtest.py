@@ -0,0 +1,227 @@
+"""
+Concurrent load test replaying /_dash-update-component POST mixes against the FastAPI app from main.py.
+
+By default the app is started in a separate uvicorn process inside a fixture workspace with the upstream APIs replaced
+by local stand-ins (see benchmarks/fixtures.py). Use --url to target an already running server instead.
+Reports throughput, p50/p95/p99 latency and error rate per callback for each concurrency level.
+
+    python -m benchmarks.loadtest --concurrency 1,4,16,64 --duration 20
+    python -m benchmarks.loadtest --uvicorn-workers 4 --mix home=5,population=1
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --concurrency 8
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fixtures import REPO_DIR, ZUERI_ENDPOINTS, build_workspace, install_upstream_stand_ins
+
+DASH_UPDATE_PATH = "/_dash-update-component"
+
+TAG_VALUES = ["restaurant", "bank", "bar", "fuel", "fast_food", "atm", "hospital", "pharmacy", "library", "books",
+              "park", "station", "alcohol", "bakery", "bicycle", "post_office"]
+SHAPES = ["-", "Kantone", "Bezirke", "Gemeinden"]
+# relayoutData of the scatter maps: initial view or zoomed in on Zürich
+VIEWPORTS = [None, {"mapbox.zoom": 14, "mapbox.center": {"lon": 8.54, "lat": 47.37},
+                    "mapbox._derived": {"coordinates": [[8.50, 47.39], [8.58, 47.39], [8.58, 47.35], [8.50, 47.35]]}}]
+
+
+def dash_request(outputs, inputs, state=()):
+    """
+    Builds the JSON body the Dash renderer posts for a callback.
+    outputs: [(id, prop)], inputs and state: [(id, prop, value)]
+    """
+    if len(outputs) == 1:
+        output = f"{outputs[0][0]}.{outputs[0][1]}"
+        outputs_json = {"id": outputs[0][0], "property": outputs[0][1]}
+    else:
+        output = ".." + "...".join(f"{i}.{p}" for i, p in outputs) + ".."
+        outputs_json = [{"id": i, "property": p} for i, p in outputs]
+    return {
+        "output": output,
+        "outputs": outputs_json,
+        "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+        "changedPropIds": [f"{i}.{p}" for i, p, _ in inputs[:1]],
+        "state": [{"id": i, "property": p, "value": v} for i, p, v in state],
+    }
+
+
+# Callback name -> (default weight, request body builder), weights approximate the page popularity
+CALLBACKS = {
+    "home": (30, lambda: dash_request([("my-div", "style")], [("url", "pathname", random.choice(["/", "/ev", "/swiss"]))])),
+    "population": (15, lambda: dash_request([("graph-content-2", "figure")],
+                                            [("dropdown-shape", "value", random.choice(SHAPES[1:])),
+                                             ("dropdown-pop", "value", random.choice(["Population", "Area", "Density"]))])),
+    "ev": (15, lambda: dash_request([("graph-content-ev", "figure"), ("my-data-table", "data")],
+                                    [("my-data-table", "active_cell",
+                                      random.choice([None, {"row": random.randrange(5), "column": 0}])),
+                                     ("graph-content-ev", "relayoutData", random.choice(VIEWPORTS)),
+                                     ("dropdown-plug", "value", random.choice([[], ["CCS"], ["Type 2", "CHAdeMO"]]))])),
+    "zueri": (8, lambda: dash_request([("graph-content-1", "figure")],
+                                      [("dropdown-id", "value", random.sample(list(ZUERI_ENDPOINTS), random.randint(1, 3)))])),
+    "osm": (8, lambda: dash_request([("graph-content", "figure"), ("osm-job", "data"), ("osm-interval", "disabled")],
+                                    [("dropdown-value", "value", random.sample(TAG_VALUES, random.randint(1, 2))),
+                                     ("dropdown-country", "value",
+                                      random.sample(["CH", "DE", "AT", "FR", "IT"], random.randint(1, 3))),
+                                     ("osm-interval", "n_intervals", None)],
+                                    [("osm-job", "data", None)])),
+    "density": (6, lambda: dash_request([("graph-content-3", "figure")],
+                                        [("dropdown-value", "value", random.choice(TAG_VALUES)),
+                                         ("dropdown-shape", "value", random.choice(SHAPES))])),
+    "antenna": (6, lambda: dash_request([("graph-content-ant", "figure")],
+                                        [("layer-toggle", "value", ["5G"]),
+                                         ("dropdown-shape", "value", random.choice(SHAPES)),
+                                         ("dropdown-coverage", "value",
+                                          random.choice(["Pop. density", "Antennas per km²", "Power per km²"]))])),
+    "mobile": (5, lambda: dash_request([("graph-content-data", "figure")],
+                                       [("dropdown-data", "value", ""),
+                                        ("graph-content-data", "relayoutData", random.choice(VIEWPORTS))])),
+    "map3d": (4, lambda: dash_request([("graph-content-5", "figure")],
+                                      [("dropdown-method", "value", random.choice(["linear", "cubic", "nearest"]))])),
+    "wind": (2, lambda: dash_request([("graph-content-wind", "figure")],
+                                     [("dropdown-wind", "value", random.choice(["All", "Normalbetrieb", "Stillgelegt"]))])),
+    "land": (3, lambda: dash_request([("graph-content-land", "figure")],
+                                     [("dropdown-land", "value", ""),
+                                      ("graph-content-land", "relayoutData", random.choice(VIEWPORTS))])),
+}
+
+
+def create_app():
+    """uvicorn app factory used for the server process: main.app with the upstream stand-ins installed"""
+    install_upstream_stand_ins()
+    from main import app
+    return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workspace, port, workers):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    cmd = [sys.executable, "-m", "uvicorn", "benchmarks.loadtest:create_app", "--factory",
+           "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    server = subprocess.Popen(cmd, cwd=workspace, env=env, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server process exited during startup")
+        try:
+            # measured once the critical datasets are preloaded, as a deployed instance would be
+            if requests.get(url + "/readyz", timeout=1).status_code == 200:
+                return server, url
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("Server did not start within 120s")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def run_level(url, mix, concurrency, duration, timeout):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < stop_at:
+            name = random.choices(names, weights)[0]
+            body = CALLBACKS[name][1]()
+            start = time.perf_counter()
+            try:
+                ok = session.post(url + DASH_UPDATE_PATH, json=body, timeout=timeout).status_code in (200, 204)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append(elapsed)
+                if not ok:
+                    errors[name] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - start
+    return samples, errors, wall
+
+
+def report(concurrency, samples, errors, wall):
+    total = sum(len(s) for s in samples.values())
+    total_errors = sum(errors.values())
+    print(f"\nConcurrency {concurrency}: {total} requests in {wall:.1f}s, {total / wall:.1f} req/s, "
+          f"{total_errors / max(total, 1):.1%} errors")
+    print(f"  {'callback':12} {'requests':>8} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for name, values in sorted(samples.items()):
+        if not values:
+            continue
+        values = sorted(values)
+        print(f"  {name:12} {len(values):8d} {len(values) / wall:7.1f} {percentile(values, 50):7.3f}s "
+              f"{percentile(values, 95):7.3f}s {percentile(values, 99):7.3f}s {errors[name] / len(values):7.1%}")
+
+
+def parse_mix(value):
+    mix = {name: weight for name, (weight, _) in CALLBACKS.items()}
+    if value:
+        mix = {}
+        for item in value.split(","):
+            name, weight = item.split("=")
+            if name not in CALLBACKS:
+                raise SystemExit(f"Unknown callback {name}, choose from {', '.join(CALLBACKS)}")
+            mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of warm-up traffic before measuring")
+    parser.add_argument("--mix", help="callback weights, e.g. home=5,ev=2 (default: built-in realistic mix)")
+    parser.add_argument("--timeout", type=float, default=60, help="request timeout in seconds")
+    parser.add_argument("--uvicorn-workers", type=int, default=1, help="worker processes of the started server")
+    parser.add_argument("--workspace", help="fixture workspace directory (default: new temporary directory)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the request mix")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    server = None
+    url = args.url
+    if not url:
+        workspace = build_workspace(args.workspace or tempfile.mkdtemp(prefix="swissmaps-load-"))
+        server, url = start_server(workspace, free_port(), args.uvicorn_workers)
+    try:
+        if args.warmup:
+            print(f"Warming up for {args.warmup:.0f}s...")
+            run_level(url, mix, 2, args.warmup, args.timeout)
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            report(concurrency, *run_level(url, mix, concurrency, args.duration, args.timeout))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
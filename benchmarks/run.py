@@ -0,0 +1,174 @@
+"""
+Benchmark suite calling each page's update_graph directly across its input domain.
+
+Runs against fixture datasets and local stand-ins for the upstream APIs (see benchmarks/fixtures.py) and records
+per case: cold wall time (first call), warm wall time (median of the repeats), serialization time, peak Python
+memory and the size of the serialized figure.
+
+    python -m benchmarks.run                      # run and print the results
+    python -m benchmarks.run --save               # store the results as baseline
+    python -m benchmarks.run --compare            # compare against the baseline, exit 1 on regressions
+    python -m benchmarks.run --pages ev,mobile --repeat 5 --threshold 0.2
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fixtures import REPO_DIR, build_workspace, install_upstream_stand_ins, ZUERI_ENDPOINTS
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Metrics compared against the baseline, regressions are increases above the threshold
+COMPARED_METRICS = ["warm_time", "serialize_time", "peak_memory", "payload_bytes"]
+# Ignore differences on very small absolute values (timer noise)
+MIN_TIME = 0.02
+
+# relayoutData of a map zoomed in on Zürich (individual points instead of clusters)
+ZOOMED_IN = {"mapbox.zoom": 14, "mapbox.center": {"lon": 8.54, "lat": 47.37},
+             "mapbox._derived": {"coordinates": [[8.50, 47.39], [8.58, 47.39], [8.58, 47.35], [8.50, 47.35]]}}
+
+
+def page_cases():
+    """Input domain per page: {page module: [update_graph arguments, ...]}"""
+    from data_loader_overpy import get_tag_keys_values_options, get_country_codes
+    tag_keys, tag_values, tag_key_value_list = get_tag_keys_values_options()
+    shapes = ["-", "Kantone", "Bezirke", "Gemeinden"]
+    return {
+        "dash_euro_osm": [(tag, "CH") for tag in sorted(tag_values)] +
+                         [("books", country) for country in get_country_codes() if country != "CH"] +
+                         [(["bakery"], ["CH", "DE", "AT"]), (["bakery", "books"], ["CH", "DE", "AT", "FR", "IT"])],
+        "dash_swiss_osm_density": [(tag, "-") for tag in sorted(tag_values)] +
+                                  [("restaurant", shape) for shape in shapes[1:]],
+        "dash_swiss_3d": [("linear",), ("cubic",), ("nearest",)],
+        "dash_swiss_5g": [(layers, shape) for layers in (["5G"], []) for shape in shapes] +
+                         [(["5G"], shape, value) for shape in shapes[1:]
+                          for value in ["Antennas per km²", "Power per 1000 inh."]],
+        "dash_swiss_ev": [(None,)] + [({"row": row, "column": 0},) for row in range(5)] + [(None, ZOOMED_IN)] +
+                         [({"row": 1, "column": 0}, None, ["CCS"]), (None, ZOOMED_IN, ["Type 2", "CHAdeMO"])],
+        "dash_swiss_land": [("",), ("", ZOOMED_IN)],
+        "dash_swiss_wind": [("All",), ("Normalbetrieb",)],
+        "dash_swiss_mobile": [("",), ("", ZOOMED_IN)],
+        "dash_swiss_population": [(shape, data) for shape in shapes[1:]
+                                  for data in ["Population", "Area", "Density"]],
+        "dash_zueri_tourism": [([api_id],) for api_id in ZUERI_ENDPOINTS] + [(list(ZUERI_ENDPOINTS)[:3],)],
+    }
+
+
+def serialize(result):
+    # Same JSON encoding Dash uses for callback outputs
+    from plotly.io.json import to_json_plotly
+    return to_json_plotly(result)
+
+
+def run_case(func, args, repeat):
+    start = time.perf_counter()
+    result = func(*args)
+    cold_time = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    payload = serialize(result)
+    serialize_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "cold_time": cold_time,
+        "warm_time": statistics.median(times) if times else cold_time,
+        "serialize_time": serialize_time,
+        "peak_memory": peak_memory,
+        "payload_bytes": len(payload),
+    }
+
+
+def run(pages=None, repeat=3):
+    # Import the Dash app (registers all pages) inside the fixture workspace with the stand-ins installed
+    install_upstream_stand_ins()
+    import dash_app  # noqa: F401
+
+    results = {}
+    for page, cases in page_cases().items():
+        if pages and page not in pages:
+            continue
+        module = importlib.import_module(f"pages.{page}")
+        for args in cases:
+            key = f"{page}{json.dumps(args)}"
+            results[key] = run_case(module.update_graph, args, repeat)
+            r = results[key]
+            print(f"{key:60} cold {r['cold_time']:7.3f}s  warm {r['warm_time']:7.3f}s  "
+                  f"json {r['serialize_time']:6.3f}s  mem {r['peak_memory'] / 1e6:7.1f} MB  "
+                  f"payload {r['payload_bytes'] / 1e6:7.2f} MB", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            if metric.endswith("_time") and max(old, new) < MIN_TIME:
+                continue
+            change = (new - old) / old
+            flag = "REGRESSION" if change > threshold else ("improved" if change < -threshold else "")
+            if flag:
+                print(f"{flag:10} {key:60} {metric:15} {old:12.4f} -> {new:12.4f} ({change:+.0%})")
+            if change > threshold:
+                regressions.append((key, metric, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", help="comma separated page modules to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs per case")
+    parser.add_argument("--save", action="store_true", help="store the results as baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative increase flagged as regression")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    parser.add_argument("--workspace", help="fixture workspace directory (default: new temporary directory)")
+    args = parser.parse_args()
+
+    baseline_file = os.path.abspath(args.baseline)
+    # the benchmark runs inside the workspace, keep the app modules importable
+    sys.path.insert(0, REPO_DIR)
+    workspace = build_workspace(args.workspace or tempfile.mkdtemp(prefix="swissmaps-bench-"))
+    os.chdir(workspace)
+
+    results = run(args.pages.split(",") if args.pages else None, args.repeat)
+
+    if args.compare:
+        with open(baseline_file) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+        if regressions:
+            sys.exit(1)
+
+    if args.save:
+        with open(baseline_file, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "repeat": args.repeat,
+                       "results": results}, f, indent=2)
+        print(f"Baseline saved to {baseline_file}")
+
+
+if __name__ == "__main__":
+    main()
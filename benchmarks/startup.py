@@ -0,0 +1,121 @@
+"""
+Startup profile of the FastAPI app: import and init time per module, checked against a startup time budget.
+
+Imports main.py in a fresh interpreter inside a fixture workspace. The init time of a module is the time spent running
+its own module code, the time with imports includes the modules it imports.
+Network connections are refused during the import, starting the app must not wait for upstream APIs.
+The check fails (exit 1) when the import takes longer than the budget, when it tries to connect to the network or
+when one of the lazily imported heavy libraries is loaded at startup.
+
+    python -m benchmarks.startup                      # profile and check against STARTUP_BUDGET (default 3s)
+    python -m benchmarks.startup --budget 2 --top 30
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.fixtures import REPO_DIR, build_workspace
+
+# Heavy libraries only imported by the code paths that need them
+LAZY_MODULES = ["geopandas", "scipy", "overpy", "plotly.express", "pyogrio"]
+REPORT_PREFIX = "STARTUP_REPORT "
+
+# Runs in a fresh interpreter: times the execution of every Python module imported by main (cumulative and own time,
+# i.e. without the modules it imports) and refuses network connections. benchmarks.fixtures is not imported there,
+# it would load the heavy libraries before the app does.
+CHILD_SCRIPT = f"""
+import importlib.machinery, json, socket, sys, time
+connections = []
+def refuse(address):
+    connections.append(str(address))
+    raise OSError("network access during startup")
+socket.getaddrinfo = lambda host, port, *args, **kwargs: refuse(f"{{host}}:{{port}}")
+socket.socket.connect = lambda self, address: refuse(address)
+
+modules = []
+stack = []
+exec_module = importlib.machinery.SourceFileLoader.exec_module
+def timed_exec_module(loader, module):
+    parent = stack[-1][0] if stack else None
+    stack.append([module.__name__, 0.0])
+    start = time.perf_counter()
+    try:
+        exec_module(loader, module)
+    finally:
+        elapsed = time.perf_counter() - start
+        name, children = stack.pop()
+        if stack:
+            stack[-1][1] += elapsed
+        modules.append((name, elapsed - children, elapsed, parent))
+importlib.machinery.SourceFileLoader.exec_module = timed_exec_module
+
+start = time.perf_counter()
+import main
+report = {{"total": time.perf_counter() - start, "connections": connections, "modules": modules,
+          "lazy_loaded": [m for m in {LAZY_MODULES!r} if m in sys.modules]}}
+print({REPORT_PREFIX!r} + json.dumps(report), file=sys.stderr)
+"""
+
+
+def app_modules():
+    # Modules of the repository (top-level modules and pages)
+    names = {f[:-3] for f in os.listdir(REPO_DIR) if f.endswith(".py")}
+    names |= {f"pages.{f[:-3]}" for f in os.listdir(os.path.join(REPO_DIR, "pages")) if f.endswith(".py")}
+    return names
+
+
+def profile(workspace):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-c", CHILD_SCRIPT], cwd=workspace, env=env,
+                            capture_output=True, text=True)
+    reports = [line for line in result.stderr.splitlines() if line.startswith(REPORT_PREFIX)]
+    if result.returncode != 0 or not reports:
+        print(result.stdout, result.stderr, file=sys.stderr)
+        raise SystemExit("Importing the app failed")
+    return json.loads(reports[-1][len(REPORT_PREFIX):])
+
+
+def print_profile(modules, top):
+    own = app_modules()
+    print(f"{'app module':40} {'init':>9} {'with imports':>13}")
+    for name, self_time, cumulative, _ in sorted((m for m in modules if m[0] in own), key=lambda m: -m[2])[:top]:
+        print(f"{name:40} {self_time * 1000:7.1f}ms {cumulative * 1000:11.1f}ms")
+
+    # Dependencies imported directly by an app module, i.e. what each page or module pulls in at startup
+    print(f"\n{'dependency':40} {'imported by':30} {'with imports':>13}")
+    dependencies = [m for m in modules if m[0] not in own and m[3] in own]
+    for name, _, cumulative, parent in sorted(dependencies, key=lambda m: -m[2])[:top]:
+        print(f"{name:40} {parent:30} {cumulative * 1000:11.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET", 3.0)),
+                        help="maximum import time of the app in seconds")
+    parser.add_argument("--top", type=int, default=20, help="modules listed per table")
+    parser.add_argument("--workspace", help="fixture workspace directory (default: new temporary directory)")
+    args = parser.parse_args()
+
+    workspace = build_workspace(args.workspace or tempfile.mkdtemp(prefix="swissmaps-startup-"))
+    report = profile(workspace)
+    print_profile(report["modules"], args.top)
+
+    failures = []
+    print(f"\nStartup: {report['total']:.2f}s (budget {args.budget:.2f}s)")
+    if report["total"] > args.budget:
+        failures.append(f"startup took {report['total']:.2f}s, budget is {args.budget:.2f}s")
+    if report["connections"]:
+        failures.append(f"network connections during startup: {', '.join(report['connections'])}")
+    if report["lazy_loaded"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(report['lazy_loaded'])}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import json
+import math
+import os
+import threading
+import time
+
+from data_loader import zueri_poi_index
+from data_loader_overpy import CACHE_MAX_AGE, get_country_codes, get_data_overpy, get_tag_keys_values_options, \
+    overpass_cache_age
+from metrics import Counter, Gauge
+
+# Combinations kept warm, upstream fetches allowed per cycle and time between two cycles
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 20))
+WARMUP_BUDGET = int(os.getenv("WARMUP_BUDGET", 10))
+WARMUP_INTERVAL = int(os.getenv("WARMUP_INTERVAL", 60 * 10))
+# Entries expiring within this time are refreshed ahead of their expiry
+WARMUP_AHEAD = 60 * 60 * 2
+# Request counts lose half their weight after a day, so that the ranking follows what is popular now
+POPULARITY_HALF_LIFE = 60 * 60 * 24
+POPULARITY_FILE = "temp/popularity.json"
+# Keys kept by the popularity tracker, the lowest scoring ones are dropped above it
+POPULARITY_MAX_KEYS = 1000
+
+ZUERI_MAX_AGE = 60 * 60 * 24
+
+warmup_refreshes = Counter("cache_warmup_refreshes_total", "Cache entries refreshed ahead of expiry by the warm-up.",
+                           ("cache", "result"))
+
+
+class PopularityTracker:
+    """Time-decayed request counts of upstream-backed callback inputs, e.g. ("overpass", "CH", "bakery")."""
+
+    def __init__(self, half_life=POPULARITY_HALF_LIFE, max_keys=POPULARITY_MAX_KEYS):
+        self.decay = math.log(2) / half_life
+        self.max_keys = max_keys
+        self._scores = {}       # key -> (score, time of the last update)
+        self._lock = threading.Lock()
+
+    def _score(self, score, updated, now):
+        return score * math.exp(-self.decay * (now - updated))
+
+    def record(self, key, weight=1.0):
+        now = time.time()
+        with self._lock:
+            score, updated = self._scores.get(key, (0.0, now))
+            self._scores[key] = (self._score(score, updated, now) + weight, now)
+            if len(self._scores) > self.max_keys:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Drops the lowest scoring keys down to 90% of max_keys, so that pruning does not run on every new key
+        ranked = sorted(self._scores, key=lambda k: self._score(*self._scores[k], now), reverse=True)
+        for key in ranked[int(self.max_keys * 0.9):]:
+            del self._scores[key]
+
+    def top(self, n):
+        now = time.time()
+        with self._lock:
+            scores = [(self._score(score, updated, now), key) for key, (score, updated) in self._scores.items()]
+        return [key for score, key in sorted(scores, reverse=True)[:n]]
+
+    def __len__(self):
+        return len(self._scores)
+
+    def save(self, path=POPULARITY_FILE):
+        with self._lock:
+            data = [[list(key), score, updated] for key, (score, updated) in self._scores.items()]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path=POPULARITY_FILE):
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            data = json.load(f)
+        with self._lock:
+            for key, score, updated in data:
+                if all(isinstance(part, str) for part in key):
+                    self._scores[tuple(key)] = (score, updated)
+            if len(self._scores) > self.max_keys:
+                self._prune(time.time())
+
+
+def as_list(value, default=None):
+    # Dropdown value (one value or a list of them) as a list, [default] if nothing is selected and default is given
+    if isinstance(value, (list, tuple)):
+        values = list(value)
+    else:
+        values = [] if value is None or value == "" else [value]
+    return values or ([] if default is None else [default])
+
+
+def string_values(value):
+    # Selected dropdown values, anything but strings (e.g. nested lists of a malformed request) is ignored
+    return [v for v in as_list(value) if isinstance(v, str)]
+
+
+def known_key(key):
+    # Only combinations the pages offer are tracked and warmed up, the request inputs come from the client
+    if key[0] == "overpass" and len(key) == 3:
+        return key[1] in COUNTRY_CODES and key[2] in TAG_KEYS
+    if key[0] == "zueri" and len(key) == 2:
+        return key[1] in zueri_poi_index.zueri_data.cached_endpoint_ids()
+    return False
+
+
+def upstream_keys(body):
+    """Cache keys of the upstream data a Dash callback request needs, read from its inputs."""
+    inputs = {(i.get("id"), i.get("property")): i.get("value") for i in body.get("inputs", [])
+              if isinstance(i, dict) and isinstance(i.get("id"), str) and isinstance(i.get("property"), str)}
+    output = body.get("output", "")
+    if not isinstance(output, str):
+        return []
+    keys = []
+    if "graph-content.figure" in output:    # Open Street Maps Europe
+        for country in string_values(inputs.get(("dropdown-country", "value"))):
+            for tag in string_values(inputs.get(("dropdown-value", "value"))):
+                keys.append(("overpass", country, tag))
+    elif "graph-content-3.figure" in output:    # POI density (Switzerland)
+        for tag in string_values(inputs.get(("dropdown-value", "value"))):
+            keys.append(("overpass", "CH", tag))
+    elif "graph-content-1.figure" in output:    # Zürich Tourism
+        for api_id in as_list(inputs.get(("dropdown-id", "value"))):
+            if isinstance(api_id, (str, int)) and not isinstance(api_id, bool):
+                keys.append(("zueri", str(api_id)))
+    return [key for key in keys if known_key(key)]
+
+
+def record_dash_request(body):
+    # Called by the request middleware with the JSON body of every Dash callback request
+    for key in upstream_keys(body):
+        popularity.record(key)
+    warmup_scheduler.start()
+
+
+class WarmupScheduler:
+    """
+    Keeps the top-N most requested upstream combinations cached: every WARMUP_INTERVAL the entries that are missing
+    or expire within WARMUP_AHEAD are refreshed, at most WARMUP_BUDGET upstream fetches per cycle.
+    """
+
+    def __init__(self, tracker, top_n=WARMUP_TOP_N, budget=WARMUP_BUDGET, interval=WARMUP_INTERVAL):
+        self.tracker = tracker
+        self.top_n = top_n
+        self.budget = budget
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        _, _, self.tag_keys = get_tag_keys_values_options()
+
+    def cache_age(self, key):
+        # Seconds since the cached upstream data of the key was fetched, None if it is not cached
+        if key[0] == "overpass":
+            _, country, tag = key
+            return overpass_cache_age(country, self.tag_keys[tag], tag) if tag in self.tag_keys else None
+        if key[0] == "zueri":
+            return zueri_poi_index.zueri_data.cache_age(key[1])
+        return None
+
+    def _needs_refresh(self, key):
+        if key[0] == "overpass" and key[2] not in self.tag_keys:
+            return False
+        max_age = {"overpass": CACHE_MAX_AGE, "zueri": ZUERI_MAX_AGE}.get(key[0])
+        if max_age is None:
+            return False
+        age = self.cache_age(key)
+        return age is None or age > max_age - WARMUP_AHEAD
+
+    def _refresh(self, key):
+        if key[0] == "overpass":
+            _, country, tag = key
+            get_data_overpy(country, self.tag_keys[tag], tag, max_age=CACHE_MAX_AGE - WARMUP_AHEAD)
+        elif key[0] == "zueri":
+            data = zueri_poi_index.zueri_data.get_api_data(key[1], max_age=ZUERI_MAX_AGE - WARMUP_AHEAD)
+            if isinstance(data, list):
+                zueri_poi_index.ingest(key[1], data)
+
+    def run_once(self):
+        refreshed = 0
+        for key in self.tracker.top(self.top_n):
+            if refreshed >= self.budget:
+                break
+            # keys recorded before they were checked (popularity file of an older version)
+            if not known_key(key) or not self._needs_refresh(key):
+                continue
+            print(f"Warming up cache for {key}...")
+            refreshed += 1
+            try:
+                self._refresh(key)
+                warmup_refreshes.inc(key[0], "ok")
+            except Exception as e:
+                print(f"Cache warm-up for {key} failed: {e}")
+                warmup_refreshes.inc(key[0], "error")
+        return refreshed
+
+    def start(self):
+        # Starts the background warm-up thread once
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self.tracker.load()
+                    self._thread = threading.Thread(target=self._run, name="cache-warmup", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+                self.tracker.save()
+            except Exception as e:
+                print(f"Cache warm-up failed: {e}")
+
+
+COUNTRY_CODES = set(get_country_codes())
+TAG_KEYS = get_tag_keys_values_options()[2]
+
+popularity = PopularityTracker()
+warmup_scheduler = WarmupScheduler(popularity)
+
+Gauge("cache_warmup_tracked_keys", "Upstream combinations with a recorded popularity.", (),
+      lambda: {(): len(popularity)})
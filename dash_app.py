@@ -3,6 +3,8 @@ import dash
 from dash import Dash, html, dcc
 from dash.dependencies import Input, Output
 from dash_layout_builder import build_page_registry, build_nav_links
+from metrics import install_flask_hooks, instrument_callback
+from task_pool import install_session_cookie
 
 external_stylesheets = [
     'https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/css/bootstrap.min.css',
@@ -26,6 +28,10 @@ else:
     os.makedirs(TEMP_DIR)
 
 app = Dash(__name__, use_pages=True, external_stylesheets=external_stylesheets, external_scripts=external_scripts)
+# Record serialization time and payload size of every callback response (see metrics)
+install_flask_hooks(app.server)
+# Session id cookie used to discard superseded heavy callbacks of a user (see task_pool)
+install_session_cookie(app.server)
 
 # This callback is a workaround in order to correctly collect and display all nav links inside the home page
 # which cant be done from inside a page as the page_registry may not be complete at page creation time
@@ -34,6 +40,7 @@ app = Dash(__name__, use_pages=True, external_stylesheets=external_stylesheets,
     Output('my-div', 'style'),
     Input('url', 'pathname')
 )
+@instrument_callback("show_hide_div")
 def show_hide_div(pathname):
     if pathname == "/":
         return {'display': 'block'}
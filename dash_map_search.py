@@ -0,0 +1,67 @@
+import json
+
+from dash import callback, clientside_callback, dcc, html, Input, Output, State
+from dash.exceptions import PreventUpdate
+
+from metrics import instrument_callback
+from search_index import normalize, search_index
+
+# Suggestions listed below the search box
+SEARCH_SUGGESTIONS = 10
+
+# Moves the map to the selected place like a user would (Plotly.relayout), so that the user's position is kept by
+# uirevision and the pages that load data for the visible area (relayoutData) update for the new view
+JUMP_SCRIPT = """
+function(value, graph_id) {
+    if (!value) {
+        return window.dash_clientside.no_update;
+    }
+    const target = JSON.parse(value);
+    const graph = document.getElementById(graph_id);
+    const plot = graph && graph.querySelector('.js-plotly-plot');
+    if (plot && window.Plotly) {
+        window.Plotly.relayout(plot, {'mapbox.center': {lat: target.lat, lon: target.lon}, 'mapbox.zoom': target.zoom});
+    }
+    return value;
+}
+"""
+
+
+def search_option(result):
+    label = f"{result['name']} ({result['kind']}{', ' + result['detail'] if result['detail'] else ''})"
+    value = json.dumps({"lat": result["lat"], "lon": result["lon"], "zoom": result["zoom"], "label": label})
+    # the browser filters the options by the search text, the normalized name also matches "zurich" for "Zürich"
+    return {"label": label, "value": value, "search": f"{label} {normalize(result['name'])}"}
+
+
+def map_search(graph_id):
+    """Search box jumping the map of graph_id to a Gemeinde, Bezirk, Kanton or POI (see search_index)."""
+    search_id = f"{graph_id}-search"
+
+    @callback(
+        Output(search_id, 'options'),
+        Input(search_id, 'search_value'),
+        State(search_id, 'value'),
+    )
+    @instrument_callback("map_search")
+    def update_suggestions(search_value, value):
+        if not search_value:
+            raise PreventUpdate
+        options = [search_option(result) for result in search_index.search(search_value, SEARCH_SUGGESTIONS)]
+        # the selected place stays an option, otherwise the dropdown would clear it
+        if value and all(option["value"] != value for option in options):
+            options.append({"label": json.loads(value)["label"], "value": value})
+        return options
+
+    clientside_callback(
+        JUMP_SCRIPT,
+        Output(f"{search_id}-target", 'data'),
+        Input(search_id, 'value'),
+        State(graph_id, 'id'),
+    )
+
+    return html.Div([
+        dcc.Dropdown([], None, placeholder="Search a Gemeinde, Bezirk, Kanton or POI...", className='ddown',
+                     id=search_id),
+        dcc.Store(id=f"{search_id}-target"),
+    ], className='map-search')
@@ -1,6 +1,8 @@
 from dash import callback, Input, Output, State, html
 import dash_bootstrap_components as dbc
 
+from metrics import instrument_callback
+
 modal = html.Div(
     [
         dbc.Button("Open modal", id="open", n_clicks=0, style={'display': 'none'}),
@@ -27,6 +29,7 @@ modal = html.Div(
      Input("close", "n_clicks")],
     [State("modal", "is_open")],
 )
+@instrument_callback("toggle_modal")
 def toggle_modal(dropdown_shape, n2, is_open):
     if dropdown_shape or n2:
         if dropdown_shape in ['Kantone', "-"]:
@@ -0,0 +1,323 @@
+import json
+import operator
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import shapely
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from data_registry import registry
+from reprojection import WGS84, crs_key, to_crs, transform_xy
+
+# Rows encoded at a time, a response never holds more than one chunk of features
+CHUNK_SIZE = 1000
+DEFAULT_LIMIT = 10000
+MAX_LIMIT = 100000
+
+FILTER = re.compile(r"^(\w+)(<=|>=|!=|=|<|>)(.*)$")
+OPERATORS = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt,
+             ">=": operator.ge}
+ORDERING = {"<", "<=", ">", ">="}
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "geojson": "application/geo+json"}
+
+router = APIRouter(prefix="/api/data")
+
+
+def parse_filters(where, columns):
+    # "column<op>value" strings (e.g. "TYP_NR>=3", "NAME=Zürich") to (column, operator, value)
+    filters = []
+    for expression in where or []:
+        match = FILTER.match(expression)
+        if not match or match.group(1) not in columns:
+            raise HTTPException(status_code=400, detail=f"Invalid filter {expression!r}, columns: {', '.join(columns)}")
+        filters.append(match.groups())
+    return filters
+
+
+def parse_bbox(bbox):
+    if bbox is None:
+        return None
+    try:
+        lon_min, lat_min, lon_max, lat_max = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be lon_min,lat_min,lon_max,lat_max")
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def filter_value(value, numeric):
+    if not numeric:
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Numeric value expected, got {value!r}")
+
+
+def filter_mask(values, symbol, value):
+    # Rows of a column matching "<symbol> value", only the requested comparison is evaluated
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        if symbol in ORDERING and not values.cat.ordered:
+            raise HTTPException(status_code=400, detail=f"{symbol} is not supported on column {values.name}")
+        values = values.astype(str)
+    value = filter_value(value, pd.api.types.is_numeric_dtype(values))
+    try:
+        return OPERATORS[symbol](values, value).to_numpy(dtype=bool)
+    except TypeError:
+        raise HTTPException(status_code=400, detail=f"{symbol} is not supported on column {values.name}")
+
+
+def parse_cursor(cursor, numeric):
+    # Key of the first feature of the page, as returned in X-Next-Cursor
+    if cursor is None or not numeric:
+        return cursor
+    try:
+        return int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor!r}")
+
+
+def feature_lines(chunk, lat_column=None, lon_column=None):
+    """GeoJSON Feature strings of a (Geo)DataFrame chunk in WGS84, properties are encoded by pandas in one pass."""
+    if lat_column:
+        geometries = [None if np.isnan(lat) or np.isnan(lon) else
+                      f'{{"type":"Point","coordinates":[{lon!r},{lat!r}]}}'
+                      for lat, lon in zip(chunk[lat_column].to_numpy(dtype=float).tolist(),
+                                          chunk[lon_column].to_numpy(dtype=float).tolist())]
+        properties = pd.DataFrame(chunk)
+    else:
+        geometries = shapely.to_geojson(chunk.geometry.values).tolist()
+        properties = pd.DataFrame(chunk.drop(columns=chunk.geometry.name))
+    if len(properties) == 0:
+        return
+    records = properties.to_json(orient="records", lines=True, date_format="iso", force_ascii=False)
+    for geometry, record in zip(geometries, records.splitlines()):
+        yield f'{{"type":"Feature","geometry":{geometry or "null"},"properties":{record}}}'
+
+
+class FrameSource:
+    """
+    A dataset held in memory, points given by lat / lon columns or a geometry.
+    Pages are ordered by the key column (the row position if there is none, for frames read from a file), the cursor
+    is the key of the first feature of the next page, so that pages stay consistent when the frame is replaced.
+    """
+
+    def __init__(self, description, loader, key=None, lat_column=None, lon_column=None):
+        self.description = description
+        self.loader = loader
+        self.key = key
+        self.lat_column = lat_column
+        self.lon_column = lon_column
+
+    def load(self):
+        # One version of the frame per request, select and chunks must see the same rows
+        return self.loader()
+
+    @staticmethod
+    def columns(df):
+        return [c for c in df.columns if c != getattr(df, "_geometry_column_name", None)]
+
+    def column_names(self):
+        return self.columns(self.load())
+
+    def keys(self, df, positions):
+        return positions if self.key is None else df[self.key].to_numpy()[positions]
+
+    def numeric_key(self, df):
+        return self.key is None or pd.api.types.is_numeric_dtype(df[self.key])
+
+    def select(self, df, bbox, filters):
+        # Row positions matching the bbox and the attribute filters
+        mask = np.ones(len(df), dtype=bool)
+        if bbox:
+            if self.lat_column:
+                lat, lon = df[self.lat_column].to_numpy(dtype=float), df[self.lon_column].to_numpy(dtype=float)
+                mask &= (lon >= bbox[0]) & (lat >= bbox[1]) & (lon <= bbox[2]) & (lat <= bbox[3])
+            else:
+                in_bbox = np.zeros(len(df), dtype=bool)
+                x, y = transform_xy([bbox[0], bbox[2]], [bbox[1], bbox[3]], WGS84, df.crs)
+                in_bbox[df.sindex.query(shapely.box(x[0], y[0], x[1], y[1]))] = True
+                mask &= in_bbox
+        for column, symbol, value in filters:
+            mask &= filter_mask(df[column], symbol, value)
+        return np.flatnonzero(mask)
+
+    def chunks(self, df, positions):
+        for start in range(0, len(positions), CHUNK_SIZE):
+            chunk = df.iloc[positions[start:start + CHUNK_SIZE]]
+            if not self.lat_column and crs_key(chunk.crs) != WGS84:
+                chunk = to_crs(chunk, WGS84)
+            yield chunk
+
+
+class FileSource:
+    """
+    A vector file read in chunks with pyogrio, so that large layers are never loaded as a whole.
+    The bbox and the attribute filters are evaluated by GDAL (spatial index, SQL where), positions and keys are the
+    feature ids.
+    """
+
+    def __init__(self, description, path):
+        self.description = description
+        self.path = path
+
+    def load(self):
+        import pyogrio
+        return pyogrio.read_info(self.path)
+
+    @staticmethod
+    def columns(info):
+        return list(info["fields"])
+
+    def column_names(self):
+        return self.columns(self.load())
+
+    @staticmethod
+    def keys(info, positions):
+        return positions
+
+    @staticmethod
+    def numeric_key(info):
+        return True
+
+    def select(self, info, bbox, filters):
+        import pyogrio
+        dtypes = dict(zip(info["fields"], info["dtypes"]))
+        clauses = []
+        for column, symbol, value in filters:
+            numeric = dtypes[column] != "object"
+            value = filter_value(value, numeric)
+            literal = repr(value) if numeric else "'" + value.replace("'", "''") + "'"
+            clauses.append(f'"{column}" {"<>" if symbol == "!=" else symbol} {literal}')
+        if bbox:
+            x, y = transform_xy([bbox[0], bbox[2], bbox[0], bbox[2]], [bbox[1], bbox[1], bbox[3], bbox[3]],
+                                WGS84, info["crs"])
+            bbox = (x.min(), y.min(), x.max(), y.max())
+        fids = pyogrio.read_dataframe(self.path, columns=[], read_geometry=False, fid_as_index=True,
+                                      where=" AND ".join(clauses) or None, bbox=bbox).index
+        return fids.to_numpy()
+
+    def chunks(self, info, positions):
+        import pyogrio
+        for start in range(0, len(positions), CHUNK_SIZE):
+            chunk = pyogrio.read_dataframe(self.path, fids=positions[start:start + CHUNK_SIZE])
+            yield to_crs(chunk, WGS84)
+
+
+@lru_cache(maxsize=None)
+def read_processed(path):
+    from data_registry import read_file
+    return read_file(path)
+
+
+class ProcessedFileSource(FrameSource):
+    """
+    A processed file with all its columns and types, read as a whole on first use of the API. The registry only holds
+    the compacted columns the pages use (see data_registry.compact_geodataframe).
+    """
+
+    def __init__(self, description, path, key):
+        super().__init__(description, lambda: read_processed(path), key)
+        self.path = path
+
+    def column_names(self):
+        # from the file header, listing the datasets does not load them
+        import pyogrio
+        return list(pyogrio.read_info(self.path)["fields"])
+
+
+def load_ev_stations():
+    from ev_catalogue import ev_catalogue, ev_live_status
+    live = ev_live_status.get().drop_duplicates("EvseID", keep="last")
+    return pd.merge(ev_catalogue.get(), live, on="EvseID", how="left")
+
+
+def poi_source(country, tag_value):
+    # POIs of a cached Overpass query (see data_loader_overpy), the API does not query Overpass itself
+    from data_loader_overpy import get_tag_keys_values_options, overpass_cache_path
+    _, _, tag_keys = get_tag_keys_values_options()
+    path = overpass_cache_path(country, tag_keys.get(tag_value), tag_value) if tag_value in tag_keys else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"No cached POIs for {country} {tag_value}")
+    with open(path) as f:
+        cached = json.load(f)
+    df = pd.DataFrame({"id": cached.get("ids", [None] * len(cached["names"])), "name": cached["names"],
+                       "lat": cached["lats"], "lon": cached["longs"], "website": cached.get("websites")})
+    key = "id" if df["id"].notna().all() and df["id"].is_unique else None
+    return FrameSource(f"OpenStreetMap {tag_value} in {country}", lambda: df, key, "lat", "lon")
+
+
+DATASETS = {
+    "antennas": ProcessedFileSource("5G antennas", "static/ant_gdf.json", "id"),
+    "mobile_network": FrameSource("Mobile network antennas", lambda: registry.get("mobilfunk")),
+    "ev_stations": FrameSource("EV charging stations with their live status", load_ev_stations, "EvseID",
+                               "lat", "lon"),
+    "wind_turbines": FrameSource("Wind turbines", lambda: registry.get("wind_turbines"), "xtf_id", "lat", "lon"),
+    "kantone": ProcessedFileSource("Cantons", "static/gdf_kan.json", "UUID"),
+    "bezirke": ProcessedFileSource("Districts", "static/gdf_bez.json", "UUID"),
+    "gemeinden": ProcessedFileSource("Municipalities", "static/gdf_gem.json", "UUID"),
+    "landschaft": FileSource("Landscape types", "static/landschaft.gpkg"),
+}
+
+
+def stream(source, output_format, bbox, where, limit, cursor):
+    """
+    Streams a page of the matching features as NDJSON (one GeoJSON Feature per line) or a GeoJSON FeatureCollection.
+    The cursor of the next page is returned in the X-Next-Cursor header (and in the FeatureCollection).
+    """
+    data = source.load()
+    positions = source.select(data, parse_bbox(bbox), parse_filters(where, source.columns(data)))
+    keys = source.keys(data, positions)
+    order = np.argsort(keys, kind="stable")
+    positions, keys = positions[order], keys[order]
+    if cursor is not None:
+        start = np.searchsorted(keys, parse_cursor(cursor, source.numeric_key(data)))
+        positions, keys = positions[start:], keys[start:]
+    page = positions[:limit]
+    next_cursor = str(keys[limit]) if len(keys) > limit else None
+    lat_column, lon_column = getattr(source, "lat_column", None), getattr(source, "lon_column", None)
+
+    def ndjson():
+        for chunk in source.chunks(data, page):
+            lines = list(feature_lines(chunk, lat_column, lon_column))
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+    def geojson():
+        yield '{"type":"FeatureCollection","features":['
+        separator = ""
+        for chunk in source.chunks(data, page):
+            lines = list(feature_lines(chunk, lat_column, lon_column))
+            if lines:
+                yield separator + ",".join(lines)
+                separator = ","
+        yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return StreamingResponse(ndjson() if output_format == "ndjson" else geojson(),
+                             media_type=MEDIA_TYPES[output_format], headers=headers)
+
+
+@router.get("")
+def list_datasets():
+    return {name: {"description": source.description, "columns": source.column_names()}
+            for name, source in DATASETS.items()}
+
+
+@router.get("/pois/{country}/{tag_value}")
+def get_pois(country: str, tag_value: str, bbox: str = None, where: list[str] = Query(None),
+             limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str = None,
+             format: str = Query("ndjson", pattern="^(ndjson|geojson)$")):
+    return stream(poi_source(country, tag_value), format, bbox, where, limit, cursor)
+
+
+@router.get("/{name}")
+def get_dataset(name: str, bbox: str = None, where: list[str] = Query(None),
+                limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str = None,
+                format: str = Query("ndjson", pattern="^(ndjson|geojson)$")):
+    if name not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset, one of: {', '.join(DATASETS)}")
+    return stream(DATASETS[name], format, bbox, where, limit, cursor)
@@ -1,63 +1,203 @@
 import os
+import threading
 import time
 import json
-import geopandas as gpd
+import numpy as np
 import requests
-from geopandas import GeoSeries
 from shapely.geometry import Point
 import pandas as pd
+import shapely
 
+from metrics import record_cache, upstream_timer
+from reprojection import LV95, WGS84, to_crs, transform_geometries
 from string_decode import decode_string
 
+# geopandas (slow to import) is only imported by the pre-processing functions that need it, not at startup
+
 TEMP_DIR = "temp"
 
+# Bit per mobile network technology, an antenna can support several technologies
+TECHNOLOGY_BITS = {"3G": 1, "4G": 2, "5G": 4}
+# Pre-processed boundary layers used for the antenna coverage index
+COVERAGE_LEVELS = {"Kantone": "static/gdf_kan.json", "Bezirke": "static/gdf_bez.json", "Gemeinden": "static/gdf_gem.json"}
+# Bit per plug type group of the EV chargers, a station can offer several plug types
+PLUG_TYPE_BITS = {"Type 2": 1, "CCS": 2, "CHAdeMO": 4, "Type 1": 8, "Domestic": 16, "Tesla": 32, "Other": 64}
+# Substrings of the OICP plug names identifying the plug type groups (checked in this order)
+PLUG_TYPE_PATTERNS = [("CCS", "CCS"), ("CHAdeMO", "CHAdeMO"), ("Tesla", "Tesla"), ("Type 2", "Type 2"),
+                      ("Type 1", "Type 1"), ("Schuko", "Domestic"), ("Swiss Standard", "Domestic"),
+                      ("French Standard", "Domestic"), ("Standard", "Domestic")]
+# Columns shown in the tooltip of the mobile antenna map
+ANTENNA_CUSTOMDATA_COLUMNS = ['typ_de', 'techno_de', 'power_de']
+
 
 class ZueriData:
     def __init__(self):
         self.end_url = "https://www.zuerich.com/en/api/v2/data"
         self.api_url = self.end_url + "?id="
         self.temp_dir = TEMP_DIR
-
-    def get_endpoint_list(self):
+        self._endpoint_ids = None   # (modification time of the cached list, its ids)
+
+    def get_endpoint_list(self, max_age=60 * 60 * 24):
+        # The list is kept in the temp directory, an outdated list is still used when the API cannot be reached
+        file_path = f'{self.temp_dir}/endpoints.json'
+        cached = None
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                cached = json.load(f)
+            if os.path.getmtime(file_path) > time.time() - max_age:
+                return cached
         print('Retrieving Zürich Tourism API endpoints...')
         try:
-            api_endpoints_raw = requests.get(self.end_url)
+            with upstream_timer("zueri"):
+                api_endpoints_raw = requests.get(self.end_url)
             api_ids_names = {item.get('id'): item.get('name').get('de') for item in api_endpoints_raw.json() if
                              not item.get('name').get('de') is None}
+            with open(file_path, 'w') as f:
+                json.dump(api_ids_names, f)
         except Exception as e:
             print(f'Error: {e}')
-            api_ids_names = {101: 'Error Retrieving data...'}
+            api_ids_names = cached or {101: 'Error Retrieving data...'}
         return api_ids_names
 
-    def get_api_data(self, api_id=101):
+    def cached_endpoint_ids(self):
+        # Ids of the cached endpoint list, without an upstream request (empty if the list was never fetched)
+        file_path = f'{self.temp_dir}/endpoints.json'
+        if not os.path.exists(file_path):
+            return set()
+        mtime = os.path.getmtime(file_path)
+        if self._endpoint_ids is None or self._endpoint_ids[0] != mtime:
+            with open(file_path, 'r') as f:
+                self._endpoint_ids = (mtime, set(json.load(f)))
+        return self._endpoint_ids[1]
+
+    def cache_age(self, api_id):
+        # Seconds since the endpoint was cached, None if there is no cached version
+        file_path = f'{self.temp_dir}/{api_id}.json'
+        return time.time() - os.path.getmtime(file_path) if os.path.exists(file_path) else None
+
+    def get_api_data(self, api_id=101, max_age=60 * 60 * 24):
         print(f'Checking for cached version of API endpoint with id {api_id}')
+        file_path = f'{self.temp_dir}/{api_id}.json'
         # Check if the data is already cached and not older than 24h
-        if os.path.exists(f'{self.temp_dir}/{api_id}.json') and os.path.getctime(
-                f'{self.temp_dir}/{api_id}.json') > time.time() - (60 * 60 * 24):
+        if os.path.exists(file_path) and os.path.getmtime(file_path) > time.time() - max_age:
             print('Loading cached data...')
-            with open(f'{self.temp_dir}/{api_id}.json', 'r') as f:
+            record_cache("zueri", True)
+            with open(file_path, 'r') as f:
                 data = json.load(f)
             return data
         else:
             print('No cached data found, retrieving fresh API data...')
+            record_cache("zueri", False)
             try:
-                response = requests.get(self.api_url + str(api_id))
+                with upstream_timer("zueri"):
+                    response = requests.get(self.api_url + str(api_id))
                 data = response.json()
-                with open(f'{self.temp_dir}/{api_id}.json', 'w') as f:
+                with open(file_path, 'w') as f:
                     json.dump(data, f)
             except Exception as e:
                 print(f'Error: {e}')
                 data = {}
+                # an outdated version (e.g. from the data snapshot) is better than none
+                if os.path.exists(file_path):
+                    print('Using outdated cached data...')
+                    with open(file_path, 'r') as f:
+                        data = json.load(f)
         return data
 
 
+class ZueriPOIIndex:
+    """
+    Deduplicated, columnar table of the POIs of all fetched Zürich Tourism endpoints.
+    Name, URL and coordinates are extracted once when an endpoint is ingested. Every POI has a bitset of the
+    endpoints (categories) it belongs to, one bit per endpoint in a row of uint64 words, so that selecting one
+    category or a union of several is a vectorized mask.
+    """
+
+    def __init__(self, zueri_data=None, max_age=60 * 60 * 24):
+        self.zueri_data = zueri_data or ZueriData()
+        self.max_age = max_age
+        self.bits = {}          # endpoint id -> bit position
+        self.ingested = {}      # endpoint id -> time of the last ingest
+        self.keys = {}          # POI key -> row
+        self.names = []
+        self.urls = []
+        self.lats = []
+        self.lons = []
+        self._membership = np.zeros((0, 1), dtype=np.uint64)
+        # columns are replaced as a whole under the lock, readers use the last complete snapshot
+        self._snapshot = (np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty(0), np.empty(0),
+                          self._membership)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def poi_key(item, lat, lon):
+        # The same POI listed by several endpoints has the same identifier, fall back to name and position
+        return item.get('identifier') or item.get('@id') or ((item.get('name') or {}).get('de'), lat, lon)
+
+    def ensure(self, api_ids):
+        # Ingests the endpoints that were not loaded yet or are older than max_age
+        for api_id in api_ids:
+            api_id = str(api_id)
+            if time.time() - self.ingested.get(api_id, 0) > self.max_age:
+                data = self.zueri_data.get_api_data(api_id)
+                if isinstance(data, list):
+                    self.ingest(api_id, data)
+
+    def ingest(self, api_id, data):
+        with self._lock:
+            bit = self.bits.setdefault(str(api_id), len(self.bits))
+            word, mask = bit // 64, np.uint64(1 << (bit % 64))
+            rows = []
+            for item in data:
+                coordinates = item.get('geoCoordinates')
+                if coordinates is None:
+                    continue
+                lat, lon = coordinates.get('latitude'), coordinates.get('longitude')
+                key = self.poi_key(item, lat, lon)
+                row = self.keys.get(key)
+                if row is None:
+                    row = self.keys[key] = len(self.names)
+                    self.names.append((item.get('name') or {}).get('de') or "n/a")
+                    self.urls.append((item.get('address') or {}).get('url'))
+                    self.lats.append(lat)
+                    self.lons.append(lon)
+                rows.append(row)
+
+            membership = np.zeros((len(self.names), max(word + 1, self._membership.shape[1])), dtype=np.uint64)
+            membership[:self._membership.shape[0], :self._membership.shape[1]] = self._membership
+            # a refreshed endpoint replaces its previous members
+            membership[:, word] &= ~mask
+            membership[rows, word] |= mask
+            self._membership = membership
+            self._snapshot = (np.array(self.names, dtype=object), np.array(self.urls, dtype=object),
+                              np.array(self.lats, dtype=np.float64), np.array(self.lons, dtype=np.float64),
+                              membership)
+            self.ingested[str(api_id)] = time.time()
+            print(f'Indexed {len(rows)} POIs of endpoint {api_id}, {len(self.names)} unique POIs in total')
+
+    def select(self, api_ids):
+        """DataFrame (names, infos, lats, longs) of the POIs belonging to any of the given endpoints"""
+        names, urls, lats, lons, membership = self._snapshot
+        selected = np.zeros(len(names), dtype=bool)
+        for api_id in api_ids:
+            bit = self.bits.get(str(api_id))
+            if bit is not None and bit // 64 < membership.shape[1]:
+                selected |= (membership[:, bit // 64] & np.uint64(1 << (bit % 64))) != 0
+        return pd.DataFrame(dict(names=names[selected], infos=urls[selected],
+                                 lats=lats[selected], longs=lons[selected]))
+
+
+zueri_poi_index = ZueriPOIIndex()
+
+
 def load_transform_save_antenna_data():
+    import geopandas as gpd
     # Prepare antenna data
     filepath = 'static/antennenstandorte-5g_de.json'
     ant_gdf = gpd.read_file(filepath)
 
     # Use WGS 84 (epsg:4326) as the geographic coordinate system
-    ant_gdf = ant_gdf.to_crs(epsg=4326)
+    ant_gdf = to_crs(ant_gdf, WGS84)
 
     # Convert powercode_de to integer value
     # dictionary to convert antenna power data
@@ -73,7 +213,82 @@ def load_transform_save_antenna_data():
     ant_gdf.to_file("static/ant_gdf.json", driver='GeoJSON')
 
 
+def assign_points_to_polygons(points, polygons):
+    # Index of the polygon containing each point, points outside all polygons (e.g. on the border) get the nearest one
+    tree = shapely.STRtree(polygons)
+    point_idx, polygon_idx = tree.query(points, predicate="within")
+    assignment = np.full(len(points), -1, dtype=np.int64)
+    assignment[point_idx] = polygon_idx
+    missing = np.flatnonzero(assignment < 0)
+    if len(missing):
+        point_idx, polygon_idx = tree.query_nearest(points[missing], all_matches=False)
+        assignment[missing[point_idx]] = polygon_idx
+    return assignment
+
+
+def count_points_in_shapes(dataset, lons, lats):
+    # Number of points within each polygon of a boundary dataset, runs in the task pool (see task_pool)
+    from data_registry import registry
+    gdf = registry.get(dataset)
+    tree = _shape_trees.get(dataset)
+    if tree is None:
+        tree = _shape_trees[dataset] = shapely.STRtree(gdf.geometry.values)
+    _, polygon_idx = tree.query(shapely.points(lons, lats), predicate="within")
+    return np.bincount(polygon_idx, minlength=len(gdf))
+
+
+_shape_trees = {}
+
+
+def interpolate_surface(x, y, z, method="linear", size=100):
+    # Altitude grid interpolated from scattered points, runs in the task pool (see task_pool)
+    from scipy.interpolate import griddata
+    xi = np.linspace(x.min(), x.max(), size)
+    yi = np.linspace(y.min(), y.max(), size)
+    X, Y = np.meshgrid(xi, yi)
+    return xi, yi, griddata((x, y), z, (X, Y), method=method)
+
+
+def load_transform_save_antenna_coverage(ant_gdf=None, filepath="static/antenna_coverage.csv"):
+    """
+    Precomputes the 5G antenna coverage per Kanton, Bezirk and Gemeinde: antenna count and power weighted count
+    (power_int), both per 1000 inhabitants and per km². Rows follow the order of the boundary layer files.
+    """
+    import geopandas as gpd
+    if ant_gdf is None:
+        ant_gdf = gpd.read_file("static/ant_gdf.json")
+    points = shapely.points(ant_gdf["lon"].to_numpy(), ant_gdf["lat"].to_numpy())
+    power = ant_gdf["power_int"].fillna(0).to_numpy(dtype=float)
+
+    coverage = []
+    for level, shape_file in COVERAGE_LEVELS.items():
+        print(f"Computing antenna coverage for {level}...")
+        gdf = gpd.read_file(shape_file)
+        assignment = assign_points_to_polygons(points, gdf.geometry.values)
+        antennas = np.bincount(assignment, minlength=len(gdf))
+        weighted = np.bincount(assignment, weights=power, minlength=len(gdf))
+        # Area in km² from the LV95 projection (the layers are stored in WGS84)
+        area = shapely.area(transform_geometries(gdf.geometry.values, gdf.crs, LV95)) / 1e6
+        inhabitants = gdf["EINWOHNERZ"].fillna(0).to_numpy(dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            coverage.append(pd.DataFrame({
+                "level": level,
+                "row": np.arange(len(gdf)),
+                "NAME": gdf["NAME"],
+                "antennas": antennas,
+                "power": weighted,
+                "antennas_per_1000": np.where(inhabitants > 0, antennas / inhabitants * 1000, np.nan),
+                "power_per_1000": np.where(inhabitants > 0, weighted / inhabitants * 1000, np.nan),
+                "antennas_per_km2": np.where(area > 0, antennas / area, np.nan),
+                "power_per_km2": np.where(area > 0, weighted / area, np.nan),
+            }))
+    coverage = pd.concat(coverage, ignore_index=True)
+    coverage.to_csv(filepath, index=False)
+    return coverage
+
+
 def load_transform_save_political_shape_geo_data():
+    import geopandas as gpd
     # Set the file path to the shapefile
     # shapefile = "static/Grenzen.shp/swissBOUNDARIES3D_1_5_TLM_BEZIRKSGEBIET.shp"
     # shapefile = "static/Grenzen.shp/swissBOUNDARIES3D_1_5_TLM_KANTONSGEBIET.shp"
@@ -81,10 +296,8 @@ def load_transform_save_political_shape_geo_data():
     # load Shape file into GeoDataFrame
     gdf = gpd.GeoDataFrame.from_file(shapefile)
 
-    # Convert to WGS84
-    gdf.crs = "EPSG:2056"  # Use CH1903+ / LV95 (epsg:2056)
-    # Use WGS84 (epsg:4326) as the geographic coordinate system
-    gdf = gdf.to_crs(epsg=4326)
+    # Convert from CH1903+ / LV95 (epsg:2056) to WGS84 (epsg:4326)
+    gdf = to_crs(gdf, WGS84, src=LV95)
 
     # print(gdf.columns)
     gdf['DICHTE'] = gdf['EINWOHNERZ'] / gdf['KANTONSFLA'] * 1000  # BEZIRKSFLA, KANTONSFLA
@@ -96,20 +309,53 @@ def load_transform_save_political_shape_geo_data():
     gdf.to_file("static/gdf_gem.json", driver='GeoJSON')
 
 
-def load_transform_ev_station_data():
+def get_ev_station_records():
     print("Loading EV data from URL...")
     url = "https://data.geo.admin.ch/ch.bfe.ladestellen-elektromobilitaet/data/oicp/ch.bfe.ladestellen-elektromobilitaet.json"
-    response = requests.get(url)
+    with upstream_timer("ev_static"):
+        response = requests.get(url)
     data = response.json()
-    stations = data.get("EVSEData")[0].get("EVSEDataRecord")
+    return data.get("EVSEData")[0].get("EVSEDataRecord")
+
+
+def plug_type_bit(plug):
+    for pattern, plug_type in PLUG_TYPE_PATTERNS:
+        if pattern in plug:
+            return PLUG_TYPE_BITS[plug_type]
+    return PLUG_TYPE_BITS["Other"]
+
+
+def plug_type_masks(plug_lists):
+    # Dictionary encoding: every distinct plug name is classified once, stations get the OR of their plug bits
+    codes = {}
+    masks = np.zeros(len(plug_lists), dtype=np.uint8)
+    for i, plugs in enumerate(plug_lists):
+        for plug in plugs:
+            bit = codes.get(plug)
+            if bit is None:
+                bit = codes[plug] = plug_type_bit(plug)
+            masks[i] |= bit
+    return masks
 
+
+def plug_type_filter(masks, plug_types):
+    # Stations offering any of the given plug types (all stations if none are given)
+    selected_bits = sum(PLUG_TYPE_BITS[plug_type] for plug_type in plug_types or [])
+    if not selected_bits:
+        return np.ones(len(masks), dtype=bool)
+    return (np.asarray(masks, dtype=np.uint8) & selected_bits) != 0
+
+
+def transform_ev_station_records(stations):
     station_ids = []
     coordinates = []
     plugs = []
+    plug_lists = []
     names = []
     for station in stations:
         station_ids.append(station.get("EvseID"))
         current_plugs = [station for station in station.get("Plugs")]
+        plug_lists.append([str(plug) for plug in current_plugs])
         coordinates.append(station.get("GeoCoordinates").get("Google"))
         # plugs.append({str(i):str(station) for i, station in enumerate(station.get("Plugs"))})
         plugs_str = ", ".join([str(plug) for plug in current_plugs])
@@ -117,18 +363,21 @@ def load_transform_ev_station_data():
         names.append(station.get("ChargingStationNames")[0].get("value"))
 
     print("Data Size: ", len(coordinates))
-    print("Sample coordinates: ", coordinates[:5])
-    print("Sample plug count: ", plugs[:5])
-    print("Sample names: ", names[:5])
-
-    ev_gdf = gpd.GeoDataFrame(geometry=GeoSeries())
-    ev_gdf['EvseID'] = station_ids
-    ev_gdf['name'] = names
-    ev_gdf['lat'] = [float(coord.split(" ")[0]) for coord in coordinates]
-    ev_gdf['lon'] = [float(coord.split(" ")[1]) for coord in coordinates]
-    ev_gdf['plugs'] = plugs
-    ev_gdf['geometry'] = [Point(xy) for xy in zip(ev_gdf['lon'], ev_gdf['lat'])]
-    ev_gdf.set_geometry('geometry')
+
+    ev_df = pd.DataFrame()
+    ev_df['EvseID'] = station_ids
+    ev_df['name'] = names
+    ev_df['lat'] = [float(coord.split(" ")[0]) for coord in coordinates]
+    ev_df['lon'] = [float(coord.split(" ")[1]) for coord in coordinates]
+    ev_df['plugs'] = plugs
+    ev_df['plug_mask'] = plug_type_masks(plug_lists)
+    return ev_df
+
+
+def load_transform_ev_station_data():
+    import geopandas as gpd
+    ev_df = transform_ev_station_records(get_ev_station_records())
+    ev_gdf = gpd.GeoDataFrame(ev_df, geometry=[Point(xy) for xy in zip(ev_df['lon'], ev_df['lat'])])
 
     # save to json file
     ev_gdf.to_file("static/ev_gdf.json", driver='GeoJSON')
@@ -139,7 +388,8 @@ def get_live_ev_station_data():
     print("Loading EV data from URL...")
     # Ladestationen verfügbarkeit
     url = "https://data.geo.admin.ch/ch.bfe.ladestellen-elektromobilitaet/status/oicp/ch.bfe.ladestellen-elektromobilitaet.json"
-    response = requests.get(url)
+    with upstream_timer("ev_live"):
+        response = requests.get(url)
     data = response.json()
     stations = data.get("EVSEStatuses")[0].get("EVSEStatusRecord")
     live_ev_df = pd.DataFrame(stations)
@@ -149,13 +399,13 @@ def get_live_ev_station_data():
 
 
 def load_map_save_antenna_data():
+    import geopandas as gpd
     print("Loading mobile antenna data...")
     filepath = "static/mobilfunkanlagen.json"
     gdf = gpd.read_file(filepath)
 
     print("Converting to epsg4326...")
-    gdf.set_crs(epsg=2056, inplace=True)
-    gdf = gdf.to_crs(epsg=4326)
+    gdf = to_crs(gdf, WGS84, src=LV95)
 
     print("Columns: ", gdf.columns)
     print("Shape: ", gdf.shape)
@@ -169,12 +419,85 @@ def load_map_save_antenna_data():
                   "Leistungsklasse : gross (über 5'000 W)": 10,}
     gdf["power_code"] = gdf["power_de"].map(power_dict)
 
-    gdf = gdf[['geometry', 'typ_de', 'techno_de', 'power_de', 'power_code']]
+    print("Computing technology bitmask...")
+    gdf["techno_mask"] = antenna_technology_mask(gdf["techno_de"])
+
+    gdf = gdf[['geometry', 'typ_de', 'techno_de', 'power_de', 'power_code', 'techno_mask']]
 
     # Save as GeoJSON
     gdf.to_file("static/mobilfunk.json", driver="GeoJSON")
+
+    # Save the map layers ready to use by the mobile network page
+    save_antenna_layers(build_antenna_layers(gdf))
     print("Done.")
 
+
+def antenna_technology_mask(techno):
+    # Bitmask of the technologies listed in the techno_de column (e.g. "3G, 4G, 5G" -> 7)
+    mask = np.zeros(len(techno), dtype=np.uint8)
+    for technology, bit in TECHNOLOGY_BITS.items():
+        mask |= techno.str.contains(technology).to_numpy(dtype=bool) * np.uint8(bit)
+    return mask
+
+
+def build_antenna_layers(gdf):
+    """
+    Splits the antennas into one layer per technology. The layers are stored back to back in contiguous arrays,
+    slices[technology] gives the (start, stop) range of a layer.
+    """
+    if "techno_mask" in gdf.columns:
+        mask = gdf["techno_mask"].to_numpy(dtype=np.uint8)
+    else:
+        mask = antenna_technology_mask(gdf["techno_de"])
+
+    # Dictionary encode the tooltip columns, the strings are only materialized when the layers are loaded
+    codes = []
+    tables = []
+    for column in ANTENNA_CUSTOMDATA_COLUMNS:
+        column_codes, table = pd.factorize(gdf[column])
+        codes.append(column_codes)
+        tables.append(np.asarray(table, dtype=str))
+    codes = np.stack(codes, axis=1).astype(np.int32)
+
+    # Row order: all 3G antennas, then all 4G antennas, then all 5G antennas
+    order = np.concatenate([np.flatnonzero(mask & bit) for bit in TECHNOLOGY_BITS.values()])
+    counts = [np.count_nonzero(mask & bit) for bit in TECHNOLOGY_BITS.values()]
+
+    return dict(
+        lat=gdf.geometry.y.to_numpy()[order],
+        lon=gdf.geometry.x.to_numpy()[order],
+        size=gdf["power_code"].to_numpy()[order],
+        codes=codes[order],
+        techno_mask=mask[order],
+        offsets=np.concatenate([[0], np.cumsum(counts)]),
+        count=np.array(len(gdf)),
+        **{f"table_{column}": table for column, table in zip(ANTENNA_CUSTOMDATA_COLUMNS, tables)},
+    )
+
+
+def save_antenna_layers(layers, filepath="static/mobilfunk_layers.npz"):
+    np.savez_compressed(filepath, **layers)
+
+
+def load_antenna_layers(layers):
+    # Materializes the customdata array and the per technology slices from the stored layer arrays
+    tables = [layers[f"table_{column}"].astype(object) for column in ANTENNA_CUSTOMDATA_COLUMNS]
+    customdata = np.empty(layers["codes"].shape, dtype=object)
+    for i, table in enumerate(tables):
+        customdata[:, i] = table[layers["codes"][:, i]]
+    offsets = layers["offsets"]
+    return dict(
+        lat=layers["lat"],
+        lon=layers["lon"],
+        size=layers["size"],
+        customdata=customdata,
+        codes=layers["codes"],
+        tables=dict(zip(ANTENNA_CUSTOMDATA_COLUMNS, tables)),
+        techno_mask=layers["techno_mask"],
+        slices={technology: (int(offsets[i]), int(offsets[i + 1])) for i, technology in enumerate(TECHNOLOGY_BITS)},
+        count=int(layers["count"]),
+    )
+
 if __name__ == "__main__":
     # load_transform_save_antenna_data()
     # load_transform_save_political_shape_geo_data()
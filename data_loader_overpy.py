@@ -1,7 +1,8 @@
 import os
 import json
 import time
-import overpy
+
+from metrics import record_cache, upstream_timer
 
 
 def get_tag_keys_values_options():
@@ -23,48 +24,109 @@ def get_country_codes():
     return sorted(country_codes)
 
 
-def get_data_overpy(country_iso_a2, tag_key, tag_value):
-    names = []
-    lats = []
-    longs = []
-    websites = []
-    temp_dir = "temp"
-    file_path = f'{temp_dir}/{country_iso_a2}_{tag_key}_{tag_value}.json'
+# Cached results are refreshed after CACHE_MAX_AGE with an incremental query for the nodes changed since the cached
+# snapshot, deleted nodes (or nodes that lost the tag) are only removed by a full query every RECONCILE_INTERVAL
+CACHE_MAX_AGE = 60 * 60 * 24
+RECONCILE_INTERVAL = 60 * 60 * 24 * 7
+# The snapshot timestamp is taken a bit before the query to cover the replication delay of the Overpass server
+SNAPSHOT_MARGIN = 60 * 60
+COLUMNS = ["ids", "names", "longs", "lats", "websites"]
+
+
+def overpass_timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
 
-    # if cached version exists and is not older than 24h, load from file
-    if os.path.exists(file_path) and os.path.getctime(file_path) > time.time() - (60 * 60 * 24):
-        print('Loading cached data...')
-        with open(file_path, 'r') as f:
-            data_dict = json.load(f)
 
-    else:
-        print('No cached data found, retrieving fresh API data...')
-        api = overpy.Overpass()
+def query_overpass(country_iso_a2, tag_key, tag_value, newer_than=None):
+    # Nodes with the tag in the country, only the ones created or modified after newer_than if given
+    newer = f'(newer:"{overpass_timestamp(newer_than)}")' if newer_than else ""
+    import overpy  # imported with the first query, not at startup
+    api = overpy.Overpass()
+    with upstream_timer("overpass_incremental" if newer_than else "overpass"):
         r = api.query("""
                 ( area["ISO3166-1"="{0}"][admin_level=2]; )->.searchArea;
-                ( node[{1}={2}]( area.searchArea );
+                ( node[{1}={2}]( area.searchArea ){3};
                 );
-                out center;""".format(country_iso_a2, tag_key, tag_value))
-        #print(f"Received {len(r.nodes)} nodes for {tag_value}")
-        for node in r.nodes:
-            try:  # not all entries have a name
-                names.append(node.tags.get('name'))
-            except KeyError:
-                names.append("n/a")
-
-            longs.append(float(node.lon))
-            lats.append(float(node.lat))
-            websites.append(node.tags.get('website'))
-
-        data_dict = dict(
-            names=names,
-            longs=longs,
-            lats=lats,
-            websites=websites
-        )
-
-        if len(data_dict['longs']) > 0:
-            with open(file_path, 'w') as f:
-                json.dump(data_dict, f)
+                out center;""".format(country_iso_a2, tag_key, tag_value, newer))
+    data_dict = {column: [] for column in COLUMNS}
+    for node in r.nodes:
+        data_dict["ids"].append(node.id)
+        data_dict["names"].append(node.tags.get('name'))
+        data_dict["longs"].append(float(node.lon))
+        data_dict["lats"].append(float(node.lat))
+        data_dict["websites"].append(node.tags.get('website'))
+    return data_dict
+
+
+def merge_nodes(data_dict, changed):
+    # Replaces the changed nodes in the cached columns by node id and appends the new ones
+    rows = {node_id: i for i, node_id in enumerate(data_dict["ids"])}
+    merged = {column: list(data_dict[column]) for column in COLUMNS}
+    for i, node_id in enumerate(changed["ids"]):
+        row = rows.get(node_id)
+        if row is None:
+            rows[node_id] = len(merged["ids"])
+            for column in COLUMNS:
+                merged[column].append(changed[column][i])
+        else:
+            for column in COLUMNS:
+                merged[column][row] = changed[column][i]
+    return merged
+
+
+def overpass_cache_path(country_iso_a2, tag_key, tag_value):
+    return f'temp/{country_iso_a2}_{tag_key}_{tag_value}.json'
+
+
+def overpass_cache_age(country_iso_a2, tag_key, tag_value):
+    # Seconds since the cached result was fetched, None if there is no cached result. The file is written right after
+    # the query (and restored with its modification time from the data snapshot), its mtime saves parsing the file.
+    file_path = overpass_cache_path(country_iso_a2, tag_key, tag_value)
+    if not os.path.exists(file_path):
+        return None
+    return time.time() - os.path.getmtime(file_path)
+
+
+def get_data_overpy(country_iso_a2, tag_key, tag_value, max_age=CACHE_MAX_AGE):
+    file_path = overpass_cache_path(country_iso_a2, tag_key, tag_value)
+
+    cached = None
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as f:
+            cached = json.load(f)
+    meta = (cached or {}).get("meta") or {}
+    fetched_at = meta.get("fetched_at", os.path.getctime(file_path) if cached else 0)
+
+    # if cached version exists and is not older than 24h, use it as is
+    if cached and fetched_at > time.time() - max_age:
+        print('Loading cached data...')
+        record_cache("overpass", True)
+        return {column: cached[column] for column in COLUMNS if column in cached}
+
+    record_cache("overpass", False)
+    now = time.time()
+    try:
+        # Snapshots without node ids (older cache format) or due for reconciliation are fetched completely
+        if cached and "ids" in cached and meta.get("reconciled_at", 0) > now - RECONCILE_INTERVAL:
+            print('Cached data expired, retrieving changed nodes...')
+            changed = query_overpass(country_iso_a2, tag_key, tag_value, newer_than=meta["snapshot"])
+            print(f"Merging {len(changed['ids'])} changed nodes for {tag_value}")
+            data_dict = merge_nodes(cached, changed)
+            reconciled_at = meta["reconciled_at"]
+        else:
+            print('No cached data found, retrieving fresh API data...')
+            data_dict = query_overpass(country_iso_a2, tag_key, tag_value)
+            reconciled_at = now
+    except Exception as e:
+        if not cached:
+            raise
+        # Overpass unreachable or busy, the expired result (e.g. from the data snapshot) is used until it answers
+        print(f'Overpass query failed ({e}), using expired cached data...')
+        return {column: cached[column] for column in COLUMNS if column in cached}
+
+    if len(data_dict['longs']) > 0:
+        meta = {"fetched_at": now, "snapshot": now - SNAPSHOT_MARGIN, "reconciled_at": reconciled_at}
+        with open(file_path, 'w') as f:
+            json.dump(dict(data_dict, meta=meta), f)
 
     return data_dict
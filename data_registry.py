@@ -0,0 +1,273 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from metrics import Gauge, record_cache
+from reprojection import LV95, WGS84, to_crs, transform_xy
+
+
+class Dataset:
+    """A named dataset that is loaded at most once per process, on first use."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.loaded = False
+        self.load_time = None
+        self.memory_bytes = None
+        # counted without a lock on the fast path, approximate under concurrency
+        self.hits = 0
+        self.loads = 0
+        self.lock = threading.Lock()
+
+
+def memory_footprint(value):
+    # Approximate in-memory size of a loaded dataset in bytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        size = int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+        gpd = sys.modules.get("geopandas")  # not imported at startup, there is no GeoDataFrame before it is
+        if gpd and isinstance(value, gpd.GeoDataFrame):
+            # pandas only counts the geometry pointers, add the coordinates held by the shapely objects
+            geoms = value.geometry.values
+            size += int(shapely.get_num_coordinates(geoms).sum()) * (24 if geoms.has_z.any() else 16)
+        return size
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(memory_footprint(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+# Memory footprint of the datasets before compaction
+raw_memory = {}
+
+
+def compact_geodataframe(gdf, name, columns, precise=()):
+    """
+    Compacts a loaded GeoDataFrame: keeps only the given columns, downcasts numerics (integral values to the smallest
+    integer type, other floats to float32 except the `precise` ones), turns repeated strings into categoricals and
+    drops Z coordinates that the 2D maps never use.
+    """
+    before = memory_footprint(gdf)
+    gdf = gdf[list(columns) + [gdf.geometry.name]].copy()
+    for column in columns:
+        values = gdf[column]
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_numeric_dtype(values):
+            if values.notna().all() and (values == values.round()).all():
+                gdf[column] = pd.to_numeric(values, downcast="integer")
+            elif column not in precise:
+                gdf[column] = values.astype(np.float32)
+        elif pd.api.types.is_object_dtype(values) and values.nunique() < len(values) / 2:
+            gdf[column] = values.astype("category")
+    if gdf.geometry.has_z.any():
+        gdf[gdf.geometry.name] = shapely.force_2d(gdf.geometry.values)
+    raw_memory[name] = before
+    print(f"Compacted dataset {name}: {before / 1024 / 1024:.1f} MB -> "
+          f"{memory_footprint(gdf) / 1024 / 1024:.1f} MB")
+    return gdf
+
+
+class DatasetRegistry:
+    """
+    Central registry of the datasets used by the pages.
+    Loaded values are shared between all pages and must be treated as read-only,
+    callers that need to modify a dataset have to work on a copy.
+    """
+
+    def __init__(self):
+        self._datasets = {}
+
+    def register(self, name, loader):
+        self._datasets[name] = Dataset(name, loader)
+
+    def names(self):
+        return list(self._datasets.keys())
+
+    def is_loaded(self, name):
+        return self._datasets[name].loaded
+
+    def get(self, name):
+        dataset = self._datasets[name]
+        # Fast path, no locking once the dataset is in memory. The value is read before the flag: reset clears the
+        # flag first, so a value read while the flag is still set is never the cleared one.
+        value = dataset.value
+        if dataset.loaded:
+            dataset.hits += 1
+            record_cache("datasets", True)
+            return value
+        with dataset.lock:
+            if not dataset.loaded:
+                record_cache("datasets", False)
+                self._load(dataset)
+            else:
+                dataset.hits += 1
+                record_cache("datasets", True)
+            return dataset.value
+
+    def preload(self, names=None):
+        for name in names or self.names():
+            self.get(name)
+
+    def reset(self, name):
+        # Drop a loaded dataset so that it is reloaded on next use (e.g. after the source file changed)
+        dataset = self._datasets[name]
+        with dataset.lock:
+            dataset.loaded = False
+            dataset.value = None
+
+    def stats(self):
+        return {name: {"loaded": d.loaded,
+                       "load_time": d.load_time,
+                       "memory_bytes": d.memory_bytes,
+                       "raw_memory_bytes": raw_memory.get(name, d.memory_bytes),
+                       "hits": d.hits,
+                       "loads": d.loads}
+                for name, d in self._datasets.items()}
+
+    @staticmethod
+    def _load(dataset):
+        print(f"Loading dataset {dataset.name}...")
+        start = time.perf_counter()
+        value = dataset.loader()
+        dataset.load_time = time.perf_counter() - start
+        dataset.memory_bytes = memory_footprint(value)
+        dataset.value = value
+        dataset.loads += 1
+        dataset.loaded = True
+        print(f"Loaded dataset {dataset.name} in {dataset.load_time:.2f}s "
+              f"({dataset.memory_bytes / 1024 / 1024:.1f} MB)")
+
+
+def read_file(path):
+    # geopandas is imported with the first dataset that needs it, not at startup
+    import geopandas as gpd
+    return gpd.read_file(path)
+
+
+def load_landscape_data():
+    gdf = read_file("static/landschaft.gpkg")
+    gdf = compact_geodataframe(gdf, "landschaft", ["OBJECT", "TYP_NR", "TYPNAME_DE", "REGNAME_DE"])
+    return to_crs(gdf, WGS84, src=LV95)
+
+
+def load_landscape_types():
+    # Landscape type numbers, read from the attribute table only (the map draws the polygons from the vector tiles)
+    import pyogrio
+    df = pyogrio.read_dataframe("static/landschaft.gpkg", columns=["TYP_NR"], read_geometry=False)
+    return sorted(df["TYP_NR"].unique().tolist())
+
+
+def load_landscape_points():
+    # Representative point and hover properties of each landscape object
+    gdf = registry.get("landschaft")
+    points = gdf.geometry.representative_point()
+    df = pd.DataFrame(gdf[["OBJECT", "TYPNAME_DE", "REGNAME_DE"]])
+    df["lat"], df["lon"] = points.y.to_numpy(), points.x.to_numpy()
+    return df
+
+
+def load_boundaries(name):
+    gdf = read_file(f"static/{name}.json")
+    return compact_geodataframe(gdf, name, BOUNDARY_COLUMNS[name])
+
+
+def load_altitude_points():
+    # Exterior ring coordinates (x, y, altitude) of the Kantone, used by the 3D map
+    gdf = read_file("static/gdf_kan.json")
+    polygons = shapely.get_parts(gdf.geometry.values)
+    coordinates = shapely.get_coordinates(shapely.get_exterior_ring(polygons), include_z=True)
+    return {"x": coordinates[:, 0], "y": coordinates[:, 1], "z": coordinates[:, 2]}
+
+
+def load_antennas():
+    gdf = read_file("static/ant_gdf.json")
+    return compact_geodataframe(gdf, "ant_gdf", ["lat", "lon", "power_int", "powercode_de"], precise=["lat", "lon"])
+
+
+def load_wind_turbines():
+    df = pd.read_csv("static/wind-turb.csv", encoding="latin-1")
+    df["status"] = df["operationalStatus"].str.replace("operationalStatus_", "").str.capitalize()
+    # LV95 coordinates of the turbines
+    df["lon"], df["lat"] = transform_xy(df["x"].to_numpy(), df["y"].to_numpy(), LV95, WGS84)
+    return df
+
+
+def load_mobile_antenna_layers():
+    from data_loader import build_antenna_layers, load_antenna_layers, save_antenna_layers
+    filepath = "static/mobilfunk_layers.npz"
+    if not os.path.exists(filepath):
+        # Layers are written by data_loader.load_map_save_antenna_data, build them from the GeoJSON if missing
+        save_antenna_layers(build_antenna_layers(read_file("static/mobilfunk.json")), filepath)
+    with np.load(filepath) as layers:
+        return load_antenna_layers(dict(layers))
+
+
+def build_mobile_antenna_clusters():
+    from point_clustering import ClusterIndex
+    layers = registry.get("mobilfunk_layers")
+    return {technology: ClusterIndex(layers["lat"][start:stop], layers["lon"][start:stop])
+            for technology, (start, stop) in layers["slices"].items()}
+
+
+def load_antenna_coverage():
+    from data_loader import load_transform_save_antenna_coverage
+    filepath = "static/antenna_coverage.csv"
+    if os.path.exists(filepath):
+        coverage = pd.read_csv(filepath)
+    else:
+        coverage = load_transform_save_antenna_coverage(registry.get("ant_gdf"), filepath)
+    # {level: coverage table with one row per shape, in the order of the boundary layer}
+    return {level: df.set_index("row").sort_index() for level, df in coverage.groupby("level")}
+
+
+registry = DatasetRegistry()
+
+# Columns of the boundary layers used by the pages (population, density, 5G coverage)
+BOUNDARY_COLUMNS = {"gdf_kan": ["NAME", "EINWOHNERZ", "DICHTE", "KANTONSFLA"],
+                    "gdf_bez": ["NAME", "EINWOHNERZ", "DICHTE", "BEZIRKSFLA"],
+                    "gdf_gem": ["NAME", "EINWOHNERZ", "DICHTE", "GEMEINDEFLA"]}
+
+# Expose the registry stats on the /metrics endpoint
+Gauge("dataset_memory_bytes", "Approximate memory footprint of a loaded dataset.", ("dataset",),
+      lambda: {(name, ): s["memory_bytes"] for name, s in registry.stats().items()})
+Gauge("dataset_load_seconds", "Time it took to load a dataset.", ("dataset",),
+      lambda: {(name, ): s["load_time"] for name, s in registry.stats().items()})
+Gauge("dataset_raw_memory_bytes", "Approximate memory footprint of a dataset before compaction.", ("dataset",),
+      lambda: {(name, ): s["raw_memory_bytes"] for name, s in registry.stats().items()})
+Gauge("dataset_hits", "Approximate number of times a loaded dataset was served from memory.", ("dataset",),
+      lambda: {(name, ): s["hits"] for name, s in registry.stats().items()})
+
+# Political boundaries (pre-processed, see data_loader.load_transform_save_political_shape_geo_data)
+registry.register("gdf_kan", lambda: load_boundaries("gdf_kan"))
+registry.register("gdf_bez", lambda: load_boundaries("gdf_bez"))
+registry.register("gdf_gem", lambda: load_boundaries("gdf_gem"))
+registry.register("kan_altitude_points", load_altitude_points)
+# Antennas (pre-processed, see data_loader.load_transform_save_antenna_data and load_map_save_antenna_data)
+registry.register("ant_gdf", load_antennas)
+registry.register("antenna_coverage", load_antenna_coverage)
+registry.register("mobilfunk", lambda: read_file("static/mobilfunk.json"))
+registry.register("mobilfunk_layers", load_mobile_antenna_layers)
+registry.register("mobilfunk_clusters", build_mobile_antenna_clusters)
+# Landscape types
+registry.register("landschaft", load_landscape_data)
+registry.register("landschaft_types", load_landscape_types)
+registry.register("landschaft_points", load_landscape_points)
+registry.register("wind_turbines", load_wind_turbines)
+
+
+if __name__ == "__main__":
+    registry.preload()
+    for name, s in registry.stats().items():
+        print(f"{name:20} {s['load_time']:6.2f}s {s['raw_memory_bytes'] / 1024 / 1024:8.1f} MB -> "
+              f"{s['memory_bytes'] / 1024 / 1024:8.1f} MB")
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+from data_loader import get_ev_station_records, get_live_ev_station_data, plug_type_masks, \
+    transform_ev_station_records
+from metrics import Gauge, record_cache
+
+EV_CATALOGUE_FILE = "static/ev_gdf.json"
+# Columns compared to detect a changed station
+EV_CONTENT_COLUMNS = ["name", "lat", "lon", "plugs"]
+# Coordinates are compared at this precision (about 0.1 m), the saved GeoJSON catalogue does not round-trip floats
+COORDINATE_DECIMALS = 6
+EV_LIVE_FILE = "static/live_ev_df.json"
+
+
+def content_hashes(df):
+    # Hash of the content of each station, indexed by EvseID
+    content = df[EV_CONTENT_COLUMNS].copy()
+    content[["lat", "lon"]] = content[["lat", "lon"]].astype(float).round(COORDINATE_DECIMALS)
+    return pd.Series(pd.util.hash_pandas_object(content, index=False).to_numpy(),
+                     index=df["EvseID"].to_numpy())
+
+
+class EVCatalogue:
+    """
+    EV charging station catalogue kept in memory and refreshed in a background thread.
+    A refresh diffs the downloaded records against the current version by EvseID and content hash and applies only
+    the added, removed and changed stations. The new version is swapped in as a whole, readers always get a complete
+    catalogue and never wait for a refresh (except for the very first load when there is no saved catalogue).
+    """
+
+    def __init__(self, filepath=EV_CATALOGUE_FILE, refresh_interval=60 * 60 * 4):
+        self.filepath = filepath
+        self.refresh_interval = refresh_interval
+        # (version, stations DataFrame, content hashes, time of the last successful refresh)
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_diff = {"added": 0, "removed": 0, "changed": 0}
+
+    @property
+    def version(self):
+        return self._snapshot[0] if self._snapshot else 0
+
+    @property
+    def updated_at(self):
+        return self._snapshot[3] if self._snapshot else None
+
+    def get(self):
+        return self.get_versioned()[1]
+
+    def get_versioned(self):
+        # (version, stations) of the same catalogue version, for callers caching data derived from the stations
+        snapshot = self._snapshot
+        record_cache("ev_static", snapshot is not None)
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._bootstrap()
+            snapshot = self._snapshot
+        self.start()
+        return snapshot[0], snapshot[1]
+
+    def _bootstrap(self):
+        # Start from the saved catalogue if there is one (refreshed in the background when outdated)
+        if os.path.exists(self.filepath):
+            import geopandas as gpd
+            print("Loading saved EV station catalogue...")
+            df = pd.DataFrame(gpd.read_file(self.filepath).drop(columns="geometry"))
+            if "plug_mask" not in df:
+                df["plug_mask"] = plug_type_masks(df["plugs"].map(lambda plugs: plugs.split(", ") if plugs else []))
+            df["plug_mask"] = df["plug_mask"].astype("uint8")
+            self._swap(df, os.path.getmtime(self.filepath))
+        else:
+            self.refresh()
+
+    def _swap(self, df, updated_at):
+        df = df.reset_index(drop=True)
+        self._snapshot = (self.version + 1, df, content_hashes(df), updated_at)
+
+    def refresh(self):
+        print("Refreshing EV station catalogue...")
+        incoming = transform_ev_station_records(get_ev_station_records())
+        incoming = incoming.drop_duplicates("EvseID", keep="last")
+        new_hashes = content_hashes(incoming)
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            self._swap(incoming, time.time())
+            self.save()
+            return self.last_diff
+
+        _, current, hashes, _ = snapshot
+        added = new_hashes.index.difference(hashes.index)
+        removed = hashes.index.difference(new_hashes.index)
+        common = new_hashes.index.intersection(hashes.index)
+        changed = common[new_hashes[common].to_numpy() != hashes[common].to_numpy()]
+        self.last_diff = {"added": len(added), "removed": len(removed), "changed": len(changed)}
+        print(f"EV catalogue diff: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+
+        if len(added) or len(removed) or len(changed):
+            # unchanged stations keep their position, changed ones are replaced in place, new ones are appended
+            df = current[~current["EvseID"].isin(removed)].set_index("EvseID")
+            updates = incoming.set_index("EvseID")
+            df.loc[changed, updates.columns] = updates.loc[changed, updates.columns]
+            df = pd.concat([df, updates.loc[added]]).rename_axis("EvseID").reset_index()
+            self._swap(df, time.time())
+            self.save()
+        else:
+            self._snapshot = snapshot[:3] + (time.time(),)
+        return self.last_diff
+
+    def save(self):
+        # Saved catalogue used to start quickly after a restart, written to a temporary file and then replaced
+        import geopandas as gpd
+        df = self._snapshot[1]
+        gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["lon"], df["lat"]), crs="EPSG:4326")
+        tmp_path = f"{self.filepath}.tmp"
+        gdf.to_file(tmp_path, driver="GeoJSON")
+        os.replace(tmp_path, self.filepath)
+
+    def start(self):
+        # Starts the background refresh thread once
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="ev-catalogue-refresh", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            updated_at = self.updated_at or 0
+            time.sleep(max(0, updated_at + self.refresh_interval - time.time()))
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"EV catalogue refresh failed: {e}")
+                time.sleep(60)
+
+
+class EVLiveStatus:
+    """
+    Live status of the chargers (EvseID, EVSEStatus) kept in memory.
+    Once older than max_age the status is refreshed in a background thread, readers get the previous version in the
+    meantime and only wait for the very first load when there is no saved status.
+    """
+
+    def __init__(self, filepath=EV_LIVE_FILE, max_age=60):
+        self.filepath = filepath
+        self.max_age = max_age
+        # (version, live status DataFrame, time of the download)
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def version(self):
+        return self._snapshot[0] if self._snapshot else 0
+
+    @property
+    def updated_at(self):
+        return self._snapshot[2] if self._snapshot else None
+
+    def get(self):
+        return self.get_versioned()[1]
+
+    def get_versioned(self):
+        # (version, live status) of the same download, for callers caching data derived from the status
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._bootstrap()
+            snapshot = self._snapshot
+        if snapshot[2] < time.time() - self.max_age:
+            self._refresh_in_background()
+        record_cache("ev_live", snapshot[2] >= time.time() - self.max_age)
+        return snapshot[0], snapshot[1]
+
+    def _bootstrap(self):
+        # The status file of a previous run (or of the data snapshot) saves waiting for the download, an outdated one
+        # is refreshed in the background like any other outdated status
+        if os.path.exists(self.filepath):
+            print("Using cached live EV data from file...")
+            self._swap(pd.read_json(self.filepath, lines=True), os.path.getmtime(self.filepath))
+        else:
+            self.refresh()
+
+    def _swap(self, df, updated_at):
+        self._snapshot = (self.version + 1, df[["EvseID", "EVSEStatus"]], updated_at)
+
+    def refresh(self):
+        print("Loading FRESH live EV data...")
+        self._swap(get_live_ev_station_data(), time.time())
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"EV live status refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="ev-live-refresh", daemon=True).start()
+
+
+ev_catalogue = EVCatalogue()
+ev_live_status = EVLiveStatus()
+
+Gauge("ev_catalogue_stations", "Number of EV charging stations in the current catalogue version.", (),
+      lambda: {(): len(ev_catalogue._snapshot[1]) if ev_catalogue._snapshot else None})
+Gauge("ev_catalogue_age_seconds", "Time since the last successful EV catalogue refresh.", (),
+      lambda: {(): time.time() - ev_catalogue.updated_at if ev_catalogue.updated_at else None})
+Gauge("ev_live_status_age_seconds", "Time since the live charger status was downloaded.", (),
+      lambda: {(): time.time() - ev_live_status.updated_at if ev_live_status.updated_at else None})
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+
+from data_loader import PLUG_TYPE_BITS
+from ev_catalogue import ev_catalogue, ev_live_status
+
+EARTH_RADIUS_KM = 6371.0088
+MAX_K = 50
+# Filters matching at most this many chargers are answered by scanning them instead of querying the tree
+SCAN_LIMIT = 2048
+
+
+def unit_vectors(lat, lon):
+    # Points on the unit sphere, the euclidean distance between them grows with the great-circle distance
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+
+class NearestChargerIndex:
+    """
+    KD-tree over the charger locations of the station catalogue, rebuilt only when the catalogue version changes.
+    The live status is joined as a per-charger availability array, recomputed when either version changes.
+    A query takes the nearest candidates from the tree and keeps the available ones (with the plug type), asking the
+    tree for more candidates until k are found. Rare filters (few available chargers with the plug type) would need
+    many rounds, their chargers are scanned directly instead.
+    """
+
+    def __init__(self, catalogue=ev_catalogue, live_status=ev_live_status):
+        self.catalogue = catalogue
+        self.live_status = live_status
+        self._tree = None       # (catalogue version, tree, station columns, unit vectors)
+        self._available = None  # (catalogue version, live status version, {plug type: filter})
+        self._lock = threading.Lock()
+
+    def _get_tree(self):
+        df = self.catalogue.get()
+        version = self.catalogue.version
+        tree = self._tree
+        if tree is None or tree[0] != version:
+            with self._lock:
+                if self._tree is None or self._tree[0] != version:
+                    from scipy.spatial import cKDTree
+                    print("Building EV charger KD-tree...")
+                    df = df[df["lat"].notna() & df["lon"].notna()].reset_index(drop=True)
+                    stations = {
+                        "EvseID": df["EvseID"].tolist(),
+                        # missing values as None so that the answers are valid JSON
+                        "name": df["name"].astype(object).where(df["name"].notna(), None).tolist(),
+                        "plugs": df["plugs"].astype(object).where(df["plugs"].notna(), None).tolist(),
+                        "lat": df["lat"].tolist(),
+                        "lon": df["lon"].tolist(),
+                        "plug_mask": df["plug_mask"].to_numpy(dtype=np.uint8),
+                    }
+                    vectors = unit_vectors(df["lat"].to_numpy(), df["lon"].to_numpy())
+                    self._tree = (version, cKDTree(vectors), stations, vectors)
+                tree = self._tree
+        return tree
+
+    def _get_filter(self, version, stations, vectors, plug_type):
+        # Availability (and plug type) mask of the chargers, with the positions of the matches if they are few
+        live = self.live_status.get()
+        live_version = self.live_status.version
+        available = self._available
+        if available is None or available[:2] != (version, live_version):
+            status = live.drop_duplicates("EvseID", keep="last").set_index("EvseID")["EVSEStatus"]
+            is_available = status.reindex(stations["EvseID"]).to_numpy() == "Available"
+            available = self._available = (version, live_version, {None: is_available})
+        filters = available[2]
+        if plug_type not in filters:
+            mask = filters[None] & ((stations["plug_mask"] & PLUG_TYPE_BITS[plug_type]) > 0)
+            matches = np.flatnonzero(mask)
+            filters[plug_type] = (mask, (matches, vectors[matches]) if len(matches) <= SCAN_LIMIT else None)
+        return filters[plug_type] if plug_type else (filters[None], None)
+
+    def query(self, lat, lon, k=5, plug_type=None):
+        """The k nearest available chargers of (lat, lon), optionally only those with plug_type."""
+        version, tree, stations, vectors = self._get_tree()
+        mask, scan = self._get_filter(version, stations, vectors, plug_type)
+        n = tree.n
+        if n == 0:
+            return []
+        point = unit_vectors([lat], [lon])[0]
+
+        if scan is not None:
+            matches, match_vectors = scan
+            distances = np.linalg.norm(match_vectors - point, axis=1)
+            order = np.argsort(distances)[:k]
+            distances, idx = distances[order], matches[order]
+        else:
+            candidates = min(n, k * 4)
+            while True:
+                distances, idx = tree.query(point, k=candidates)
+                distances, idx = np.atleast_1d(distances), np.atleast_1d(idx)
+                keep = mask[idx]
+                if keep.sum() >= k or candidates >= n:
+                    break
+                candidates = min(n, candidates * 4)
+            distances, idx = distances[keep][:k], idx[keep][:k]
+
+        return [{"EvseID": stations["EvseID"][i], "name": stations["name"][i], "plugs": stations["plugs"][i],
+                 "lat": stations["lat"][i], "lon": stations["lon"][i], "status": "Available",
+                 "distance_km": round(float(distance), 3)}
+                for i, distance in zip(idx.tolist(), chord_to_km(distances).tolist())]
+
+
+nearest_chargers = NearestChargerIndex()
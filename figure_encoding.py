@@ -0,0 +1,176 @@
+import base64
+import copy
+import html
+import re
+
+import numpy as np
+import pandas as pd
+
+# Numeric arrays shorter than this are left as JSON lists (the base64 overhead is not worth it)
+MIN_TYPED_LENGTH = 16
+# Upper limit of the traces a trace is split into when its repeated customdata strings are dictionary encoded
+MAX_CATEGORY_TRACES = 24
+# Every trace repeats its hovertemplate and marker settings, a split only pays off with enough points per trace
+MIN_CATEGORY_POINTS = 20
+
+# Per point trace attributes that are sliced when a trace is split, at the top level of the trace and in the marker
+POINT_ATTRIBUTES = ("lat", "lon", "x", "y", "z", "text", "hovertext", "ids")
+MARKER_ATTRIBUTES = ("size", "color", "opacity", "symbol")
+
+CUSTOMDATA_FIELD = re.compile(r"%\{customdata\[(\d+)\]([^}]*)\}")
+
+
+def typed_array(values):
+    """
+    Plotly's binary array format (plotly.js >= 2.28): the raw little-endian values as base64 instead of a JSON list.
+    Floats are sent as float32 (about 0.5 m for coordinates in degrees), integers in the smallest integer type.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        values = values.astype("<f4")
+    else:
+        low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+        for dtype in ("<u1", "<i1", "<u2", "<i2", "<u4", "<i4"):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                values = values.astype(dtype)
+                break
+        else:
+            values = values.astype("<f8")
+    return {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values.tobytes()).decode("ascii")}
+
+
+def _is_numeric_array(value):
+    if isinstance(value, np.ndarray):
+        return value.ndim == 1 and value.dtype.kind in "fiu" and len(value) >= MIN_TYPED_LENGTH
+    if isinstance(value, (list, tuple)) and len(value) >= MIN_TYPED_LENGTH:
+        return all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+    return False
+
+
+def encode_arrays(props):
+    # Replaces the numeric arrays of a trace (and of its nested objects like the marker) with typed arrays
+    encoded = {}
+    for key, value in props.items():
+        if isinstance(value, dict):
+            encoded[key] = encode_arrays(value)
+        elif _is_numeric_array(value):
+            encoded[key] = typed_array(value)
+        else:
+            encoded[key] = value
+    return encoded
+
+
+def _constant(values):
+    # The single value of an array whose elements are all the same, None otherwise
+    values = np.asarray(values, dtype=object)
+    if len(values) and all(v == values[0] for v in values):
+        return values[0]
+    return None
+
+
+def _category_codes(customdata, columns, max_traces):
+    # Combines the columns into one group code per point, columns that would exceed max_traces groups are skipped
+    codes = np.zeros(len(customdata), dtype=np.int64)
+    chosen = []
+    for column in columns:
+        column_codes, uniques = pd.factorize(customdata[:, column], use_na_sentinel=False)
+        combined, groups = pd.factorize(codes * len(uniques) + column_codes)
+        if len(groups) <= max_traces:
+            codes = combined
+            chosen.append(column)
+    return codes, chosen
+
+
+def split_categories(trace, columns, max_traces=MAX_CATEGORY_TRACES):
+    """
+    Dictionary encodes the repeated strings of customdata columns: the points are split into one trace per
+    combination of the column values, each value is written once into the hovertemplate of its trace and the
+    column is removed from customdata. Columns are taken in the given order as long as the number of traces stays
+    below max_traces and there are MIN_CATEGORY_POINTS points per trace on average. The traces of a split share the
+    legend entry of the original trace.
+    """
+    if trace.get("customdata") is None:
+        return [trace]
+    customdata = np.asarray(trace["customdata"], dtype=object)
+    if customdata.ndim != 2 or len(customdata) == 0:
+        return [trace]
+    max_traces = min(max_traces, len(customdata) // MIN_CATEGORY_POINTS)
+    codes, chosen = _category_codes(customdata, columns, max_traces)
+    if not chosen:
+        return [trace]
+    remaining = [c for c in range(customdata.shape[1]) if c not in chosen]
+    n = len(customdata)
+
+    def sliced(value, idx):
+        if isinstance(value, (list, tuple, np.ndarray)) and not isinstance(value, str) and len(value) == n:
+            return np.asarray(value)[idx] if isinstance(value, np.ndarray) else [value[i] for i in idx]
+        return value
+
+    parts = []
+    for group in range(codes.max() + 1):
+        idx = np.flatnonzero(codes == group)
+        part = {key: sliced(value, idx) if key in POINT_ATTRIBUTES else value for key, value in trace.items()}
+        if isinstance(trace.get("marker"), dict):
+            part["marker"] = {key: sliced(value, idx) if key in MARKER_ATTRIBUTES else value
+                              for key, value in trace["marker"].items()}
+            # per point marker values that became the same for the whole trace are sent once
+            for key in MARKER_ATTRIBUTES:
+                value = part["marker"].get(key)
+                if isinstance(value, (list, np.ndarray)) and _constant(value) is not None:
+                    part["marker"][key] = _constant(value)
+
+        values = customdata[idx[0]]
+
+        def field(match):
+            column = int(match.group(1))
+            if column in chosen:
+                value = values[column]
+                if value is None or (isinstance(value, float) and np.isnan(value)):
+                    return ""
+                # the value becomes part of the template, its markup and %{...} fields must show up as text
+                return html.escape(str(value), quote=False).replace("%", "&#37;")
+            return f"%{{customdata[{remaining.index(column)}]{match.group(2)}}}"
+
+        if trace.get("hovertemplate"):
+            part["hovertemplate"] = CUSTOMDATA_FIELD.sub(field, trace["hovertemplate"])
+        if remaining:
+            part["customdata"] = customdata[idx][:, remaining]
+        else:
+            del part["customdata"]
+        part["legendgroup"] = trace.get("legendgroup") or trace.get("name")
+        if parts:
+            part["showlegend"] = False
+        parts.append(part)
+    return parts
+
+
+def _expand_visible(layout, counts):
+    # Trace visibility lists of the update buttons are indexed by trace, repeat each entry for the split traces
+    for menu in layout.get("updatemenus", []):
+        for button in menu.get("buttons", []):
+            for args in button.get("args", []):
+                if isinstance(args, dict) and isinstance(args.get("visible"), list) \
+                        and len(args["visible"]) == len(counts):
+                    args["visible"] = [v for v, count in zip(args["visible"], counts) for _ in range(count)]
+
+
+def encode_figure(fig, categories=None):
+    """
+    Figure dict with the numeric arrays sent as typed arrays, which is much faster to serialize on the server and to
+    parse in the browser than JSON lists of floats.
+    categories lists per trace the customdata columns to dictionary encode (see split_categories), None to keep it.
+    """
+    figure = fig.to_plotly_json() if hasattr(fig, "to_plotly_json") else fig
+    categories = categories or []
+    data = []
+    counts = []
+    for i, trace in enumerate(figure.get("data", [])):
+        columns = categories[i] if i < len(categories) else None
+        parts = split_categories(trace, columns) if columns else [trace]
+        counts.append(len(parts))
+        data.extend(encode_arrays(part) for part in parts)
+
+    layout = copy.deepcopy(figure.get("layout", {}))
+    _expand_visible(layout, counts)
+    return {"data": data, "layout": layout}
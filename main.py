@@ -1,8 +1,20 @@
 import uvicorn
 import logging
-from fastapi import FastAPI, Request
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from admission import AdmissionRejected, admission
 from dash_app import app as dash_app
+from data_api import router as data_router
+from data_loader import PLUG_TYPE_BITS
+from ev_nearest import MAX_K, nearest_chargers
+from cache_warmup import record_dash_request
+from metrics import DASH_UPDATE_PATH, render_metrics
+from readiness import preloader
+from search_index import MAX_LIMIT as MAX_SEARCH_LIMIT, search_index
+from vector_tiles import landscape_tiles
 
 # # Set up logging
 # logger = logging.getLogger(__name__)
@@ -13,16 +25,94 @@ from dash_app import app as dash_app
 # handler.setFormatter(formatter)
 # logger.addHandler(handler)
 
+
+@asynccontextmanager
+async def lifespan(app):
+    # Critical datasets and caches are loaded in the background, /readyz reports when they are in memory
+    preloader.start()
+    yield
+
+
 # Define the FastAPI server
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Middleware to log IP addresses
 @app.middleware("http")
 async def log_ip_address(request: Request, call_next):
     # logger.info(f"Client IP: {request.client.host}")
+    # Remember which upstream data the callbacks ask for, the most popular is kept warm (see cache_warmup)
+    if request.method == "POST" and request.url.path.endswith(DASH_UPDATE_PATH):
+        output = ""
+        try:
+            body = json.loads(await request.body())
+            output = body.get("output", "")
+            record_dash_request(body)
+        except Exception as e:
+            # a malformed request is answered by Dash, recording its popularity must never fail it
+            print(f"Could not record callback request: {e}")
+        if not isinstance(output, str):
+            output = ""
+        # Callbacks are limited per cost class, heavy ones must not take the threads of the cheap ones (see admission)
+        try:
+            cost_class = await admission.acquire(output)
+        except AdmissionRejected as e:
+            return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+        try:
+            return await call_next(request)
+        finally:
+            cost_class.release()
     response = await call_next(request)
     return response
 
+
+# Liveness: the server process answers requests
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+
+# Readiness: critical datasets in memory and caches warmed up, with the load state of every dataset and cache
+@app.get("/readyz")
+def readyz():
+    status = preloader.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+# Prometheus metrics (callback latencies and phases, payload sizes, cache hits, upstream latencies)
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# Mapbox Vector Tiles of the landscape types layer (generated on demand and cached, see vector_tiles)
+@app.get("/tiles/landschaft/{z}/{x}/{y}.pbf")
+def landscape_tile(z: int, x: int, y: int):
+    if not 0 <= z <= 22 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return Response(status_code=404)
+    return Response(landscape_tiles.get_tile(z, x, y), media_type="application/x-protobuf",
+                    headers={"Cache-Control": "public, max-age=86400"})
+
+
+# Nearest available EV chargers of a location (KD-tree over the station catalogue, see ev_nearest)
+@app.get("/api/ev/nearest")
+def nearest_ev_chargers(lat: float = Query(ge=-90, le=90), lon: float = Query(ge=-180, le=180),
+                        k: int = Query(5, ge=1, le=MAX_K), plug: str = None):
+    if plug and plug not in PLUG_TYPE_BITS:
+        raise HTTPException(status_code=400, detail=f"Unknown plug type, one of: {', '.join(PLUG_TYPE_BITS)}")
+    return JSONResponse({"lat": lat, "lon": lon, "plug": plug, "chargers": nearest_chargers.query(lat, lon, k, plug)})
+
+
+# Search of Kantone, Bezirke, Gemeinden and cached POIs by name prefix, with the bounds to zoom to (see search_index)
+@app.get("/api/search")
+def search(q: str = Query(min_length=1, max_length=100), limit: int = Query(10, ge=1, le=MAX_SEARCH_LIMIT),
+           kind: list[str] = Query(None)):
+    return JSONResponse({"query": q, "results": search_index.search(q, limit, kind)})
+
+
+# Read-only data API of the processed datasets (streamed NDJSON / GeoJSON, see data_api)
+app.include_router(data_router)
+
+
 # Mount the Dash app as a sub-application in the FastAPI server
 app.mount("/", WSGIMiddleware(dash_app.server))
 
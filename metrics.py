@@ -0,0 +1,204 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Latency buckets in seconds and payload buckets in bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1000, 10000, 100000, 500000, 1000000, 5000000, 10000000, 50000000)
+
+DASH_UPDATE_PATH = "/_dash-update-component"
+
+_metrics = []
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    labels = [f'{n}="{v}"' for n, v in zip(labelnames, labelvalues)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # per bucket counts (last one is +Inf), sum, count
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from a function at scrape time, fn returns {labelvalues: value}."""
+
+    def __init__(self, name, documentation, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        _metrics.append(self)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labelvalues, value in sorted(self.fn().items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+callback_duration = Histogram("dash_callback_duration_seconds",
+                              "Time spent inside a Dash callback function.", ("callback",))
+callback_phase = Histogram("dash_callback_phase_seconds",
+                           "Time spent per callback phase (data_load, transform, figure_build, serialization).",
+                           ("callback", "phase"))
+callback_response_bytes = Histogram("dash_callback_response_bytes",
+                                    "Size of the serialized callback response.", ("callback",), BYTES_BUCKETS)
+callback_errors = Counter("dash_callback_errors_total", "Callbacks that raised an exception.", ("callback",))
+cache_requests = Counter("cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+upstream_latency = Histogram("upstream_fetch_seconds", "Latency of requests to upstream APIs.",
+                             ("upstream", "status"))
+
+
+# Per request state of the callback currently running on this thread (Dash callbacks run on the request thread)
+_state = threading.local()
+
+
+def instrument_callback(name):
+    """Decorator recording the duration and phases of a Dash callback, use below @callback."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            _state.callback = name
+            _state.start = _state.last_mark = start
+            _state.duration = None
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                callback_errors.inc(name)
+                raise
+            finally:
+                end = time.perf_counter()
+                _state.duration = end - start
+                callback_duration.observe(end - start, name)
+                # whatever remains after the last phase mark is figure building
+                if end > _state.last_mark:
+                    callback_phase.observe(end - _state.last_mark, name, "figure_build")
+        return wrapper
+    return decorator
+
+
+def mark_phase(phase):
+    """Closes the current phase of the running callback: records the time since the previous mark."""
+    callback = getattr(_state, "callback", None)
+    if callback is None:
+        return
+    now = time.perf_counter()
+    callback_phase.observe(now - _state.last_mark, callback, phase)
+    _state.last_mark = now
+
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+@contextmanager
+def upstream_timer(upstream):
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        upstream_latency.observe(time.perf_counter() - start, upstream, status)
+
+
+def install_flask_hooks(server):
+    """Records serialization time and response size of the Dash callback requests of a Flask server."""
+    from flask import request
+
+    @server.before_request
+    def _start_request_timer():
+        if request.path.endswith(DASH_UPDATE_PATH):
+            _state.callback = None
+            _state.request_start = time.perf_counter()
+
+    @server.after_request
+    def _record_response(response):
+        callback = getattr(_state, "callback", None)
+        if callback is None or not request.path.endswith(DASH_UPDATE_PATH):
+            return response
+        # Everything outside the callback function is Dash dispatch and JSON serialization of the output
+        total = time.perf_counter() - _state.request_start
+        if _state.duration is not None:
+            callback_phase.observe(max(total - _state.duration, 0.0), callback, "serialization")
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        if size is not None:
+            callback_response_bytes.observe(size, callback)
+        _state.callback = None
+        return response
+
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
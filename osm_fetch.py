@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from data_loader_overpy import get_data_overpy, get_tag_keys_values_options
+from metrics import Gauge
+
+# Concurrent queries per client allowed by the public Overpass instance
+OVERPASS_SLOTS = int(os.getenv("OVERPASS_SLOTS", 2))
+# Retries with exponential backoff when Overpass reports that all slots are taken or times out
+MAX_RETRIES = 3
+RETRY_DELAY = 5
+# Jobs that were not polled for this long are dropped
+JOB_TTL = 60 * 10
+
+
+class FetchJob:
+    """The queries of one multi-country, multi-tag selection, results become available as each query finishes."""
+
+    def __init__(self, futures):
+        self.id = uuid.uuid4().hex
+        self.futures = futures          # (country, tag value) -> Future of the data dict
+        self.touched = time.time()
+
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+
+    def results(self):
+        # {(country, tag value): data dict} of the finished queries, failed queries are left out
+        return {key: future.result() for key, future in self.futures.items()
+                if future.done() and future.exception() is None}
+
+    def failed(self):
+        return [key for key, future in self.futures.items() if future.done() and future.exception() is not None]
+
+    def pending(self):
+        return [key for key, future in self.futures.items() if not future.done()]
+
+
+class OverpassFetchScheduler:
+    """
+    Runs the Overpass queries of a selection in parallel, limited to OVERPASS_SLOTS concurrent queries.
+    Identical queries of concurrent selections share one fetch.
+    """
+
+    def __init__(self, slots=OVERPASS_SLOTS):
+        self._executor = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="overpass")
+        self._in_flight = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        _, _, self.tag_keys = get_tag_keys_values_options()
+
+    def _fetch(self, country, tag_value):
+        import overpy
+        delay = RETRY_DELAY
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return get_data_overpy(country, self.tag_keys[tag_value], tag_value)
+            except (overpy.exception.OverpassTooManyRequests, overpy.exception.OverpassGatewayTimeout):
+                if attempt == MAX_RETRIES:
+                    raise
+                print(f"Overpass busy, retrying {country} {tag_value} in {delay}s...")
+                time.sleep(delay)
+                delay *= 2
+
+    def _submit(self, country, tag_value):
+        key = (country, tag_value)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._in_flight[key] = self._executor.submit(self._fetch, country, tag_value)
+        # outside of the lock, the callback runs right away if the fetch already finished
+        future.add_done_callback(lambda f: self._finished(key, f))
+        return future
+
+    def _finished(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def start(self, countries, tag_values):
+        futures = {(country, tag_value): self._submit(country, tag_value)
+                   for tag_value in tag_values for country in countries}
+        job = FetchJob(futures)
+        with self._lock:
+            self._expire_jobs()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job:
+            job.touched = time.time()
+        return job
+
+    def wait(self, job, timeout):
+        wait(job.futures.values(), timeout=timeout)
+
+    def _expire_jobs(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.touched < now - JOB_TTL]:
+            del self._jobs[job_id]
+
+    def in_flight(self):
+        return len(self._in_flight)
+
+
+overpass_scheduler = OverpassFetchScheduler()
+
+Gauge("overpass_queries_in_flight", "Overpass queries running or queued in the fetch scheduler.", (),
+      lambda: {(): overpass_scheduler.in_flight()})
@@ -1,14 +1,12 @@
-import json
-import os
-import time
-
-import overpy
 import pandas as pd
-import plotly.express as px
 import dash
-from dash import html, dcc, callback, Output, Input
+from dash import html, dcc, callback, Output, Input, State
 
-from data_loader_overpy import get_data_overpy, get_tag_keys_values_options, get_country_codes
+from cache_warmup import as_list
+from dash_map_search import map_search
+from data_loader_overpy import get_tag_keys_values_options, get_country_codes
+from metrics import instrument_callback, mark_phase
+from osm_fetch import overpass_scheduler
 
 dash.register_page(
     __name__,
@@ -23,23 +21,32 @@ tag_keys, tag_values, tag_key_value_list = get_tag_keys_values_options()
 
 country_codes = get_country_codes()
 
+# Time a new selection waits for its queries before the first figure is returned, the remaining countries are
+# added by polling
+INITIAL_WAIT = 1.0
+POLL_INTERVAL_MS = 1000
+
 layout = html.Div([
     html.H3(children='Open Street Maps POIs'),
     html.Div([
         html.Div([
                 "Country:",
-                dcc.Dropdown(country_codes, 'CH', className='ddown', id='dropdown-country'),
+                dcc.Dropdown(country_codes, ['CH'], multi=True, className='ddown', id='dropdown-country'),
             ], className='ddmenu'),
         html.Div([
                 "Fact:",
-                dcc.Dropdown(tag_values, 'books', className='ddown', id='dropdown-value'),
+                dcc.Dropdown(tag_values, ['books'], multi=True, className='ddown', id='dropdown-value'),
             ], className='ddmenu'),
     ], className='ddmenu'),
+    map_search('graph-content'),
     dcc.Loading(
         id="loading",
         type="circle",
         children=dcc.Graph(id='graph-content', style={'height': '80vh', 'width': '100%'})
     ),
+    # Running fetch job of the selection, polled until all countries arrived
+    dcc.Store(id='osm-job'),
+    dcc.Interval(id='osm-interval', interval=POLL_INTERVAL_MS, disabled=True),
     html.Span(children=[
         html.Pre(children="Source: Open Street Maps Overpass API"),
         html.Pre(children=" "),
@@ -54,34 +61,62 @@ layout = html.Div([
 
 @callback(
     Output('graph-content', 'figure'),
+    Output('osm-job', 'data'),
+    Output('osm-interval', 'disabled'),
     Input('dropdown-value', 'value'),
     Input('dropdown-country', 'value'),
+    Input('osm-interval', 'n_intervals'),
+    State('osm-job', 'data'),
 )
-def update_graph(tag_value="shop", country_code="CH"):
-    if tag_value not in tag_values:
-        tag_value = 'books'
-    tag_key = tag_key_value_list[tag_value]
+@instrument_callback("osm")
+def update_graph(tag_value="shop", country_code="CH", n_intervals=None, job_data=None):
+    import plotly.express as px
+    selected_tags = [tag for tag in as_list(tag_value, 'books') if tag in tag_values] or ['books']
+    selected_countries = [country for country in as_list(country_code, 'CH') if country in country_codes] or ['CH']
 
-    data_dict = get_data_overpy(country_code, tag_key, tag_value)
+    # Polls continue the running job, a new selection (or a job unknown to this process) starts the queries
+    selection = {"tags": selected_tags, "countries": selected_countries}
+    job = None
+    if job_data and job_data.get("selection") == selection:
+        job = overpass_scheduler.get(job_data.get("id"))
+    if job is None:
+        job = overpass_scheduler.start(selected_countries, selected_tags)
+        overpass_scheduler.wait(job, INITIAL_WAIT)
+    results = job.results()
+    mark_phase("data_load")
 
-    total_points = len(data_dict["names"])
-    print(f"Plotting nodes for {tag_value}: {total_points}")
+    frames = []
+    for (country, tag), data_dict in results.items():
+        frames.append(pd.DataFrame(data_dict).assign(country=country, tag=tag))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=["names", "longs", "lats", "websites", "country", "tag"])
+    total_points = len(df)
+    print(f"Plotting nodes for {', '.join(selected_tags)} in {', '.join(selected_countries)}: {total_points}")
+    mark_phase("transform")
 
-    # Create a pandas DataFrame from the dictionary
-    df = pd.DataFrame(data_dict)
-    fig = px.density_mapbox(df, lat=data_dict["lats"], lon=data_dict["longs"], radius=10,
+    fig = px.density_mapbox(df, lat="lats", lon="longs", radius=10,
                             mapbox_style="open-street-map", color_continuous_scale="inferno",
-                            custom_data=['names', 'websites'])
-    fig.update_traces(hovertemplate="Name: %{customdata[0]} <br><a href='%{customdata[1]}'>%{customdata[1]}</a> <br>Coordinates: %{lat}, %{lon}")
-    fig.update_layout(title_text=f"{tag_value.capitalize()}: {total_points} points", title_font={'size': 12})
+                            custom_data=['names', 'websites', 'country'])
+    fig.update_traces(hovertemplate="Name: %{customdata[0]} <br><a href='%{customdata[1]}'>%{customdata[1]}</a> <br>Country: %{customdata[2]}<br>Coordinates: %{lat}, %{lon}")
+
+    title = f"{', '.join(tag.capitalize() for tag in selected_tags)}: {total_points} points"
+    pending = sorted({country for country, _ in job.pending()})
+    failed = sorted({country for country, _ in job.failed()})
+    if pending:
+        title += f" (loading {', '.join(pending)}...)"
+    if failed:
+        title += f" (failed: {', '.join(failed)})"
+    fig.update_layout(title_text=title, title_font={'size': 12})
     fig.update_layout(coloraxis_showscale=False,
                       autosize=True,
                       margin=dict(l=0, r=0, b=0, t=0),
                       paper_bgcolor='rgba(0,0,0,0.0)',  # Set the background color of the map
                       font=dict(color='lightgray'),
+                      # keep the view while the countries of a selection arrive
+                      uirevision=f"{selected_tags}{selected_countries}",
                       )
 
-    return fig
+    return fig, {"id": job.id, "selection": selection}, job.done()
 
 
 # if __name__ == '__main__':
@@ -1,11 +1,13 @@
 import plotly.graph_objects as go
 import dash
 from dash import callback, Output, Input, dcc, html
-import geopandas as gpd
 import numpy as np
-from scipy.interpolate import griddata
 
 from dash_modal_long_wait import modal, toggle_modal
+from data_loader import interpolate_surface
+from data_registry import registry
+from metrics import instrument_callback, mark_phase
+from task_pool import run_latest
 
 dash.register_page(
     __name__,
@@ -18,11 +20,6 @@ dash.register_page(
 
 ddown_methods = ["linear", "cubic", "nearest"]
 
-# Preload shape data
-filepath = "static/gdf_kan.json"
-print("Loading Shape data...")
-gdf = gpd.read_file(filepath)
-
 layout = [
     modal,
     html.H3(children='Swiss Topographic Map'),
@@ -49,35 +46,19 @@ layout = [
     Output('graph-content-5', 'figure'),
     Input('dropdown-method', 'value'),
 )
+@instrument_callback("map3d")
 def update_graph(method="cubic"):
 
-    print("Drawing Map...")
-    # iterate over geopandas dataframe gdf and extract all x,y, z values
-    x, y, z = [], [], []
-    for geom in gdf.geometry:
-        if geom.geom_type == 'Polygon':
-            polygon = geom.exterior.coords
-            for coord in polygon:
-                x.append(coord[0])
-                y.append(coord[1])
-                z.append(coord[2])
-        if geom.geom_type == 'MultiPolygon':
-            for poly_coll in geom.geoms:
-                polygon = poly_coll.exterior.coords
-                for coord in polygon:
-                    x.append(coord[0])
-                    y.append(coord[1])
-                    z.append(coord[2])
-
-    x = np.array(x)
-    y = np.array(y)
-    z = np.array(z)
+    # x, y and altitude of the Kantone boundary points (see data_registry)
+    points = registry.get("kan_altitude_points")
+    mark_phase("data_load")
 
-    xi = np.linspace(x.min(), x.max(), 100)
-    yi = np.linspace(y.min(), y.max(), 100)
-    X, Y = np.meshgrid(xi, yi)
+    print("Drawing Map...")
+    x, y, z = points["x"], points["y"], points["z"]
 
-    Z = griddata((x, y), z, (X, Y), method=method)
+    # The interpolation runs in the task pool, a newer request of the same user discards this one
+    xi, yi, Z = run_latest('graph-content-5', interpolate_surface, x, y, z, method)
+    mark_phase("transform")
 
     fig = go.Figure(go.Surface(x=xi, y=yi, z=Z))
     fig.update_traces(contours_z=dict(show=True, usecolormap=True,
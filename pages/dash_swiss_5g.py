@@ -1,11 +1,14 @@
 import json
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import dash
 from dash import html, dcc, callback, Output, Input
-import geopandas as gpd
 import plotly.graph_objects as go
 
+from dash_map_search import map_search
+from data_registry import registry
+from metrics import instrument_callback, mark_phase
+
 
 dash.register_page(
     __name__,
@@ -16,17 +19,20 @@ dash.register_page(
     image_url='https://f-web-cdn.fra1.cdn.digitaloceanspaces.com/antenna.png'
 )
 
-# Load Antenna data from JSON file
-print("Loading 5G Antenna data...")
-ant_gdf = gpd.read_file("static/ant_gdf.json")
-count = len(ant_gdf)
-
 ddown_options = ["-", "Kantone", "Bezirke", "Gemeinden"]
 
-# Define the shape files (Kantone, Bezirke, Gemeinden), and their file paths (files have been pre-processed)
-shape_files_dict = {"Kantone": "static/gdf_kan.json",
-                    "Bezirke": "static/gdf_bez.json",
-                    "Gemeinden": "static/gdf_gem.json"}
+# Define the shape datasets (Kantone, Bezirke, Gemeinden), files have been pre-processed (see data_registry)
+shape_files_dict = {"Kantone": "gdf_kan",
+                    "Bezirke": "gdf_bez",
+                    "Gemeinden": "gdf_gem"}
+
+# Values of the shapes choropleth: population density or a column of the antenna coverage index and its z max
+# (None: 95th percentile of the values)
+COVERAGE_OPTIONS = {"Pop. density": ("DICHTE", 10000),
+                    "Antennas per km²": ("antennas_per_km2", None),
+                    "Antennas per 1000 inh.": ("antennas_per_1000", None),
+                    "Power per km²": ("power_per_km2", None),
+                    "Power per 1000 inh.": ("power_per_1000", None)}
 
 layout = html.Div([
     html.H3(children='5G Network Coverage'),
@@ -38,11 +44,16 @@ layout = html.Div([
             className='layer-toggle',
         ),
         html.Div([
-            "Pop. density:",
+            "Regions:",
             dcc.Dropdown(ddown_options, '-', className='ddown', id='dropdown-shape')
         ], className='ddmenu'),
+        html.Div([
+            "Value:",
+            dcc.Dropdown(list(COVERAGE_OPTIONS), 'Pop. density', className='ddown', id='dropdown-coverage')
+        ], className='ddmenu'),
     ], className="ddmenu"),
 
+    map_search('graph-content-ant'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -63,13 +74,21 @@ layout = html.Div([
     Output('graph-content-ant', 'figure'),
     Input('layer-toggle', 'value'),
     Input('dropdown-shape', 'value'),
+    Input('dropdown-coverage', 'value'),
 )
-def update_graph(selected_layers=None, shape_type=None):
+@instrument_callback("antenna")
+def update_graph(selected_layers=None, shape_type=None, coverage_option="Pop. density"):
+    import plotly.express as px
+    # Antenna data is loaded once and shared (see data_registry)
+    ant_gdf = registry.get("ant_gdf")
+    count = len(ant_gdf)
+    mark_phase("data_load")
 
     if '5G' in selected_layers:
         df = pd.DataFrame(ant_gdf)
     else:
         df = pd.DataFrame(ant_gdf)[0:0]
+    mark_phase("transform")
 
     fig = px.density_mapbox(df, lat=df.lat, lon=df.lon, radius=df.power_int*2,
                             mapbox_style="open-street-map", center=dict(lat=46.8, lon=8.2), zoom=7,
@@ -88,18 +107,30 @@ def update_graph(selected_layers=None, shape_type=None):
 
     # Draw map with shape data
     if shape_type in ddown_options[1:]:
-        filepath = shape_files_dict.get(shape_type)
+        # closes the density map build, the shape layer below has its own data_load / transform phases
+        mark_phase("figure_build")
         print("Loading Shape data...")
-        gdf = gpd.read_file(filepath)
+        gdf = registry.get(shape_files_dict.get(shape_type))
+        mark_phase("data_load")
         print("Converting to GeoJSON...")
+        # Convert Timestamp objects to strings
+        gdf = gdf.map(lambda x: str(x) if isinstance(x, pd.Timestamp) else x)
         geojson_data = json.loads(gdf.to_json())
-        z_max = 10000
+
+        # Coverage values are precomputed per shape (see data_loader.load_transform_save_antenna_coverage)
+        column, z_max = COVERAGE_OPTIONS.get(coverage_option, COVERAGE_OPTIONS["Pop. density"])
+        if column == "DICHTE":
+            z = gdf['DICHTE']
+        else:
+            z = registry.get("antenna_coverage")[shape_type][column].to_numpy()
+            z_max = np.nanpercentile(z, 95) if np.isfinite(z).any() else 1
+        mark_phase("transform")
 
         fig.add_trace(
             go.Choroplethmapbox(
                 geojson=geojson_data,
                 locations=gdf.index,  # or replace with the column containing the feature identifiers
-                z=gdf['DICHTE'],  # or replace with the column containing the values to color-code
+                z=z,  # or replace with the column containing the values to color-code
                 colorscale="reds",
                 zmin=0,
                 zmax=z_max,
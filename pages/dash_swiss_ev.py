@@ -1,13 +1,18 @@
 import os.path
-import time
+import threading
 
+import numpy as np
 import pandas as pd
 import dash
 from dash import html, dcc, callback, Output, Input, dash_table
-import geopandas as gpd
 import plotly.graph_objects as go
 
-from data_loader import get_live_ev_station_data, load_transform_ev_station_data
+from dash_map_search import map_search
+from data_loader import PLUG_TYPE_BITS, plug_type_filter
+from ev_catalogue import ev_catalogue, ev_live_status
+from figure_encoding import encode_figure
+from metrics import instrument_callback, mark_phase
+from point_clustering import ClusterIndex, viewport_from_relayout, cluster_marker_size
 
 dash.register_page(
     __name__,
@@ -28,10 +33,85 @@ dash.register_page(
 
 DDOWN_OPTIONS = ["All", "Available", "Occupied", "OutOfService", "Unknown"]
 colors = {"Available": "green", "Occupied": "orange", "OutOfService": "red", "Unknown": "gray"}
+STATUSES = DDOWN_OPTIONS[1:]
+
+# (catalogue version, located chargers, their cluster index), built once per EV catalogue version
+cluster_snapshot = None
+cluster_lock = threading.Lock()
+
+
+def get_cluster_index(version, catalogue):
+    global cluster_snapshot
+    snapshot = cluster_snapshot
+    if snapshot is None or snapshot[0] != version:
+        with cluster_lock:
+            snapshot = cluster_snapshot
+            if snapshot is None or snapshot[0] != version:
+                print("Building EV charger cluster index...")
+                stations = catalogue[catalogue['lat'].notna() & catalogue['lon'].notna()].reset_index(drop=True)
+                snapshot = (version, stations, ClusterIndex(stations['lat'].to_numpy(), stations['lon'].to_numpy()))
+                cluster_snapshot = snapshot
+    return snapshot[1], snapshot[2]
+
+
+def status_codes(statuses):
+    # Index of each status in STATUSES, -1 for missing or other statuses
+    return pd.Categorical(statuses, categories=STATUSES).codes
+
+
+# ((catalogue version, live status version), joined plug and status arrays), built once per version pair
+state_snapshot = None
+state_lock = threading.Lock()
+
+
+def get_station_state(version, catalogue, live_version, live_df):
+    """
+    Plug masks and status codes of the stations joined with the live status: of all stations for the counts (outer
+    join, as stations can have a status but no catalogue entry) and of the located ones in the order of the cluster
+    index for the map. A request only applies its plug and status masks to these arrays.
+    """
+    global state_snapshot
+    key = (version, live_version)
+    snapshot = state_snapshot
+    if snapshot is None or snapshot[0] != key:
+        with state_lock:
+            snapshot = state_snapshot
+            if snapshot is None or snapshot[0] != key:
+                print("Joining live EV station data with the catalogue...")
+                stations, cluster_index = get_cluster_index(version, catalogue)
+                live_df = live_df.drop_duplicates('EvseID', keep='last')
+                df = pd.merge(catalogue[['EvseID', 'plug_mask']], live_df, on='EvseID', how='outer')
+                map_status = stations['EvseID'].map(live_df.set_index('EvseID')['EVSEStatus'])
+                map_codes = status_codes(map_status)
+                state = {
+                    "plug_mask": df['plug_mask'].fillna(0).to_numpy(dtype=np.uint8),
+                    "status": status_codes(df['EVSEStatus']),
+                    "stations": stations,
+                    "cluster_index": cluster_index,
+                    "map_plug_mask": stations['plug_mask'].fillna(0).to_numpy(dtype=np.uint8),
+                    "map_status": map_codes,
+                    "map_status_names": map_status.to_numpy(dtype=object),
+                    "map_colors": map_status.map(colors).to_numpy(dtype=object),
+                    "map_aggregates": {status: map_codes == i for i, status in enumerate(STATUSES)},
+                }
+                snapshot = (key, state)
+                state_snapshot = snapshot
+    return snapshot[1]
+
+
+def selected_stations(plug_mask, status, plug_types, selected_layer):
+    # Stations with one of the plug types (bitmask per station, see data_loader.PLUG_TYPE_BITS) and the status
+    selected = plug_type_filter(plug_mask, plug_types)
+    if selected_layer in STATUSES:
+        selected &= status == STATUSES.index(selected_layer)
+    return selected
 
 layout = html.Div([
     html.H3(children='Swiss EV Charger Network'),
+    dcc.Dropdown(list(PLUG_TYPE_BITS), [], multi=True, placeholder="All plug types", className='ddown',
+                 id='dropdown-plug'),
 
+    map_search('graph-content-ev'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -99,57 +179,78 @@ layout = html.Div([
 @callback(
     Output('graph-content-ev', 'figure'),
     Output('my-data-table', 'data'),
-    Input('my-data-table', 'active_cell')
+    Input('my-data-table', 'active_cell'),
+    Input('graph-content-ev', 'relayoutData'),
+    Input('dropdown-plug', 'value'),
 )
-def update_graph(active_cell, selected_layer="All"):
+@instrument_callback("ev")
+def update_graph(active_cell, relayout_data=None, plug_types=None, selected_layer="All"):
 
     print("Selected Rows: ", active_cell)
     if active_cell:
         selected_layer = DDOWN_OPTIONS[active_cell['row']]
     
-    # if cached file is older than 4h or does not exist, load fresh data
-    if os.path.exists("static/ev_gdf.json") and time.time() < os.path.getctime("static/ev_gdf.json") + 60*60*4:
-        print("Using cached EV static data from file (not older than 24h) ...")
-        # df = pd.DataFrame(ev_gdf)
-        df = gpd.read_file("static/ev_gdf.json")
-
-    else:
-        print("Loading FRESH EV static data...")
-        df = load_transform_ev_station_data()
+    # Station catalogue kept in memory and refreshed in the background (see ev_catalogue)
+    version, catalogue = ev_catalogue.get_versioned()
 
+    # Live status kept in memory and refreshed in the background once older than a minute (see ev_catalogue)
     print("Loading live EV station data...")
-    if os.path.exists("static/live_ev_df.json") and time.time() < os.path.getctime("static/live_ev_df.json") + 60*1*1:
-        print("Using cached live EV data from file (not older than 1 min) ...")
-        live_df = pd.read_json("static/live_ev_df.json", lines=True)
-    else:
-        print("Loading FRESH live EV data...")
-        live_df = get_live_ev_station_data()
-
-    # Outer Join the live data with the existing data (key = EvseID)
-    print("Merging live data with existing data...")
-    df = pd.merge(df, live_df, on='EvseID', how='outer')
-    df['EVSEStatusColor'] = df['EVSEStatus'].map(colors)
+    live_version, live_df = ev_live_status.get_versioned()
+    mark_phase("data_load")
 
-    # Count dataset by all Statuses
-    counts = [len(df[df['EVSEStatus'] == status]) for status in DDOWN_OPTIONS]
+    # Live data joined with the catalogue (key = EvseID) once per version, the filters are masks on its arrays
+    state = get_station_state(version, catalogue, live_version, live_df)
 
-    # Filter by selected Status
-    if selected_layer in DDOWN_OPTIONS and selected_layer != "All":
-        df = df[df['EVSEStatus'] == selected_layer]
+    # Count dataset by all Statuses
+    has_plug = plug_type_filter(state["plug_mask"], plug_types)
+    status_counts = np.bincount(state["status"][has_plug] + 1, minlength=len(STATUSES) + 1)[1:]
+    counts = [0] + [int(c) for c in status_counts]
 
     # Generate Graph title
-    count = len(df)
+    count = int(has_plug.sum()) if selected_layer not in STATUSES else counts[DDOWN_OPTIONS.index(selected_layer)]
     graph_title = f"{count} EV chargers ({selected_layer.lower()})"
+    if plug_types:
+        graph_title += f" with {', '.join(plug_types)}"
+
+    # Chargers are clustered at low zoom levels and shown individually once zoomed in, the located chargers keep the
+    # catalogue order so that the cluster index is only rebuilt for a new catalogue version
+    map_df = state["stations"]
+    zoom, bbox = viewport_from_relayout(relayout_data)
+    result = state["cluster_index"].query(
+        zoom, mask=selected_stations(state["map_plug_mask"], state["map_status"], plug_types, selected_layer),
+        bbox=bbox, aggregates=state["map_aggregates"])
+    points = map_df.iloc[result["points"]]
+    point_status = state["map_status_names"][result["points"]]
+    point_colors = state["map_colors"][result["points"]]
+    mark_phase("transform")
+
+    # Clusters are colored by their most frequent status, the tooltip shows the status mix
+    status_mix = np.column_stack([result["aggregates"][status] for status in STATUSES])
+    cluster_colors = [colors.get(STATUSES[i]) for i in status_mix.argmax(axis=1)] if len(status_mix) else []
+    cluster_customdata = [(f"{n} chargers", "-", ", ".join(f"{status} {int(v)}" for status, v in zip(STATUSES, mix) if v))
+                          for n, mix in zip(result["count"], status_mix)]
 
     print("Plotting maps...")
-    fig = go.Figure(go.Scattermapbox(lat=df['lat'], lon=df['lon'], mode='markers',
-                                    marker={'size': 10, 'color': df['EVSEStatusColor'], 'opacity': 0.7},
-                                    customdata=list(
-                                         zip(df["name"].tolist(), df["plugs"].tolist(), df['EVSEStatus'].tolist())),
-                                    ))
-    # Define the tooltip
-    fig.update_traces(hovertemplate="GPS: %{lat}, %{lon} <br>Name: %{customdata[0]} <br>Plugs: %{customdata[1]}"
-                                    "<br>Status: %{customdata[2]}<extra></extra>")
+    hovertemplate = ("GPS: %{lat:.5f}, %{lon:.5f} <br>Name: %{customdata[0]} <br>Plugs: %{customdata[1]}"
+                     "<br>Status: %{customdata[2]}<extra></extra>")
+    fig = go.Figure([go.Scattermapbox(lat=result["lat"], lon=result["lon"],
+                                      mode='markers',
+                                      marker={'size': cluster_marker_size(result["count"]),
+                                              'color': cluster_colors,
+                                              'opacity': 0.7},
+                                      customdata=cluster_customdata,
+                                      hovertemplate=hovertemplate,
+                                      ),
+                     go.Scattermapbox(lat=points['lat'].to_numpy(), lon=points['lon'].to_numpy(),
+                                      mode='markers',
+                                      marker={'size': 10,
+                                              'color': point_colors.tolist(),
+                                              'opacity': 0.7},
+                                      customdata=np.column_stack([points["name"].to_numpy(dtype=object),
+                                                                  points["plugs"].to_numpy(dtype=object),
+                                                                  point_status]),
+                                      hovertemplate=hovertemplate,
+                                      )])
     token = os.getenv("MAPBOX_TOKEN")
     fig.update_layout(title_text=graph_title,
                       # mapbox_style="open-street-map",
@@ -164,17 +265,20 @@ def update_graph(active_cell, selected_layer="All"):
                       margin=dict(l=0, r=0, b=0, t=0),
                       paper_bgcolor='rgba(0,0,0,0)',
                       font=dict(color='lightgray'),
+                      uirevision='ev',  # keep the user's zoom and position when the clusters are updated
+                      showlegend=False,
                       )
     # Add total to "All"
     counts[0] = sum(counts)
     # calculate percentages from counts
-    percentages = [f"{round(c/counts[0]*100, 1)}" for c in counts]
+    percentages = [f"{round(c/max(counts[0], 1)*100, 1)}" for c in counts]
 
     # Define the data table
     table_data = [{"Status": i, "Total": p, "%": w} for i, p, w in zip(DDOWN_OPTIONS, counts, percentages)]
     table_data = pd.DataFrame(table_data).to_dict('records')
-    # Return the figure and the table data
-    return fig, table_data
+    # Return the figure (coordinates as typed arrays, chargers split per status and plug combination so that the
+    # repeated strings are sent once per trace, see figure_encoding) and the table data
+    return encode_figure(fig, categories=[None, [2, 1]]), table_data
 
 
 # if __name__ == '__main__':
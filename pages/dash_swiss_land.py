@@ -1,10 +1,16 @@
-import json
 import os
 
+import flask
+import pandas as pd
 import plotly.graph_objects as go
+from plotly.colors import sample_colorscale
 import dash
 from dash import callback, dcc, Input, Output, html
-import geopandas as gpd
+
+from dash_map_search import map_search
+from data_registry import registry
+from metrics import instrument_callback, mark_phase
+from point_clustering import viewport_from_relayout
 
 dash.register_page(
     __name__,
@@ -17,9 +23,14 @@ dash.register_page(
 )
 
 
+# Hover information is only sent once zoomed in this far, for the landscape objects in the viewport
+HOVER_MIN_ZOOM = 10
+HOVER_COLUMNS = ["OBJECT", "TYPNAME_DE", "REGNAME_DE"]
+
 layout = [
     html.H3(children='Swiss Landscape Types'),
     dcc.Dropdown([], "", className='ddown', id='dropdown-land', style={'display': 'none'}),
+    map_search('graph-content-land'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -27,43 +38,76 @@ layout = [
     ),
 ]
 
+
+def tile_base_url():
+    # Mapbox needs absolute tile URLs, use the host of the current request (or TILE_BASE_URL outside of a request)
+    if flask.has_request_context():
+        return flask.request.host_url.rstrip("/")
+    return os.getenv("TILE_BASE_URL", "")
+
+
+def layers_visible(count, visible):
+    # relayout arguments toggling all mapbox layers
+    return {f"mapbox.layers[{i}].visible": visible for i in range(count)}
+
+
+def hover_points(zoom, bbox):
+    # Representative points of the landscape objects in the viewport (see data_registry.load_landscape_points)
+    if zoom < HOVER_MIN_ZOOM:
+        return pd.DataFrame(columns=HOVER_COLUMNS + ["lat", "lon"])
+    points = registry.get("landschaft_points")
+    if bbox:
+        lat, lon = points["lat"].to_numpy(), points["lon"].to_numpy()
+        points = points[(lon >= bbox[0]) & (lat >= bbox[1]) & (lon <= bbox[2]) & (lat <= bbox[3])]
+    return points
+
+
 @callback(
     Output('graph-content-land', 'figure'),
     Input('dropdown-land', 'value'),
+    Input('graph-content-land', 'relayoutData'),
 )
-def update_graph(pop):
-    print("Loading Shape data...")
-    filepath = "static/landschaft.gpkg"
-    gdf = gpd.read_file(filepath)
-    gdf.set_crs(epsg=2056, inplace=True)
-    gdf = gdf.to_crs(epsg=4326)
+@instrument_callback("land")
+def update_graph(pop, relayout_data=None):
+    # Type list read once per process (see data_registry), the polygons are not loaded for the figure
+    types = registry.get("landschaft_types")
+    mark_phase("data_load")
 
-    print("Columns: ", gdf.columns)
-    print("Shape: ", gdf.shape)
-    print(gdf.head())
-    print(gdf.index)
+    # The polygons are served as vector tiles by the FastAPI app (see vector_tiles), the figure only references them
+    tile_url = tile_base_url() + "/tiles/landschaft/{z}/{x}/{y}.pbf"
+    colors = sample_colorscale("earth", [i / max(len(types) - 1, 1) for i in range(len(types))])
+    layers = [dict(sourcetype="vector",
+                   source=[tile_url],
+                   sourcelayer=f"landschaft_{typ}",
+                   type="fill",
+                   color=color,
+                   opacity=0.6,
+                   below="traces",
+                   visible=True)
+              for typ, color in zip(types, colors)]
 
-    print("Converting to GeoJSON...")
-    geojson_data = json.loads(gdf.to_json())    # Needed for Choroplethmapbox
+    zoom, bbox = viewport_from_relayout(relayout_data)
+    points = hover_points(zoom, bbox)
+    mark_phase("transform")
 
     print("Drawing Map...")
     # Create a figure
-    fig = go.Figure(go.Choroplethmapbox(geojson=geojson_data,
-                                        locations=gdf.index,  # Use the DataFrame index as the location identifiers
-                                        z=gdf["TYP_NR"],  # Use a column of ones for the z parameter
-                                        showscale=False,  # Hide the color scale
-                                        colorscale="earth",
-                                        customdata=gdf[["OBJECT", "TYPNAME_DE", "REGNAME_DE"]],
-                                        hovertemplate='<b>%{customdata[0]}</b> - %{customdata[1]}'
-                                                      '<br>Region: %{customdata[2]}'
-                                                      '<extra></extra>',
-                                        visible=True
-                                        ))
+    fig = go.Figure(go.Scattermapbox(lat=points["lat"].to_numpy(),
+                                     lon=points["lon"].to_numpy(),
+                                     mode="markers",
+                                     marker=dict(size=8, color="white", opacity=0.6),
+                                     customdata=points[HOVER_COLUMNS].to_numpy(dtype=object),
+                                     hovertemplate='<b>%{customdata[0]}</b> - %{customdata[1]}'
+                                                   '<br>Region: %{customdata[2]}'
+                                                   '<extra></extra>',
+                                     visible=True
+                                     ))
 
     token = os.getenv("MAPBOX_TOKEN")
 
-    # Add a button to the layout that toggles the visibility of the Choroplethmapbox
+    # Add a button to the layout that toggles the visibility of the landscape layers
     fig.update_layout(
+        mapbox_layers=layers,
         mapbox_accesstoken=token,
         mapbox_style="satellite",
         # mapbox_style="carto-positron",
@@ -74,18 +118,19 @@ def update_graph(pop):
         # coloraxis_showscale=False,  # Hide the color scale
         font=dict(color='darkgray'),
         margin=dict(l=0, r=0, b=0, t=0),
+        uirevision='land',  # keep the user's zoom and position when the hover points are updated
         updatemenus=[
             dict(
                 type="buttons",
                 direction="right",
                 buttons=list([
                     dict(
-                        args=[{"visible": [True]}],
+                        args=[{"visible": [True]}, layers_visible(len(layers), True)],
                         label="Show",
                         method="update",
                     ),
                     dict(
-                        args=[{"visible": [False]}],
+                        args=[{"visible": [False]}, layers_visible(len(layers), False)],
                         label="Hide",
                         method="update",
                     )
@@ -1,9 +1,14 @@
+import numpy as np
 import plotly.graph_objects as go
-import plotly.express as px
 import dash
 from dash import callback, Output, Input, dcc, html
 
-import geopandas as gpd
+from dash_map_search import map_search
+from data_loader import TECHNOLOGY_BITS
+from data_registry import registry
+from figure_encoding import encode_figure
+from metrics import instrument_callback, mark_phase
+from point_clustering import viewport_from_relayout, cluster_marker_size
 
 dash.register_page(
     __name__,
@@ -18,6 +23,7 @@ dash.register_page(
 layout = [
     html.H3(children='Mobile Network Antennas'),
     dcc.Dropdown([], "", className='ddown', id='dropdown-data', style={'display': 'none'}),
+    map_search('graph-content-data'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -25,71 +31,84 @@ layout = [
     ),
 ]
 
+# customdata columns (typ, techno, power) of the antennas that are dictionary encoded, fewest distinct values first
+ANTENNA_CATEGORY_COLUMNS = [2, 0, 1]
+
+
+def cluster_customdata(result, power_classes):
+    # Tooltip columns (typ, techno, power) of the cluster markers: antenna count, technology mix and power mix
+    aggregates = result["aggregates"]
+    customdata = np.empty((len(result["count"]), 3), dtype=object)
+    for i, count in enumerate(result["count"]):
+        customdata[i, 0] = f"{count} antennas"
+        customdata[i, 1] = ", ".join(f"{t} {int(aggregates[t][i])}" for t in TECHNOLOGY_BITS)
+        customdata[i, 2] = ", ".join(f"{p.split('(')[0].split(':')[-1].strip()} {int(aggregates[p][i])}"
+                                     for p in power_classes if aggregates[p][i])
+    return customdata
+
+
 @callback(
     Output('graph-content-data', 'figure'),
     Input('dropdown-data', 'value'),
+    Input('graph-content-data', 'relayoutData'),
 )
-def update_graph(pop):
+@instrument_callback("mobile")
+def update_graph(pop, relayout_data=None):
 
-    # print("Loading Shape data...")
-    gdf = gpd.read_file("static/mobilfunk.json")
+    # Antenna layers are pre-split per technology at load time (see data_loader.build_antenna_layers)
+    layers = registry.get("mobilfunk_layers")
+    cluster_indexes = registry.get("mobilfunk_clusters")
+    mark_phase("data_load")
 
     # count
-    count = len(gdf)
-
-    # filter by column techno_de containing "5G"
-    print("Filtering by antenna technology...")
-    gdf_5g = gdf[gdf["techno_de"].str.contains("5G")]
-    gdf_4g = gdf[gdf["techno_de"].str.contains("4G")]
-    gdf_3g = gdf[gdf["techno_de"].str.contains("3G")]
+    count = layers["count"]
 
-    # print("Generating Map...")
-    # # Create a separate density_mapbox for each GeoDataFrame
-    # density_3g = px.density_mapbox(gdf_3g, lat=gdf_3g.geometry.y, lon=gdf_3g.geometry.x, radius=gdf_3g.power_code,
-    #                                custom_data=['typ_de', 'techno_de', 'power_de'],
-    #                                color_continuous_scale="spectral",
-    #                                )
-    # density_4g = px.density_mapbox(gdf_4g, lat=gdf_4g.geometry.y, lon=gdf_4g.geometry.x, radius=gdf_4g.power_code,
-    #                                custom_data=['typ_de', 'techno_de', 'power_de'],
-    #                                )
-    # density_5g = px.density_mapbox(gdf_5g, lat=gdf_5g.geometry.y, lon=gdf_5g.geometry.x, radius=gdf_5g.power_code,
-    #                                custom_data=['typ_de', 'techno_de', 'power_de'],
-    #                                )
-    #
-    # # Combine the figures into a single figure
-    # fig = go.Figure(data=density_3g.data + density_4g.data + density_5g.data)
+    # Antennas are clustered at low zoom levels and shown individually once zoomed in
+    zoom, bbox = viewport_from_relayout(relayout_data)
+    power_classes = layers["tables"]["power_de"]
+    results = {}
+    for technology, (start, stop) in layers["slices"].items():
+        techno_mask = layers["techno_mask"][start:stop]
+        power_codes = layers["codes"][start:stop, 2]
+        aggregates = {t: (techno_mask & bit) > 0 for t, bit in TECHNOLOGY_BITS.items()}
+        aggregates.update({p: power_codes == i for i, p in enumerate(power_classes)})
+        results[technology] = cluster_indexes[technology].query(zoom, aggregates=aggregates, bbox=bbox)
+    mark_phase("transform")
 
     print("Generating Map...")
-    # Create a separate scatter_mapbox for each GeoDataFrame
-    scatter_3g = go.Scattermapbox(
-        lat=gdf_3g.geometry.y, lon=gdf_3g.geometry.x, mode='markers',
-        marker={'size': gdf_3g.power_code, 'opacity': 0.7},
-        customdata=gdf_3g[['typ_de', 'techno_de', 'power_de']].values,
-        name='3G'
-    )
-
-    scatter_4g = go.Scattermapbox(
-        lat=gdf_4g.geometry.y, lon=gdf_4g.geometry.x, mode='markers',
-        marker={'size': gdf_4g.power_code, 'opacity': 0.7},
-        customdata=gdf_4g[['typ_de', 'techno_de', 'power_de']].values,
-        name='4G'
-    )
-
-    scatter_5g = go.Scattermapbox(
-        lat=gdf_5g.geometry.y, lon=gdf_5g.geometry.x, mode='markers',
-        marker={'size': gdf_5g.power_code, 'opacity': 0.7},
-        customdata=gdf_5g[['typ_de', 'techno_de', 'power_de']].values,
-        name='5G'
-    )
+    # Create separate scatter_mapboxes for each technology: its clusters and its individual antennas
+    traces = []
+    hovertemplate = ("Techno: %{customdata[1]}"
+                     "<br>Power: %{customdata[2]}"
+                     "<br>Typ: %{customdata[0]}"
+                     "<br>GPS: %{lat:.5f}, %{lon:.5f}")
+    for technology, (start, stop) in layers["slices"].items():
+        result = results[technology]
+        points = result["points"] + start
+        traces.append(go.Scattermapbox(
+            lat=result["lat"],
+            lon=result["lon"],
+            mode='markers',
+            marker={'size': cluster_marker_size(result["count"]), 'opacity': 0.7},
+            customdata=cluster_customdata(result, power_classes),
+            hovertemplate=hovertemplate,
+            name=technology,
+            legendgroup=technology,
+        ))
+        traces.append(go.Scattermapbox(
+            lat=layers["lat"][points],
+            lon=layers["lon"][points],
+            mode='markers',
+            marker={'size': layers["size"][points], 'opacity': 0.7},
+            customdata=layers["customdata"][points],
+            hovertemplate=hovertemplate,
+            name=technology,
+            legendgroup=technology,
+            showlegend=False,
+        ))
 
     # Combine the figures into a single figure
-    fig = go.Figure(data=[scatter_3g, scatter_4g, scatter_5g])
-    fig.update_traces(hovertemplate=""
-                                    "Techno: %{customdata[1]}"
-                                    "<br>Power: %{customdata[2]}"
-                                    "<br>Typ: %{customdata[0]}"
-                                    "<br>GPS: %{lat}, %{lon}"
-                      )
+    fig = go.Figure(data=traces)
 
     # token = os.getenv("MAPBOX_TOKEN")
     # Add buttons to the layout to control the visibility of each trace
@@ -101,6 +120,7 @@ def update_graph(pop):
         mapbox_zoom=7,
         mapbox_center={"lat": 47, "lon": 8.2},
         font=dict(color='darkgray'),
+        uirevision='mobile',  # keep the user's zoom and position when the clusters are updated
         legend=dict(
             orientation="h",  # Horizontal orientation
             yanchor="bottom",
@@ -114,22 +134,22 @@ def update_graph(pop):
                 direction="right",
                 buttons=list([
                     dict(
-                        args=[{"visible": [True, False, False]}],
+                        args=[{"visible": [True, True, False, False, False, False]}],
                         label="Show 3G",
                         method="update",
                     ),
                     dict(
-                        args=[{"visible": [False, True, False]}],
+                        args=[{"visible": [False, False, True, True, False, False]}],
                         label="Show 4G",
                         method="update",
                     ),
                     dict(
-                        args=[{"visible": [False, False, True]}],
+                        args=[{"visible": [False, False, False, False, True, True]}],
                         label="Show 5G",
                         method="update",
                     ),
                     dict(
-                        args=[{"visible": [True, True, True]}],
+                        args=[{"visible": [True] * 6}],
                         label="Show All",
                         method="update",
                     )
@@ -144,4 +164,6 @@ def update_graph(pop):
         ]
     )
     print("Returning figure...")
-    return fig
+    # Coordinates as typed arrays, antennas split per power class and type so that the repeated strings are sent
+    # once per trace (see figure_encoding)
+    return encode_figure(fig, categories=[None, ANTENNA_CATEGORY_COLUMNS] * len(layers["slices"]))
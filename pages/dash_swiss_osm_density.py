@@ -1,15 +1,17 @@
 import json
 
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import dash
 from dash import html, dcc, callback, Output, Input
-from geopandas import sjoin
-import geopandas as gpd
 
+from dash_map_search import map_search
+from data_loader import count_points_in_shapes
 from data_loader_overpy import get_data_overpy, get_tag_keys_values_options
 from dash_modal_long_wait import modal, toggle_modal
+from data_registry import registry
+from metrics import instrument_callback, mark_phase
+from task_pool import run_latest
 
 
 dash.register_page(
@@ -23,11 +25,11 @@ dash.register_page(
 
 tag_keys, tag_values, tag_key_value_list = get_tag_keys_values_options()
 
-# Define the shape files (Kantone, Bezirke, Gemeinden), and their file paths (files have been pre-processed)
+# Define the shape datasets (Kantone, Bezirke, Gemeinden), files have been pre-processed (see data_registry)
 shape_files_dict = {"-": "",
-                    "Kantone": "static/gdf_kan.json",
-                    "Bezirke": "static/gdf_bez.json",
-                    "Gemeinden": "static/gdf_gem.json",
+                    "Kantone": "gdf_kan",
+                    "Bezirke": "gdf_bez",
+                    "Gemeinden": "gdf_gem",
                     }
 
 ddown_options = list(shape_files_dict.keys())
@@ -45,6 +47,7 @@ layout = html.Div([
             dcc.Dropdown(ddown_options, '-', className='ddown', id='dropdown-shape')
         ], className='ddmenu')
     ], className='ddmenu'),
+    map_search('graph-content-3'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -61,21 +64,14 @@ layout = html.Div([
 ])
 
 
-def count_points_in_polygon(poi_df, gdf):
+def count_points_in_polygon(poi_df, gdf, shape_dataset):
     print("Counting POIs in each shape...")
-    # Convert the DataFrame to a GeoDataFrame
-    poi_gdf = gpd.GeoDataFrame(poi_df, geometry=gpd.points_from_xy(poi_df.longs, poi_df.lats))
-    poi_gdf.crs = gdf.crs
-
-    # Perform a spatial join operation
-    joined_gdf = sjoin(poi_gdf, gdf, how='inner', predicate='within')
-
-    # Count the number of points in each polygon
-    counts = joined_gdf['index_right'].value_counts()
+    # Point in polygon counting runs in the task pool, a newer request of the same user discards this one
+    counts = run_latest('graph-content-3', count_points_in_shapes, shape_dataset,
+                        poi_df['longs'].to_numpy(dtype=float), poi_df['lats'].to_numpy(dtype=float))
 
     # Update the 'COUNT' column in the original GeoDataFrame
     gdf['COUNT'] = counts
-    gdf['COUNT'] = gdf['COUNT'].fillna(0)
 
     print("Calculating density...")
     gdf['OSM_DICHTE'] = gdf['COUNT'] / gdf['DICHTE'] * 1000
@@ -88,18 +84,22 @@ def count_points_in_polygon(poi_df, gdf):
     Input('dropdown-value', 'value'),
     Input('dropdown-shape', 'value'),
 )
+@instrument_callback("density")
 def update_graph(tag_value="shop", shape_type=None, country_code="CH"):
+    import plotly.express as px
     if tag_value not in tag_values:
         tag_value = 'books'
     tag_key = tag_key_value_list[tag_value]
 
     data_dict = get_data_overpy(country_code, tag_key, tag_value)
+    mark_phase("data_load")
 
     total_points = len(data_dict["names"])
     print(f"Plotting nodes for {tag_value}: {total_points}")
 
     # Create a pandas DataFrame from the dictionary
     poi_df = pd.DataFrame(data_dict)
+    mark_phase("transform")
 
     fig = px.density_mapbox(poi_df, lat=data_dict["lats"], lon=data_dict["longs"], radius=5, zoom=7,
                             mapbox_style="open-street-map", color_continuous_scale="oxy",
@@ -125,10 +125,12 @@ def update_graph(tag_value="shop", shape_type=None, country_code="CH"):
                       )
     # Draw map with shape data
     if shape_type in ddown_options[1:]:
-        # load the shape data
-        filepath = shape_files_dict.get(shape_type)
+        # closes the density map build, the shape layer below has its own data_load / transform phases
+        mark_phase("figure_build")
+        # load the shape data (shared dataset, the map below returns a modified copy)
         print("Loading Shape data...")
-        gdf = gpd.read_file(filepath)
+        gdf = registry.get(shape_files_dict.get(shape_type))
+        mark_phase("data_load")
         print("Converting to GeoJSON...")
 
         # geojson_data = json.loads(gdf.to_json())
@@ -137,7 +139,8 @@ def update_graph(tag_value="shop", shape_type=None, country_code="CH"):
         geojson_data = json.loads(gdf.to_json())
 
         # Count the number of points in each polygon
-        gdf, z_max = count_points_in_polygon(poi_df, gdf)
+        gdf, z_max = count_points_in_polygon(poi_df, gdf, shape_files_dict.get(shape_type))
+        mark_phase("transform")
 
         print("Drawing Choroplethmapbox...")
         fig.add_trace(
@@ -4,8 +4,10 @@ import pandas as pd
 import plotly.graph_objects as go
 import dash
 from dash import callback, dcc, Input, Output, html
-import geopandas as gpd
+from dash_map_search import map_search
 from dash_modal_long_wait import modal, toggle_modal
+from data_registry import registry
+from metrics import instrument_callback, mark_phase
 
 dash.register_page(
     __name__,
@@ -19,22 +21,14 @@ dash.register_page(
 
 TEMP_DIR = 'temp'
 
-# Define the shape files (Kantone, Bezirke, Gemeinden), and their file paths (files have been pre-processed)
-shape_files_dict = {"Kantone": ["static/gdf_kan.json", "KANTONSFLA", [1000000, 5000, 10000]],
-                    "Bezirke": ["static/gdf_bez.json", "BEZIRKSFLA", [100000, 500, 10000]],
-                    "Gemeinden": ["static/gdf_gem.json","GEMEINDEFLA", [100000, 200, 10000]]}
+# Define the shape datasets (Kantone, Bezirke, Gemeinden), their area columns and z max values (see data_registry)
+shape_files_dict = {"Kantone": ["gdf_kan", "KANTONSFLA", [1000000, 5000, 10000]],
+                    "Bezirke": ["gdf_bez", "BEZIRKSFLA", [100000, 500, 10000]],
+                    "Gemeinden": ["gdf_gem", "GEMEINDEFLA", [100000, 200, 10000]]}
 
 ddown_options = list(shape_files_dict.keys())
 DATA_OPTIONS = ["Population", "Area", "Density"]
 
-filepath = "static/gdf_kan.json"
-print("Loading Shape data for all shapes...")
-gdf_kan = gpd.read_file("static/gdf_kan.json")
-gdf_bez = gpd.read_file("static/gdf_bez.json")
-gdf_gem = gpd.read_file("static/gdf_gem.json")
-
-gdf_preload = {"Kantone":gdf_kan, "Bezirke":gdf_bez, "Gemeinden":gdf_gem}
-
 layout = [
     modal,
     html.H3(children='Swiss Population'),
@@ -42,6 +36,7 @@ layout = [
         dcc.Dropdown(ddown_options, 'Kantone', className='ddown', id='dropdown-shape'),
         dcc.Dropdown(DATA_OPTIONS, "Population", className='ddown', id='dropdown-pop'),
     ], className="ddmenu"),
+    map_search('graph-content-2'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -63,13 +58,13 @@ layout = [
     Input('dropdown-shape', 'value'),
     Input('dropdown-pop', 'value'),
 )
+@instrument_callback("population")
 def update_graph(shape_type="Kantone", api_id="Population"):
     print("Loading Shape data...")
-    try:
-        gdf = gdf_preload.get(shape_type)
-    except:
-        filepath = shape_files_dict.get(shape_type)[0]
-        gdf = gpd.read_file(filepath)
+    if shape_type not in shape_files_dict:
+        shape_type = "Kantone"
+    gdf = registry.get(shape_files_dict.get(shape_type)[0])
+    mark_phase("data_load")
 
     print("Converting to GeoJSON...")
     # geojson_data = json.loads(gdf.to_json())    # Needed for Choroplethmapbox
@@ -88,6 +83,7 @@ def update_graph(shape_type="Kantone", api_id="Population"):
     if api_id == 'Density':
         fact = gdf['DICHTE']
         z_max = z_max_options[2]
+    mark_phase("transform")
 
     print("Drawing Map...")
     # Create a figure
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+import dash
+from dash import callback, dcc, Input, Output, html
+
+from dash_map_search import map_search
+from data_registry import registry
+from metrics import instrument_callback, mark_phase
+
+dash.register_page(
+    __name__,
+    name='Wind Turbines',
+    title='Wind Turbines in Switzerland',
+    description='Map of the wind turbines in Switzerland with their rated power and operational status.',
+    path="/wind",
+    image_url='https://f-web-cdn.fra1.cdn.digitaloceanspaces.com/wind.png',
+    order=160
+)
+
+colors = {"Normalbetrieb": "deepskyblue", "Stillgelegt": "gray"}
+
+layout = [
+    html.H3(children='Swiss Wind Turbines'),
+    dcc.Dropdown(["All"] + list(colors), "All", className='ddown', id='dropdown-wind'),
+    map_search('graph-content-wind'),
+    dcc.Loading(
+        id="loading",
+        type="circle",
+        children=dcc.Graph(id='graph-content-wind', className="graph-content", style={'height': '80vh', 'width': '100%'})
+    ),
+]
+
+
+@callback(
+    Output('graph-content-wind', 'figure'),
+    Input('dropdown-wind', 'value'),
+)
+@instrument_callback("wind")
+def update_graph(status="All"):
+    # Turbine locations reprojected from LV95 once per process (see data_registry)
+    df = registry.get("wind_turbines")
+    mark_phase("data_load")
+
+    if status in colors:
+        df = df[df["status"] == status]
+    mark_phase("transform")
+
+    fig = go.Figure(go.Scattermapbox(lat=df["lat"],
+                                     lon=df["lon"],
+                                     mode="markers",
+                                     # marker area proportional to the rated power
+                                     marker=dict(size=np.sqrt(df["ratedPower"].fillna(0)) / 2 + 6,
+                                                 color=df["status"].map(colors).fillna("white"),
+                                                 opacity=0.8),
+                                     customdata=df[["manufacturer", "model", "ratedPower", "hubHeight",
+                                                    "yearOfConstruction", "status"]],
+                                     hovertemplate='<b>%{customdata[0]} %{customdata[1]}</b>'
+                                                   '<br>Rated power: %{customdata[2]} kW'
+                                                   '<br>Hub height: %{customdata[3]} m'
+                                                   '<br>Built: %{customdata[4]}'
+                                                   '<br>Status: %{customdata[5]}'
+                                                   '<extra></extra>',
+                                     ))
+    token = os.getenv("MAPBOX_TOKEN")
+    fig.update_layout(title_text=f"{len(df)} wind turbines, {df['ratedPower'].sum() / 1000:.1f} MW",
+                      title_font={'size': 12, 'color': 'lightgray'},
+                      mapbox={
+                          'accesstoken': token,
+                          'style': "outdoors",
+                          'zoom': 7,
+                          'center': dict(lat=46.8, lon=8.2),
+                      },
+                      autosize=True,
+                      margin=dict(l=0, r=0, b=0, t=0),
+                      paper_bgcolor='rgba(0,0,0,0)',
+                      font=dict(color='lightgray'),
+                      )
+    return fig
@@ -1,10 +1,10 @@
 # Zürich Tourism API: https://www.zuerich.com/en/api/v2/data
-import pandas as pd
-import plotly.express as px
 import dash
 from dash import callback, Output, Input, dcc, html
 
-from data_loader import ZueriData
+from dash_map_search import map_search
+from data_loader import ZueriData, zueri_poi_index
+from metrics import instrument_callback, mark_phase
 
 dash.register_page(
     __name__,
@@ -16,12 +16,13 @@ dash.register_page(
     order=10
 )
 
-# Get API endpoints will be used to populate dropdown menu
-api_ids_names = ZueriData().get_endpoint_list()
+# API endpoints used to populate the dropdown menu, fetched on the first visit of the page instead of at import
+endpoint_options = {}
 
 layout = [
     html.H3(children='Zürich Tourism POIs'),
-    dcc.Dropdown(api_ids_names, '101', className='ddown', id='dropdown-id'),
+    dcc.Dropdown({'101': '101'}, ['101'], multi=True, className='ddown', id='dropdown-id'),
+    map_search('graph-content-1'),
     dcc.Loading(
         id="loading",
         type="circle",
@@ -39,51 +40,54 @@ layout = [
 ]
 
 
+def get_endpoint_options():
+    if not endpoint_options:
+        api_ids_names = ZueriData().get_endpoint_list()
+        # the error placeholder is not kept, the next visit tries again
+        if 'Error Retrieving data...' in api_ids_names.values():
+            return api_ids_names
+        endpoint_options.update(api_ids_names)
+    return endpoint_options
+
+
+@callback(
+    Output('dropdown-id', 'options'),
+    Input('dropdown-id', 'id'),
+)
+@instrument_callback("zueri_endpoints")
+def load_endpoint_options(_):
+    return get_endpoint_options()
+
+
 @callback(
     Output('graph-content-1', 'figure'),
     Input('dropdown-id', 'value'),
 )
-def update_graph(api_id=101):
-    zueri_data = ZueriData()
-    names = []
-    lats = []
-    longs = []
-    infos = []
+@instrument_callback("zueri")
+def update_graph(api_ids=None):
+    import plotly.express as px
+    api_ids = api_ids or []
+    if isinstance(api_ids, (str, int)):
+        api_ids = [api_ids]
 
-    data = zueri_data.get_api_data(api_id)
-    print(f'Received {len(data)} items')
+    # POIs of all selected endpoints from the shared index, each POI only once
+    zueri_poi_index.ensure(api_ids)
+    mark_phase("data_load")
 
-    for item in data:
-        if item.get('geoCoordinates') is None:
-            continue
-        try:  # not all entries have a name
-            names.append(item.get('name').get('de'))
-            longs.append(item.get('geoCoordinates').get('longitude'))
-            lats.append(item.get('geoCoordinates').get('latitude'))
-            infos.append(item.get('address').get('url'))
-        except KeyError:
-            names.append("n/a")
-
-    data_dict = dict(
-        names=names,
-        longs=longs,
-        lats=lats,
-        infos=infos
-    )
-    total_points = len(data_dict.get('names'))
+    df = zueri_poi_index.select(api_ids)
+    total_points = len(df)
     print(f'Displaying {total_points} items')
-    # show plotly dash modal
-
-    # Create a pandas DataFrame from the dictionary
-    df = pd.DataFrame(data_dict)
-    fig = px.density_mapbox(df, lat=lats, lon=longs, radius=10,
+    mark_phase("transform")
+    fig = px.density_mapbox(df, lat='lats', lon='longs', radius=10,
                             mapbox_style="open-street-map",
                             color_continuous_scale="spectral",
                             custom_data=['names', 'infos'],
                             center=dict(lat=47.37, lon=8.53), zoom=12,
                             )
     fig.update_traces(hovertemplate="Name: %{customdata[0]} <br><a href='%{customdata[1]}'>%{customdata[1]}</a> <br>Coordinates: %{lat}, %{lon}")
-    fig.update_layout(title_text=f"{api_ids_names.get(str(api_id))}: {total_points} points", title_font={'size': 12, 'color': 'lightgray'})
+    api_ids_names = get_endpoint_options()
+    title = ", ".join(str(api_ids_names.get(str(api_id), api_id)) for api_id in api_ids)
+    fig.update_layout(title_text=f"{title}: {total_points} points", title_font={'size': 12, 'color': 'lightgray'})
     fig.update_layout(coloraxis_showscale=False,
                       autosize=True,
                       margin=dict(l=0, r=0, b=0, t=0),
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Cluster radius in pixels and tile extent used to convert the radius to map units (as in supercluster)
+CLUSTER_RADIUS = 60
+TILE_EXTENT = 512
+
+
+def mercator_xy(lat, lon):
+    # Web Mercator coordinates normalized to [0, 1]
+    x = np.asarray(lon, dtype=np.float64) / 360 + 0.5
+    sin = np.sin(np.radians(np.clip(np.asarray(lat, dtype=np.float64), -85.05, 85.05)))
+    y = 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / np.pi
+    return x, y
+
+
+class ClusterIndex:
+    """
+    Hierarchical point clustering precomputed for every zoom level.
+    At zoom z the map is divided into cells of CLUSTER_RADIUS pixels, all points of a cell form a cluster.
+    Cells of zoom z are exactly four cells of zoom z + 1, so the clusters nest from one level to the next.
+    Above max_zoom all points are shown individually.
+    """
+
+    def __init__(self, lat, lon, min_zoom=0, max_zoom=13, radius=CLUSTER_RADIUS):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.labels = {}
+        self.n_clusters = {}
+        x, y = mercator_xy(self.lat, self.lon)
+        for zoom in range(min_zoom, max_zoom + 1):
+            cells = 2 ** zoom * TILE_EXTENT / radius
+            cx = np.floor(x * cells).astype(np.int64)
+            cy = np.floor(y * cells).astype(np.int64)
+            keys, labels = np.unique(cx * (int(cells) + 1) + cy, return_inverse=True)
+            self.labels[zoom] = labels.astype(np.int32)
+            self.n_clusters[zoom] = len(keys)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def query(self, zoom, mask=None, aggregates=None, bbox=None):
+        """
+        Returns the clusters and the individual points visible at a zoom level.
+            mask: boolean array selecting the points to cluster (e.g. a status filter)
+            aggregates: {name: boolean or numeric array}, summed per cluster (e.g. the status mix)
+            bbox: (lon_min, lat_min, lon_max, lat_max) of the viewport, clusters and points outside are dropped
+        Result: dict with cluster lat, lon, count and aggregate sums, and the indices of the individual points.
+        """
+        mask = np.ones(len(self), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        aggregates = aggregates or {}
+        zoom = int(np.floor(zoom or 0))
+        zoom = max(zoom, self.min_zoom)
+
+        if zoom > self.max_zoom:
+            points = np.flatnonzero(mask & self._in_bbox(self.lat, self.lon, bbox))
+            return dict(lat=np.empty(0), lon=np.empty(0), count=np.empty(0, dtype=np.int64),
+                        aggregates={name: np.empty(0) for name in aggregates}, points=points)
+
+        labels = self.labels[zoom]
+        n = self.n_clusters[zoom]
+        weights = mask.astype(np.float64)
+        count = np.bincount(labels, weights, n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            lat = np.bincount(labels, weights * self.lat, n) / count
+            lon = np.bincount(labels, weights * self.lon, n) / count
+        sums = {name: np.bincount(labels, weights * np.asarray(values, dtype=np.float64), n)
+                for name, values in aggregates.items()}
+
+        # Clusters with a single selected point are shown as that point
+        clusters = np.flatnonzero((count > 1) & self._in_bbox(lat, lon, bbox))
+        points = np.flatnonzero(mask & (count[labels] == 1) & self._in_bbox(self.lat, self.lon, bbox))
+        return dict(lat=lat[clusters], lon=lon[clusters], count=count[clusters].astype(np.int64),
+                    aggregates={name: values[clusters] for name, values in sums.items()}, points=points)
+
+    @staticmethod
+    def _in_bbox(lat, lon, bbox):
+        if bbox is None:
+            return np.ones(len(lat), dtype=bool)
+        lon_min, lat_min, lon_max, lat_max = bbox
+        return (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+
+
+def viewport_from_relayout(relayout_data, default_zoom=7):
+    """Reads zoom and bounding box (with a margin) of a mapbox figure from the graph's relayoutData."""
+    relayout_data = relayout_data or {}
+    zoom = relayout_data.get("mapbox.zoom", default_zoom)
+    corners = (relayout_data.get("mapbox._derived") or {}).get("coordinates")
+    bbox = None
+    if corners:
+        lons = [c[0] for c in corners]
+        lats = [c[1] for c in corners]
+        # margin of half a viewport so that small pans do not show empty borders
+        dx = (max(lons) - min(lons)) / 2
+        dy = (max(lats) - min(lats)) / 2
+        bbox = (min(lons) - dx, min(lats) - dy, max(lons) + dx, max(lats) + dy)
+    return zoom, bbox
+
+
+def cluster_marker_size(count):
+    # Marker size growing with the log of the number of points in a cluster
+    return np.clip(12 + 4 * np.log2(np.maximum(count, 1)), 12, 40)
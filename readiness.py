@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+import traceback
+
+from cache_warmup import popularity, warmup_scheduler
+from data_registry import registry
+from ev_catalogue import ev_catalogue, ev_live_status
+from ev_nearest import nearest_chargers
+from metrics import Gauge
+from search_index import search_index
+from snapshot import restore
+from task_pool import start_workers
+
+# Datasets that have to be in memory before the instance takes traffic, the other datasets are loaded afterwards
+CRITICAL_DATASETS = [name.strip() for name in
+                     os.getenv("CRITICAL_DATASETS", "gdf_kan,gdf_bez,gdf_gem,ant_gdf,mobilfunk_layers").split(",")
+                     if name.strip()]
+# The warm-up of the caches is waited for at most this long, an unreachable upstream must not keep the instance out
+READINESS_WARMUP_TIMEOUT = int(os.getenv("READINESS_WARMUP_TIMEOUT", 120))
+# Number of popular upstream combinations whose cache age is reported
+FRESHNESS_TOP_N = 10
+
+
+class Preloader:
+    """
+    Loads the critical datasets and warms up the caches in a background thread after the server started, so that
+    liveness can be answered right away while readiness waits until the first requests will not hit cold data.
+    Steps: data snapshot restore (see snapshot), critical datasets, EV station catalogue and live status, most popular
+    upstream queries (cache_warmup), search index, task pool workers, then the remaining datasets (not waited for).
+    """
+
+    def __init__(self, critical=CRITICAL_DATASETS, warmup_timeout=READINESS_WARMUP_TIMEOUT):
+        self.critical = [name for name in critical if name in registry.names()]
+        self.warmup_timeout = warmup_timeout
+        self.datasets = {name: {"state": "pending", "error": None} for name in registry.names()}
+        self.snapshot = {"state": "pending", "version": None, "created_at": None}
+        self.warmup = {"state": "pending", "steps": {}, "started_at": None, "finished_at": None}
+        self.warmup_steps = [("ev_catalogue", ev_catalogue.get),
+                             ("ev_live_status", ev_live_status.get),
+                             ("ev_nearest", lambda: nearest_chargers.query(46.8, 8.2, 1)),
+                             ("upstream", self._warm_upstream),
+                             ("search_index", search_index.build),
+                             ("task_pool", start_workers)]
+        self._thread = None
+        self._lock = threading.Lock()
+        unknown = set(critical) - set(self.critical)
+        if unknown:
+            print(f"Unknown critical datasets ignored: {', '.join(sorted(unknown))}")
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="preload", daemon=True)
+                    self._thread.start()
+
+    def _load(self, name):
+        status = self.datasets[name]
+        status["state"] = "loading"
+        try:
+            registry.get(name)
+            status["state"] = "loaded"
+        except Exception as e:
+            traceback.print_exc()
+            status.update(state="failed", error=str(e))
+
+    def _warm(self, name, func):
+        step = self.warmup["steps"][name] = {"state": "running", "error": None}
+        try:
+            func()
+            step["state"] = "done"
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            step.update(state="failed", error=str(e))
+
+    @staticmethod
+    def _warm_upstream():
+        # Loads the recorded popularity and starts the periodic warm-up, its first cycle is run right away
+        warmup_scheduler.start()
+        warmup_scheduler.run_once()
+
+    def _restore_snapshot(self):
+        self.snapshot["state"] = "restoring"
+        try:
+            manifest = restore()
+        except Exception as e:
+            print(f"Restoring the data snapshot failed: {e}")
+            self.snapshot.update(state="failed")
+            return
+        if manifest is None:
+            self.snapshot["state"] = "missing"
+        else:
+            self.snapshot.update(state="restored", version=manifest["version"], created_at=manifest["created_at"])
+
+    def _run(self):
+        start = time.perf_counter()
+        # before anything reads the files of the snapshot
+        self._restore_snapshot()
+        for name in self.critical:
+            self._load(name)
+        print(f"Critical datasets loaded in {time.perf_counter() - start:.2f}s")
+
+        self.warmup.update(state="running", started_at=time.time())
+        for name, func in self.warmup_steps:
+            self._warm(name, func)
+        self.warmup.update(state="done", finished_at=time.time())
+
+        for name in registry.names():
+            if self.datasets[name]["state"] == "pending":
+                self._load(name)
+        print(f"Preload finished in {time.perf_counter() - start:.2f}s")
+
+    def warmup_settled(self):
+        # Done, or running for longer than the timeout
+        if self.warmup["state"] == "done":
+            return True
+        started_at = self.warmup["started_at"]
+        return started_at is not None and time.time() - started_at > self.warmup_timeout
+
+    def is_ready(self):
+        return self.snapshot["state"] not in ("pending", "restoring") \
+            and all(registry.is_loaded(name) for name in self.critical) and self.warmup_settled()
+
+    def status(self):
+        now = time.time()
+        stats = registry.stats()
+        # datasets can also be loaded by a request before the preload gets to them
+        datasets = {name: {**status, "state": "loaded" if stats[name]["loaded"] else status["state"],
+                           "critical": name in self.critical, "load_time": stats[name]["load_time"]}
+                    for name, status in self.datasets.items()}
+        steps = self.warmup["steps"]
+        warmup = {"state": self.warmup["state"],
+                  "progress": f"{sum(s['state'] != 'running' for s in steps.values())}/{len(self.warmup_steps)}",
+                  "steps": steps}
+
+        def age(updated_at):
+            return round(now - updated_at, 1) if updated_at else None
+
+        upstream = {}
+        for key in popularity.top(FRESHNESS_TOP_N):
+            cache_age = warmup_scheduler.cache_age(key)
+            upstream["/".join(key)] = round(cache_age, 1) if cache_age is not None else None
+        return {"ready": self.is_ready(),
+                "datasets": datasets,
+                "warmup": warmup,
+                "snapshot": {**self.snapshot, "age_seconds": age(self.snapshot["created_at"])},
+                "freshness_seconds": {"ev_catalogue": age(ev_catalogue.updated_at),
+                                      "ev_live_status": age(ev_live_status.updated_at),
+                                      "upstream": upstream}}
+
+
+preloader = Preloader()
+
+Gauge("app_ready", "1 once the critical datasets are loaded and the caches are warmed up.", (),
+      lambda: {(): int(preloader.is_ready())})
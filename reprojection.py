@@ -0,0 +1,71 @@
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+from task_pool import get_executor
+
+# Swiss coordinate system CH1903+ / LV95 used by most of the federal datasets
+LV95 = 2056
+WGS84 = 4326
+WEB_MERCATOR = 3857
+
+# Inputs with more coordinates are split into chunks and reprojected in the task pool (see task_pool)
+PARALLEL_THRESHOLD = 1_000_000
+CHUNK_SIZE = 250_000
+
+
+@lru_cache(maxsize=32)
+def get_transformer(src, dst):
+    # Creating a transformer is expensive (database lookups), one is kept per CRS pair and process
+    return Transformer.from_crs(src, dst, always_xy=True)
+
+
+def _transform_chunk(src, dst, x, y):
+    return get_transformer(src, dst).transform(x, y)
+
+
+def crs_key(crs):
+    # EPSG code if there is one (hashable and cheap to send to the workers), the CRS as given otherwise
+    if isinstance(crs, int):
+        return crs
+    epsg = getattr(crs, "to_epsg", lambda: None)()
+    return epsg or str(crs)
+
+
+def transform_xy(x, y, src=LV95, dst=WGS84):
+    """Reprojects coordinate arrays (x = easting / longitude, y = northing / latitude) from src to dst."""
+    src, dst = crs_key(src), crs_key(dst)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if src == dst:
+        return x.copy(), y.copy()
+    executor = get_executor() if len(x) > PARALLEL_THRESHOLD else None
+    if executor is None:
+        return _transform_chunk(src, dst, x, y)
+
+    starts = range(0, len(x), CHUNK_SIZE)
+    results = list(executor.map(_transform_chunk, [src] * len(starts), [dst] * len(starts),
+                                       [x[i:i + CHUNK_SIZE] for i in starts], [y[i:i + CHUNK_SIZE] for i in starts]))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def transform_geometries(geometries, src=LV95, dst=WGS84):
+    """Reprojects an array of shapely geometries, Z values are kept as they are."""
+    geometries = np.asarray(geometries, dtype=object)
+    include_z = bool(shapely.has_z(geometries).any())
+    coordinates = shapely.get_coordinates(geometries, include_z=include_z)
+    coordinates[:, 0], coordinates[:, 1] = transform_xy(coordinates[:, 0], coordinates[:, 1], src, dst)
+    return shapely.set_coordinates(geometries.copy(), coordinates)
+
+
+def to_crs(gdf, dst=WGS84, src=None):
+    """
+    GeoDataFrame.to_crs with cached transformers and batched (and for large layers parallel) reprojection.
+    src overrides the CRS of the frame, for files that come without (or with a wrong) CRS.
+    """
+    import geopandas as gpd
+    src = src or gdf.crs
+    geometries = transform_geometries(gdf.geometry.values, src, dst)
+    return gdf.assign(**{gdf.geometry.name: gpd.GeoSeries(geometries, index=gdf.index, crs=f"EPSG:{crs_key(dst)}")})
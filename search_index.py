@@ -0,0 +1,229 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from data_loader import zueri_poi_index
+from data_loader_overpy import get_country_codes, get_tag_keys_values_options, overpass_cache_path
+from data_registry import registry
+from metrics import Gauge
+from reprojection import WGS84, crs_key, to_crs
+
+# Boundary layers searched by their NAME, in the order their matches are listed
+BOUNDARY_KINDS = {"gdf_kan": "Kanton", "gdf_bez": "Bezirk", "gdf_gem": "Gemeinde"}
+MAX_LIMIT = 50
+# Index keys looked at per lookup, the best matches among them are returned (keeps lookups short for 1 letter)
+SCAN_LIMIT = 400
+# The cached POI sets are checked for changes at most this often, the POI index is rebuilt in the background
+POI_REFRESH_INTERVAL = 60
+# Zoom level a single point (POI) is shown at
+POINT_ZOOM = 16
+
+
+def normalize(text):
+    # Case and accent insensitive form of a name: "Zürich" and "ZURICH" -> "zurich"
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def bounds_zoom(bounds):
+    # Mapbox zoom level showing the bounds (lon_min, lat_min, lon_max, lat_max) on a map about 1000 pixels wide
+    lon_span = bounds[2] - bounds[0]
+    lat_span = (bounds[3] - bounds[1]) / max(math.cos(math.radians((bounds[1] + bounds[3]) / 2)), 0.1)
+    span = max(lon_span, lat_span * 1.6)
+    if span <= 0:
+        return POINT_ZOOM
+    return round(min(POINT_ZOOM, max(1.0, math.log2(360 / span) + 1.5)), 2)
+
+
+class PrefixIndex:
+    """
+    Sorted array of normalized names with binary search: the keys starting with a prefix are a contiguous range.
+    Every word of a name is a key of its own, "Affoltern am Albis" is also found with "albis".
+    """
+
+    def __init__(self, names, kinds, details, bounds):
+        self.names = list(names)
+        self.kinds = list(kinds)
+        self.details = list(details)
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.normalized = [normalize(name) for name in self.names]
+        keys = []
+        for i, key in enumerate(self.normalized):
+            keys.append((key, i))
+            keys.extend((key[start + 1:], i) for start in range(len(key)) if key[start] == " " and key[start + 1:])
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.ids = [i for _, i in keys]
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, prefix, limit, kinds=None):
+        # Entries with a key starting with prefix: whole name matches before word matches, then shorter names first
+        start = bisect.bisect_left(self.keys, prefix)
+        stop = min(bisect.bisect_left(self.keys, prefix + "\uffff"), start + SCAN_LIMIT)
+        best = {}
+        for position in range(start, stop):
+            i = self.ids[position]
+            if kinds and self.kinds[i] not in kinds:
+                continue
+            rank = (not self.normalized[i].startswith(prefix), len(self.names[i]), self.names[i])
+            if i not in best or rank < best[i]:
+                best[i] = rank
+        return sorted(best, key=best.get)[:limit]
+
+    def result(self, i):
+        lon_min, lat_min, lon_max, lat_max = self.bounds[i].tolist()
+        return {"name": self.names[i], "kind": self.kinds[i], "detail": self.details[i],
+                "bounds": [lon_min, lat_min, lon_max, lat_max],
+                "lat": (lat_min + lat_max) / 2, "lon": (lon_min + lon_max) / 2,
+                "zoom": bounds_zoom(self.bounds[i])}
+
+
+def build_boundary_index():
+    names, kinds, details, bounds = [], [], [], []
+    for dataset, kind in BOUNDARY_KINDS.items():
+        gdf = registry.get(dataset)
+        if crs_key(gdf.crs) != WGS84:
+            gdf = to_crs(gdf, WGS84)
+        # a name can have several shapes (exclaves), their bounds are merged
+        shape_bounds = pd.DataFrame(shapely.bounds(gdf.geometry.values), columns=["x0", "y0", "x1", "y1"])
+        shape_bounds["NAME"] = gdf["NAME"].astype(str).to_numpy()
+        merged = shape_bounds.groupby("NAME", sort=False).agg(x0=("x0", "min"), y0=("y0", "min"),
+                                                               x1=("x1", "max"), y1=("y1", "max"))
+        names.extend(merged.index)
+        kinds.extend([kind] * len(merged))
+        details.extend([None] * len(merged))
+        bounds.extend(merged[["x0", "y0", "x1", "y1"]].to_numpy())
+    return PrefixIndex(names, kinds, details, bounds)
+
+
+def cached_poi_files():
+    # (path, modification time, country, tag) of the cached Overpass results (see data_loader_overpy)
+    _, _, tag_keys = get_tag_keys_values_options()
+    files = []
+    for country in get_country_codes():
+        for tag_value, tag_key in tag_keys.items():
+            path = overpass_cache_path(country, tag_key, tag_value)
+            if os.path.exists(path):
+                files.append((path, os.path.getmtime(path), country, tag_value))
+    return files
+
+
+def build_poi_index(files):
+    names, kinds, details, bounds = [], [], [], []
+    seen = set()
+
+    def add(name, lat, lon, detail):
+        if not name or lat is None or lon is None or (name, lat, lon) in seen:
+            return
+        seen.add((name, lat, lon))
+        names.append(name)
+        kinds.append("POI")
+        details.append(detail)
+        bounds.append((lon, lat, lon, lat))
+
+    for path, _, country, tag_value in files:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Search index: skipping {path}: {e}")
+            continue
+        for name, lat, lon in zip(cached["names"], cached["lats"], cached["longs"]):
+            add(name, lat, lon, f"{tag_value}, {country}")
+    # POIs of the Zürich Tourism endpoints loaded so far
+    zueri = zueri_poi_index.select(list(zueri_poi_index.bits))
+    for name, lat, lon in zip(zueri["names"], zueri["lats"], zueri["longs"]):
+        if name != "n/a":
+            add(name, lat, lon, "Zürich Tourism")
+    return PrefixIndex(names, kinds, details, bounds)
+
+
+class SearchIndex:
+    """
+    Name search over the boundaries (Kantone, Bezirke, Gemeinden) and the POIs of the cached upstream data.
+    The boundary index is built once, the POI index is rebuilt in a background thread when the cached POI sets
+    changed. Lookups use the last complete indexes and never wait for a rebuild.
+    """
+
+    def __init__(self):
+        self._boundaries = None
+        self._pois = None            # (signature of the POI sources, index)
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    @staticmethod
+    def _poi_signature(files):
+        return tuple((path, mtime) for path, mtime, _, _ in files), len(zueri_poi_index.ingested)
+
+    def build(self):
+        # Builds the missing indexes in the calling thread, used at startup (see readiness)
+        with self._lock:
+            if self._boundaries is None:
+                start = time.perf_counter()
+                self._boundaries = build_boundary_index()
+                print(f"Built boundary search index: {len(self._boundaries)} names "
+                      f"in {time.perf_counter() - start:.2f}s")
+            if self._pois is None:
+                self._rebuild_pois()
+
+    def _rebuild_pois(self):
+        start = time.perf_counter()
+        files = cached_poi_files()
+        index = build_poi_index(files)
+        self._pois = (self._poi_signature(files), index)
+        self._checked_at = time.time()
+        print(f"Built POI search index: {len(index)} names in {time.perf_counter() - start:.2f}s")
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            self._checked_at = time.time()
+
+        def run():
+            try:
+                if self._poi_signature(cached_poi_files()) != self._pois[0]:
+                    self._rebuild_pois()
+            except Exception as e:
+                print(f"POI search index rebuild failed: {e}")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="search-index", daemon=True).start()
+
+    def search(self, query, limit=10, kinds=None):
+        """Best matches of the names starting with query (or with a word starting with it), boundaries first."""
+        if self._boundaries is None or self._pois is None:
+            self.build()
+        elif time.time() - self._checked_at > POI_REFRESH_INTERVAL:
+            self._refresh_in_background()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        results = []
+        for index in (self._boundaries, self._pois[1]):
+            if len(results) >= limit:
+                break
+            results.extend(index.result(i) for i in index.lookup(prefix, limit - len(results), kinds))
+        return results
+
+    def __len__(self):
+        return (len(self._boundaries) if self._boundaries else 0) + (len(self._pois[1]) if self._pois else 0)
+
+
+search_index = SearchIndex()
+
+Gauge("search_index_names", "Names in the search index (boundaries and POIs).", (),
+      lambda: {(): len(search_index)})
@@ -0,0 +1,186 @@
+"""
+Data snapshot: the processed upstream data (EV stations and their status, Zürich Tourism endpoints, cached Overpass
+queries, processed antenna layers) baked into one compressed bundle, e.g. while building the Docker image.
+The app restores the bundle at startup (see readiness) and refreshes the data in the background as usual, so that a
+new instance serves warm data right away, also when the upstream APIs cannot be reached.
+
+    python snapshot.py build                      # fetch the upstream data and write the bundle
+    python snapshot.py build --countries CH,DE    # also snapshot the Overpass POIs of Germany
+    python snapshot.py restore                    # extract the bundle into the working directory
+    python snapshot.py info
+"""
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "snapshot/data.tar.gz")
+# Bundles of another format version are not restored
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+
+# Files of the bundle, relative to the working directory of the app
+SNAPSHOT_PATTERNS = [
+    "static/ev_gdf.json",
+    "static/live_ev_df.json",
+    "static/mobilfunk.json",
+    "static/mobilfunk_layers.npz",
+    "static/antenna_coverage.csv",
+    "static/gdf_kan.json",
+    "static/gdf_bez.json",
+    "static/gdf_gem.json",
+    "temp/*.json",   # Overpass results, Zürich Tourism endpoints, callback popularity
+]
+
+
+def fetch_ev_data():
+    from data_loader import get_live_ev_station_data
+    from ev_catalogue import ev_catalogue
+    ev_catalogue.refresh()
+    get_live_ev_station_data()
+
+
+def fetch_zueri_data():
+    from data_loader import ZueriData
+    zueri_data = ZueriData()
+    endpoints = zueri_data.get_endpoint_list(max_age=0)
+    for api_id in endpoints:
+        zueri_data.get_api_data(api_id, max_age=0)
+
+
+def fetch_overpass_data(countries):
+    from data_loader_overpy import get_data_overpy, get_tag_keys_values_options
+    _, _, tag_keys = get_tag_keys_values_options()
+    for country in countries:
+        for tag_value, tag_key in tag_keys.items():
+            get_data_overpy(country, tag_key, tag_value)
+
+
+def process_local_data():
+    # Layers derived from the static files, written by the registry loaders when missing
+    from data_registry import registry
+    for name in ("mobilfunk_layers", "antenna_coverage"):
+        registry.get(name)
+
+
+def snapshot_files():
+    return sorted({path for pattern in SNAPSHOT_PATTERNS for path in glob.glob(pattern)
+                   if os.path.isfile(path)})
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build(output=SNAPSHOT_FILE, countries=("CH",)):
+    """Fetches and processes the upstream data, then writes the bundle. Failing sources are left out."""
+    os.makedirs("temp", exist_ok=True)
+    steps = [("ev", fetch_ev_data), ("zueri", fetch_zueri_data),
+             ("overpass", lambda: fetch_overpass_data(countries)), ("local", process_local_data)]
+    errors = {}
+    for name, step in steps:
+        print(f"Snapshot: {name}...")
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Snapshot: {name} failed: {e}")
+            errors[name] = str(e)
+        print(f"Snapshot: {name} took {time.perf_counter() - start:.1f}s")
+
+    created_at = time.time()
+    files = snapshot_files()
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": time.strftime("%Y%m%d%H%M%S", time.gmtime(created_at)),
+        "created_at": created_at,
+        "errors": errors,
+        # tar keeps whole second modification times
+        "files": {path: {"size": os.path.getsize(path), "mtime": int(os.path.getmtime(path)),
+                         "sha256": file_hash(path)} for path in files},
+    }
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    tmp_path = f"{output}.tmp"
+    with tarfile.open(tmp_path, "w:gz") as tar:
+        data = json.dumps(manifest, indent=1).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size, info.mtime = len(data), created_at
+        tar.addfile(info, io.BytesIO(data))
+        for path in files:
+            tar.add(path)
+    os.replace(tmp_path, output)
+    print(f"Snapshot {manifest['version']}: {len(files)} files, {os.path.getsize(output) / 1024 / 1024:.1f} MB "
+          f"written to {output}")
+    return manifest
+
+
+def read_manifest(path=SNAPSHOT_FILE):
+    if not os.path.exists(path):
+        return None
+    with tarfile.open(path, "r:gz") as tar:
+        return json.load(tar.extractfile(MANIFEST_NAME))
+
+
+def restore(path=SNAPSHOT_FILE, force=False):
+    """
+    Extracts the files of the bundle into the working directory. Files that are newer than their snapshot version
+    (e.g. refreshed by a previous run on a persistent volume) are kept unless force is set. The modification times of
+    the snapshot are kept, the caches see the data as old as it is and refresh it when it expired.
+    Returns the manifest, None if there is no bundle or it has another format.
+    """
+    if not os.path.exists(path):
+        print(f"No data snapshot at {path}")
+        return None
+    start = time.perf_counter()
+    with tarfile.open(path, "r:gz") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            print(f"Data snapshot format {manifest.get('format')} is not supported (expected {SNAPSHOT_FORMAT})")
+            return None
+        restored = []
+        for member in tar.getmembers():
+            entry = manifest["files"].get(member.name)
+            if entry is None or not member.isfile():
+                continue
+            if not force and os.path.exists(member.name) and os.path.getmtime(member.name) >= entry["mtime"]:
+                continue
+            restored.append(member)
+        tar.extractall(members=restored, filter="data")
+    print(f"Restored {len(restored)} of {len(manifest['files'])} files of data snapshot {manifest['version']} "
+          f"in {time.perf_counter() - start:.2f}s")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "restore", "info"])
+    parser.add_argument("--file", default=SNAPSHOT_FILE, help=f"bundle path (default {SNAPSHOT_FILE})")
+    parser.add_argument("--countries", default="CH", help="countries of the Overpass POIs, comma separated")
+    parser.add_argument("--force", action="store_true", help="restore: overwrite newer local files")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build(args.file, [c.strip() for c in args.countries.split(",") if c.strip()])
+    elif args.command == "restore":
+        restore(args.file, args.force)
+    else:
+        manifest = read_manifest(args.file)
+        if manifest is None:
+            raise SystemExit(f"No data snapshot at {args.file}")
+        age = (time.time() - manifest["created_at"]) / 3600
+        print(f"Snapshot {manifest['version']} (format {manifest['format']}), {age:.1f}h old, "
+              f"{len(manifest['files'])} files, errors: {manifest['errors'] or 'none'}")
+        for path, entry in sorted(manifest["files"].items()):
+            print(f"  {path:45} {entry['size'] / 1024:10.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
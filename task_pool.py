@@ -0,0 +1,181 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from dash.exceptions import PreventUpdate
+
+from metrics import Counter, Gauge
+
+SESSION_COOKIE = "swissmaps_session"
+# How often a waiting request checks whether it was superseded by a newer one
+POLL_INTERVAL = 0.05
+# Datasets loaded by every worker when it starts (boundaries used by data_loader.count_points_in_shapes)
+WORKER_DATASETS = [name for name in os.getenv("TASK_POOL_DATASETS", "gdf_kan,gdf_bez,gdf_gem").split(",") if name]
+
+task_results = Counter("task_pool_tasks_total", "CPU-heavy callback tasks run in the process pool.",
+                       ("task", "result"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_worker = False
+# (client, output) -> token of the newest request, older requests for the same output are superseded
+_latest = {}
+_latest_lock = threading.Lock()
+_tokens = itertools.count()
+_running = {"waiting": 0}
+
+Gauge("task_pool_waiting_requests", "Requests waiting for a task of the process pool.", (),
+      lambda: {(): _running["waiting"]})
+
+
+def _init_worker(datasets):
+    global _in_worker
+    _in_worker = True
+    if datasets:
+        # preload() without names loads every dataset
+        from data_registry import registry
+        registry.preload(datasets)
+
+
+def _start_method():
+    # The server process runs background threads (preload, EV refresh, cache warm-up), a forked worker could inherit
+    # a lock held by one of them. Workers are started from a clean forkserver process instead (spawn where there is
+    # none) and load the datasets they need themselves.
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def worker_count():
+    return int(os.getenv("TASK_POOL_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
+
+
+def get_executor():
+    """Process pool shared by the CPU-heavy callbacks (and the reprojection of large layers), None inside a worker."""
+    global _executor
+    if _in_worker:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                context = multiprocessing.get_context(_start_method())
+                if context.get_start_method() == "forkserver":
+                    # modules of the tasks imported once by the forkserver instead of by every worker
+                    context.set_forkserver_preload(["data_loader", "data_registry", "reprojection"])
+                _executor = ProcessPoolExecutor(max_workers=worker_count(), mp_context=context,
+                                                initializer=_init_worker, initargs=(WORKER_DATASETS,))
+    return _executor
+
+
+def _ping():
+    return os.getpid()
+
+
+def start_workers():
+    # Starts the workers and waits until they loaded their datasets, used at startup (see readiness)
+    executor = get_executor()
+    if executor is not None:
+        pids = set(future.result() for future in [executor.submit(_ping) for _ in range(worker_count())])
+        print(f"Task pool ready: {len(pids)} worker processes")
+
+
+def _reset_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+
+
+def client_key():
+    # Session cookie of the browser (set by install_session_cookie), remote address as fallback
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return "local"
+    if not has_request_context():
+        return "local"
+    return request.cookies.get(SESSION_COOKIE) or request.remote_addr or "local"
+
+
+def install_session_cookie(server):
+    """Gives every browser a random session id, used to find the superseded requests of a client."""
+    from flask import request
+
+    @server.after_request
+    def _set_session_cookie(response):
+        if SESSION_COOKIE not in request.cookies:
+            response.set_cookie(SESSION_COOKIE, uuid.uuid4().hex, httponly=True, samesite="Lax")
+        return response
+
+
+def run_task(func, *args):
+    """Runs func(*args) in the process pool and waits for the result (inline inside a worker process)."""
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    try:
+        return executor.submit(func, *args).result()
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        return func(*args)
+
+
+def run_latest(output, func, *args):
+    """
+    Runs func(*args) in the process pool for one output of the current client.
+    A newer request of the same client for the same output supersedes this one: the task is cancelled if it has
+    not started yet, otherwise its result is discarded. Superseded requests raise PreventUpdate right away, so that
+    the request thread is released and the figure is not updated with an outdated result.
+    """
+    key = (client_key(), output)
+    token = next(_tokens)
+    with _latest_lock:
+        _latest[key] = token
+    try:
+        return _run_latest(key, token, func, *args)
+    finally:
+        # also when the task failed, a newer request keeps its own entry
+        with _latest_lock:
+            if _latest.get(key) == token:
+                del _latest[key]
+
+
+def _run_latest(key, token, func, *args):
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    name = getattr(func, "__name__", str(func))
+    try:
+        future = executor.submit(func, *args)
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        task_results.inc(name, "inline")
+        return func(*args)
+
+    with _latest_lock:
+        _running["waiting"] += 1
+    try:
+        while True:
+            try:
+                result = future.result(timeout=POLL_INTERVAL)
+                break
+            except TimeoutError:
+                if _latest.get(key) != token:
+                    future.cancel()
+                    task_results.inc(name, "superseded")
+                    raise PreventUpdate
+            except BrokenProcessPool:
+                _reset_executor(executor)
+                task_results.inc(name, "inline")
+                return func(*args)
+    finally:
+        with _latest_lock:
+            _running["waiting"] -= 1
+
+    if _latest.get(key) != token:
+        task_results.inc(name, "superseded")
+        raise PreventUpdate
+    task_results.inc(name, "completed")
+    return result
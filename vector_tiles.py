@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+from reprojection import WEB_MERCATOR, WGS84, to_crs, transform_xy
+
+TILE_EXTENT = 4096
+# Half circumference of the earth in Web Mercator meters
+MERCATOR_MAX = 20037508.342789244
+TILE_CACHE_DIR = "temp/tiles"
+# Below this zoom a tile covers most of the layer, a simplified copy of all geometries is kept for a few such zooms.
+# From this zoom on only the geometries of the tile are simplified.
+SIMPLIFIED_MAX_ZOOM = 10
+SIMPLIFIED_CACHE_SIZE = 3
+
+
+def tile_bounds(z, x, y):
+    # Web Mercator (EPSG:3857) bounds of a XYZ tile
+    size = 2 * MERCATOR_MAX / 2 ** z
+    minx = -MERCATOR_MAX + x * size
+    maxy = MERCATOR_MAX - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_for_bounds(lon_min, lat_min, lon_max, lat_max, zoom):
+    # XYZ tiles covering a WGS84 bounding box
+    def tile_xy(lon, lat):
+        n = 2 ** zoom
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+    x_min, y_min = tile_xy(lon_min, lat_max)
+    x_max, y_max = tile_xy(lon_max, lat_min)
+    return [(zoom, x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+class VectorTileLayer:
+    """
+    Serves a polygon dataset as Mapbox Vector Tiles, generated on demand and cached in memory and on disk.
+    Geometries are simplified to the tile resolution of each zoom level and clipped to the (buffered) tile.
+    Features are split into one tile layer per value of `layer_column` so that each can be styled separately.
+    """
+
+    def __init__(self, name, loader, layer_column, properties, max_zoom=16, cache_size=2048,
+                 cache_dir=TILE_CACHE_DIR):
+        self.name = name
+        self.loader = loader
+        self.layer_column = layer_column
+        self.properties = properties
+        self.max_zoom = max_zoom
+        self.cache_dir = os.path.join(cache_dir, name) if cache_dir else None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._simplified = OrderedDict()
+        self._lock = threading.Lock()
+        self._data = None
+
+    def layer_names(self, gdf):
+        return [f"{self.name}_{value}" for value in sorted(gdf[self.layer_column].unique())]
+
+    def _load(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    gdf = to_crs(self.loader(), WEB_MERCATOR)
+                    self._data = (gdf, gdf.sindex)
+        return self._data
+
+    def _geometries(self, z, idx):
+        # Geometries idx simplified to the resolution of a tile pixel at zoom z
+        gdf, _ = self._load()
+        tolerance = 2 * MERCATOR_MAX / 2 ** z / TILE_EXTENT
+        if z >= SIMPLIFIED_MAX_ZOOM:
+            return shapely.simplify(gdf.geometry.values[idx], tolerance, preserve_topology=True)
+        with self._lock:
+            simplified = self._simplified.get(z)
+            if simplified is not None:
+                self._simplified.move_to_end(z)
+        if simplified is None:
+            simplified = shapely.simplify(gdf.geometry.values, tolerance, preserve_topology=True)
+            with self._lock:
+                self._simplified[z] = simplified
+                if len(self._simplified) > SIMPLIFIED_CACHE_SIZE:
+                    self._simplified.popitem(last=False)
+        return simplified[idx]
+
+    def get_tile(self, z, x, y):
+        key = (z, x, y)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        tile = self._read_cached_file(key)
+        if tile is None:
+            tile = self._encode_tile(z, x, y)
+            self._write_cached_file(key, tile)
+
+        with self._lock:
+            self._cache[key] = tile
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tile
+
+    def _encode_tile(self, z, x, y):
+        import mapbox_vector_tile
+
+        gdf, sindex = self._load()
+        bounds = tile_bounds(z, x, y)
+        # clip with a buffer of 64 pixels so that polygon edges are not drawn along the tile borders
+        buffer = (bounds[2] - bounds[0]) / TILE_EXTENT * 64
+        clip_box = (bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer)
+        idx = sindex.query(shapely.box(*clip_box), predicate="intersects")
+        if len(idx) == 0:
+            return b""
+
+        geometries = shapely.clip_by_rect(self._geometries(min(z, self.max_zoom), idx), *clip_box)
+        rows = gdf.iloc[idx]
+        layers = {}
+        for geometry, (_, row) in zip(geometries, rows.iterrows()):
+            if geometry is None or geometry.is_empty:
+                continue
+            layer = layers.setdefault(f"{self.name}_{row[self.layer_column]}", [])
+            layer.append({"geometry": geometry,
+                          "properties": {p: _property_value(row[p]) for p in self.properties}})
+        if not layers:
+            return b""
+        return mapbox_vector_tile.encode(
+            [{"name": name, "features": features} for name, features in layers.items()],
+            default_options={"quantize_bounds": bounds, "extents": TILE_EXTENT})
+
+    def _tile_path(self, key):
+        z, x, y = key
+        return os.path.join(self.cache_dir, str(z), str(x), f"{y}.pbf")
+
+    def _read_cached_file(self, key):
+        if not self.cache_dir or not os.path.exists(self._tile_path(key)):
+            return None
+        with open(self._tile_path(key), "rb") as f:
+            return f.read()
+
+    def _write_cached_file(self, key, tile):
+        if not self.cache_dir:
+            return
+        path = self._tile_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that concurrent readers never see a partial tile
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(tile)
+        os.replace(tmp_path, path)
+
+    def pregenerate(self, min_zoom, max_zoom):
+        gdf, _ = self._load()
+        x_min, y_min, x_max, y_max = gdf.total_bounds
+        (lon_min, lon_max), (lat_min, lat_max) = transform_xy([x_min, x_max], [y_min, y_max], WEB_MERCATOR, WGS84)
+        count = 0
+        for zoom in range(min_zoom, max_zoom + 1):
+            for z, x, y in tiles_for_bounds(lon_min, lat_min, lon_max, lat_max, zoom):
+                self.get_tile(z, x, y)
+                count += 1
+            print(f"Generated tiles up to zoom {zoom} ({count} tiles)")
+        return count
+
+
+def _property_value(value):
+    # MVT properties must be plain str, int, float or bool
+    if isinstance(value, np.generic):
+        return value.item()
+    return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+
+def _load_landscape_data():
+    from data_registry import registry
+    return registry.get("landschaft")
+
+
+landscape_tiles = VectorTileLayer("landschaft", _load_landscape_data, layer_column="TYP_NR",
+                                  properties=["OBJECT", "TYPNAME_DE", "REGNAME_DE"])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Pre-generate the landscape type vector tiles")
+    parser.add_argument("--min-zoom", type=int, default=5)
+    parser.add_argument("--max-zoom", type=int, default=11)
+    args = parser.parse_args()
+    landscape_tiles.pregenerate(args.min_zoom, args.max_zoom)